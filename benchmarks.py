@@ -0,0 +1,243 @@
+# benchmarks.py
+# ================================================
+# Medições do pipeline do Scanner de Opções com livros sintéticos
+# Projeto Phoenix
+# ================================================
+#
+# Uso:  python benchmarks.py [nome ...] [--contratos N]
+# Importa dashboards.scanner_opcoes, então precisa das mesmas variáveis
+# de ambiente do app (SUPABASE_URL, SUPABASE_KEY, ...).
+
+import argparse
+import time
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+
+from core.calendario_b3 import dias_uteis
+from core.precificacao import bs_price_greeks_vec
+
+
+def livro_sintetico(contratos: int = 100_000, strikes: int = 40, vencimentos: int = 6, seed: int = 0) -> pd.DataFrame:
+    """Cadeia no formato de _baixar_snapshot_oplab + contexto do ativo, preços de um smile BS."""
+    rng = np.random.default_rng(seed)
+    por_ativo = 2 * strikes * vencimentos
+    n_und = max(1, contratos // por_ativo)
+
+    und = np.repeat(np.arange(n_und), por_ativo)
+    venc = np.tile(np.repeat(np.arange(vencimentos), 2 * strikes), n_und)
+    k = np.tile(np.repeat(np.linspace(0.7, 1.3, strikes), 2), n_und * vencimentos)
+    is_call = np.tile([True, False], n_und * vencimentos * strikes)
+
+    S = rng.uniform(5, 150, n_und)[und]
+    K = np.round(S * k, 2)
+    hoje = pd.Timestamp.today().normalize()
+    dias = 10 + 30 * venc
+    T = np.clip(dias_uteis(hoje.date(), (hoje + pd.to_timedelta(dias, unit="D")).to_numpy()), 1, None) / 252
+    sigma = 0.30 + 0.20 * (k - 1) ** 2
+    preco = np.maximum(np.round(bs_price_greeks_vec(S, K, T, 0.149, sigma, is_call)[0], 2), 0.01)
+
+    nomes = np.array([f"ATV{i:03d}" for i in range(n_und)])
+    tipo = np.where(is_call, "CALL", "PUT")
+    return pd.DataFrame({
+        "symbol": [f"{u}{t[0]}{v}{kk:.2f}" for u, t, v, kk in zip(nomes[und], tipo, venc, K)],
+        "underlying_symbol": nomes[und],
+        "expiration": hoje + pd.to_timedelta(dias, unit="D"),
+        "type": tipo,
+        "strike": K,
+        "bid": np.maximum(preco - 0.02, 0.0),
+        "ask": preco + 0.02,
+        "last": np.where(rng.random(len(K)) > 0.2, preco, np.nan),
+        "close": preco,
+        "volume": rng.integers(0, 5000, len(K)).astype(float),
+        "open_interest": rng.integers(0, 50000, len(K)).astype(float),
+        "ref_price": S,
+        "volume_fin_acao": rng.uniform(1e7, 1e9, n_und)[und],
+        "volfin_ma_acao": rng.uniform(1e7, 1e9, n_und)[und],
+    })
+
+
+def _pico(fn, *args, **kwargs):
+    tracemalloc.start()
+    t0 = time.perf_counter()
+    out = fn(*args, **kwargs)
+    dt = time.perf_counter() - t0
+    _, pico = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return out, pico, dt
+
+
+# ===============================
+# MEMÓRIA DO LIVRO ENRIQUECIDO
+# ===============================
+
+def bench_memoria(contratos: int):
+    import dashboards.scanner_opcoes as so
+
+    raw = livro_sintetico(contratos)
+    n = len(raw)
+    print(f"Livro bruto: {n:,} contratos, {so.memoria_por_contrato(raw):,.0f} B/contrato")
+    for compacto in (False, True):
+        so.IV_CACHE.limpar()
+        book, pico, dt = _pico(so.add_features_and_iv, raw, None, 0.149, compacto=compacto)
+        print(
+            f"{'compacto' if compacto else 'completo':>9}: pico {pico / n:,.0f} B/contrato "
+            f"({pico / 2**20:,.1f} MiB), residente {so.memoria_por_contrato(book):,.0f} B/contrato, "
+            f"{len(book.columns)} colunas, {dt:.2f}s"
+        )
+
+
+# ===============================
+# ESTATÍSTICAS POR GRUPO (sem lambdas)
+# ===============================
+
+def _candles_sinteticos(n_und: int, dias: int = 180, seed: int = 0) -> pd.DataFrame:
+    rng = np.random.default_rng(seed)
+    datas = pd.bdate_range(end=pd.Timestamp.today().normalize(), periods=dias)
+    return pd.DataFrame({
+        "underlying_symbol": np.repeat([f"ATV{i:03d}" for i in range(n_und)], dias),
+        "date": np.tile(datas, n_und),
+        "close": rng.uniform(5, 150, n_und * dias),
+        "volume": rng.integers(10_000, 5_000_000, n_und * dias).astype(float),
+    })
+
+
+def _cronometrar(fn, repeticoes: int = 3) -> tuple[float, object]:
+    melhor, out = float("inf"), None
+    for _ in range(repeticoes):
+        t0 = time.perf_counter()
+        out = fn()
+        melhor = min(melhor, time.perf_counter() - t0)
+    return melhor, out
+
+
+def bench_agrupamentos(contratos: int):
+    import dashboards.scanner_opcoes as so
+
+    n_und, vencimentos = 500, 5
+    livro = livro_sintetico(contratos, strikes=max(1, contratos // (n_und * 2 * vencimentos)), vencimentos=vencimentos)
+    livro["iv_local_pct"] = np.random.default_rng(1).uniform(10, 80, len(livro))
+    livro["iv_status"] = so.IV_OK
+    candles = _candles_sinteticos(n_und)
+    print(f"{livro['underlying_symbol'].nunique()} ativos, {len(livro):,} contratos, {len(candles):,} candles")
+
+    # versões com lambda (como eram antes), para comparação
+    def volfin_ma_lambda():
+        d = candles.sort_values(["underlying_symbol", "date"])
+        vf = d["close"] * d["volume"]
+        return vf.groupby(d["underlying_symbol"]).transform(
+            lambda s: pd.Series(s).rolling(20, min_periods=1).mean().values)
+
+    def volfin_ma_nativo():
+        d = candles.sort_values(["underlying_symbol", "date"])
+        vf = d["close"] * d["volume"]
+        return vf.groupby(d["underlying_symbol"], sort=False).rolling(20, min_periods=1).mean().reset_index(level=0, drop=True)
+
+    def iv_pct_lambda():
+        return livro["iv_local_pct"].groupby([livro["underlying_symbol"], livro["expiration"]]).transform(
+            lambda s: 100 * s.rank(pct=True, method="average"))
+
+    def dte_lambda():
+        return (livro["expiration"].dt.date - pd.Timestamp.today().date()).apply(
+            lambda x: x.days if pd.notna(x) else np.nan)
+
+    def dte_nativo():
+        return (livro["expiration"].dt.normalize() - pd.Timestamp.today().normalize()).dt.days
+
+    casos = [
+        ("MM20 volume financeiro", volfin_ma_lambda, volfin_ma_nativo),
+        ("iv_pct_local", iv_pct_lambda, lambda: so._iv_pct_local(livro)),
+        ("dte_calendar", dte_lambda, dte_nativo),
+    ]
+    for nome, antes, depois in casos:
+        t_antes, a = _cronometrar(antes)
+        t_depois, b = _cronometrar(depois)
+        igual = np.allclose(np.asarray(a, dtype=float), np.asarray(b.reindex(a.index), dtype=float), equal_nan=True)
+        print(f"{nome:>24}: lambda {t_antes * 1e3:8.1f} ms  nativo {t_depois * 1e3:7.1f} ms  "
+              f"{t_antes / t_depois:5.1f}x  iguais={igual}")
+
+
+# ===============================
+# EXERCÍCIO AMERICANO COM DIVIDENDOS
+# ===============================
+
+def bench_americano(contratos: int):
+    from core.precificacao import implied_vol_vec
+    from core.precificacao_americana import implied_vol_americana, matriz_dividendos, preco_americano_vec
+
+    # cadeia cheia de um ativo: 12 vencimentos x 200 strikes x call/put
+    cadeia = livro_sintetico(min(contratos, 4_800), strikes=200, vencimentos=12)
+    hoje = pd.Timestamp.today().normalize()
+    agenda = {a: [((hoje + pd.Timedelta(days=d)).date(), 0.02 * s) for d in (25, 115, 205)]
+              for a, s in cadeia.groupby("underlying_symbol")["ref_price"].first().items()}
+    tau, valor = matriz_dividendos(cadeia["underlying_symbol"].to_numpy(), agenda)
+
+    S = cadeia["ref_price"].to_numpy(dtype=float)
+    K = cadeia["strike"].to_numpy(dtype=float)
+    T = np.clip(dias_uteis(hoje.date(), cadeia["expiration"].to_numpy()), 1, None) / 252
+    is_call = (cadeia["type"] == "CALL").to_numpy()
+    sigma = 0.30 + 0.20 * (K / S - 1) ** 2
+    # prêmios da própria árvore fina, para a IV americana ter solução
+    premio = np.maximum(np.round(preco_americano_vec(S, K, T, 0.149, sigma, is_call, tau, valor, 400)[0], 2), 0.01)
+    print(f"{len(S):,} contratos, {tau.shape[1]} proventos por ativo")
+
+    t_bs, _ = _cronometrar(lambda: bs_price_greeks_vec(S, K, T, 0.149, sigma, is_call))
+    t_eu, _ = _cronometrar(lambda: implied_vol_vec(S, K, T, 0.149, premio, is_call))
+    print(f"{'Black-Scholes':>24}: preço+gregas {t_bs * 1e3:7.1f} ms  IV {t_eu * 1e3:7.1f} ms")
+    for passos in (50, 100, 200):
+        t_am, _ = _cronometrar(lambda: preco_americano_vec(S, K, T, 0.149, sigma, is_call, tau, valor, passos))
+        t_iv, (iv, status) = _cronometrar(
+            lambda: implied_vol_americana(S, K, T, 0.149, premio, is_call, tau, valor, passos=passos), 1)
+        print(f"{f'árvore {passos} passos':>24}: preço {t_am * 1e3:7.1f} ms  IV {t_iv * 1e3:7.1f} ms  "
+              f"resolvidas {np.mean(status == 0):.0%}  preço < 1 s: {'sim' if t_am < 1 else 'NÃO'}")
+
+
+# ===============================
+# TRAVAS VERTICAIS
+# ===============================
+
+def bench_spreads(contratos: int):
+    import dashboards.scanner_opcoes as so
+
+    book = so.add_features_and_iv(livro_sintetico(min(contratos, 20_000)), None, 0.149)
+    hoje = pd.Timestamp.today().normalize()
+    filtros = dict(
+        tipo_opcao="", venc_ini=hoje, venc_fim=hoje + pd.Timedelta(days=365), delta_min=0.0, delta_max=1.0,
+        iv_pct_max=100.0, min_volume_opt=0.0, max_spread_rel=5.0, exigir_vol_acima=False,
+        iv_rank_max=100.0, excluir_arbitragem=False,
+    )
+    t_busca, sp = _cronometrar(lambda: so.buscar_spreads(book, filtros), 1)
+    print(f"{len(book):,} contratos, {len(sp):,} travas, busca {t_busca * 1e3:.0f} ms")
+
+    scores = []
+    for bonus in (False, True):
+        top = so.visao_spreads(book, {**filtros, "exigir_vol_acima": bonus}, top_n=len(sp))
+        scores.append(top.sort_values(["compra", "venda"])["score"].to_numpy())
+    muda = len(scores[0]) == len(scores[1]) and not np.allclose(scores[0], scores[1])
+    print(f"bônus de volume muda o score das travas: {'sim' if muda else 'NÃO'}")
+
+
+BENCHMARKS = {
+    "memoria": bench_memoria,
+    "agrupamentos": bench_agrupamentos,
+    "americano": bench_americano,
+    "spreads": bench_spreads,
+}
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Benchmarks do Scanner de Opções.")
+    ap.add_argument("nomes", nargs="*", help=f"um ou mais de: {', '.join(BENCHMARKS)} (padrão: todos)")
+    ap.add_argument("--contratos", type=int, default=100_000)
+    args = ap.parse_args()
+    desconhecidos = set(args.nomes) - set(BENCHMARKS)
+    if desconhecidos:
+        ap.error(f"benchmark desconhecido: {', '.join(sorted(desconhecidos))}")
+    for nome in args.nomes or list(BENCHMARKS):
+        print(f"== {nome}")
+        BENCHMARKS[nome](args.contratos)
+
+
+if __name__ == "__main__":
+    main()
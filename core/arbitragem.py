@@ -0,0 +1,125 @@
+# core/arbitragem.py
+# ================================================
+# Validação de não-arbitragem das cadeias de opções, vetorizada
+# Projeto Phoenix
+# ================================================
+#
+# Sem dependência de Streamlit. Só entram contratos com bid e ask. As
+# checagens usam bid/ask (e não o meio), então só acusam o que daria para
+# travar de fato com as cotações mostradas, além da tolerância:
+#   - paridade put-call no mesmo strike e vencimento (C - P = S - VP(div) - K·e^(-rT));
+#     com call americana só vale o lado C - P >= S - VP(div) - K·e^(-rT), pois o
+#     exercício antecipado pode pôr a call acima da europeia;
+#   - monotonia em strike (call não sobe, put não desce com K);
+#   - convexidade em strike (borboleta de três strikes vizinhos);
+#   - calendário (call do vencimento mais longo não vale menos, mesmo K, a
+#     menos dos proventos entre os vencimentos quando a call é europeia).
+# Cada checagem ordena a cadeia uma vez (np.lexsort) e compara vizinhos
+# com fatias deslocadas do vetor ordenado — nada de laço por par.
+# Resultado: bitmask int8 por contrato com as constantes ARB_*.
+
+import numpy as np
+
+ARB_PARIDADE = 1
+ARB_MONOTONIA = 2
+ARB_BORBOLETA = 4
+ARB_CALENDARIO = 8
+NOMES_ARB = {
+    ARB_PARIDADE: "paridade put-call",
+    ARB_MONOTONIA: "monotonia em strike",
+    ARB_BORBOLETA: "borboleta",
+    ARB_CALENDARIO: "calendário",
+}
+
+TOL_ARB = 0.02              # R$ (dois ticks) em todas as checagens
+TOL_PARIDADE_REL = 0.005    # + fração do spot na paridade (dividendos, aluguel, spot defasado)
+
+
+def _vizinhos(ordem, *chaves):
+    """Pares consecutivos (a, b) de `ordem` com as mesmas chaves."""
+    a, b = ordem[:-1], ordem[1:]
+    mesmo = np.ones(len(a), dtype=bool)
+    for c in chaves:
+        mesmo &= c[a] == c[b]
+    return a[mesmo], b[mesmo]
+
+
+def flags_arbitragem(grupo, venc, K, is_call, bid, ask, S, T, r, vp_div=None, call_americana=None,
+                     tol: float = TOL_ARB, tol_paridade_rel: float = TOL_PARIDADE_REL) -> np.ndarray:
+    """
+    Bitmask ARB_* por contrato. grupo: código inteiro do subjacente; venc:
+    vencimento (datetime64 ou inteiro ordenável); demais como no pricer.
+    vp_div: VP dos dividendos até o vencimento de cada linha (padrão 0);
+    call_americana: linhas cuja call tem exercício antecipado (padrão nenhuma).
+    Numa violação entre dois contratos os dois são marcados; na borboleta,
+    só o strike do meio.
+    """
+    K, bid, ask, S, T, r = (np.asarray(x, dtype=float) for x in (K, bid, ask, S, T, r))
+    vp_div = np.zeros(len(K)) if vp_div is None else np.nan_to_num(np.asarray(vp_div, dtype=float))
+    americana = np.zeros(len(K), dtype=bool) if call_americana is None else np.asarray(call_americana, dtype=bool)
+    grupo = np.asarray(grupo)
+    venc = np.asarray(venc)
+    tem_venc = np.ones(len(K), dtype=bool)
+    if venc.dtype.kind == "M":
+        venc = venc.astype("datetime64[D]")
+        tem_venc = ~np.isnat(venc)
+        venc = venc.astype(np.int64)
+    cp = np.asarray(is_call, dtype=bool).astype(np.int8)
+    flags = np.zeros(len(K), dtype=np.int8)
+
+    ok = tem_venc & (bid > 0) & (ask >= bid) & (K > 0)
+    idx = np.flatnonzero(ok)
+    if idx.size < 2:
+        return flags
+
+    # strikes vizinhos dentro de (ativo, vencimento, tipo)
+    ordem = idx[np.lexsort((K[idx], cp[idx], venc[idx], grupo[idx]))]
+    a, b = _vizinhos(ordem, grupo, venc, cp)
+    sobe = K[b] > K[a]
+    a, b = a[sobe], b[sobe]
+    call = cp[a] == 1
+    maior = np.where(call, a, b)            # o que deve valer mais: call de K menor, put de K maior
+    menor = np.where(call, b, a)
+    viola = ask[maior] + tol < bid[menor]
+    flags[maior[viola]] |= ARB_MONOTONIA
+    flags[menor[viola]] |= ARB_MONOTONIA
+
+    # trincas (a, b, c) consecutivas: b - a e c - b pares válidos e encadeados
+    if len(a) >= 2:
+        encadeado = b[:-1] == a[1:]
+        i, j, k = a[:-1][encadeado], b[:-1][encadeado], b[1:][encadeado]
+        w = (K[k] - K[j]) / (K[k] - K[i])
+        viola = bid[j] > w * ask[i] + (1 - w) * ask[k] + tol
+        flags[j[viola]] |= ARB_BORBOLETA
+
+    # put e call do mesmo (ativo, vencimento, strike): put antes da call na ordenação
+    ordem = idx[np.lexsort((cp[idx], K[idx], venc[idx], grupo[idx]))]
+    p, c = _vizinhos(ordem, grupo, venc, K)
+    par = (cp[p] == 0) & (cp[c] == 1)
+    p, c = p[par], c[par]
+    with np.errstate(invalid="ignore", over="ignore"):
+        fwd = S[c] - vp_div[c] - K[c] * np.exp(-r[c] * T[c])
+        tol_p = tol + tol_paridade_rel * np.nan_to_num(S[c])
+        viola = ((bid[c] - ask[p] > fwd + tol_p) & ~americana[c]) | (ask[c] - bid[p] < fwd - tol_p)
+    flags[p[viola]] |= ARB_PARIDADE
+    flags[c[viola]] |= ARB_PARIDADE
+
+    # calls do mesmo (ativo, strike) em vencimentos vizinhos. Só calls: put
+    # europeia com r > 0 pode valer menos no vencimento mais longo.
+    idx_c = idx[cp[idx] == 1]
+    ordem = idx_c[np.lexsort((venc[idx_c], K[idx_c], grupo[idx_c]))]
+    a, b = _vizinhos(ordem, grupo, K)
+    depois = venc[b] > venc[a]
+    a, b = a[depois], b[depois]
+    # call europeia perde para a mais curta até o VP dos proventos entre os dois vencimentos
+    folga = np.where(americana[b], 0.0, np.maximum(vp_div[b] - vp_div[a], 0.0))
+    viola = ask[b] + tol + folga < bid[a]
+    flags[a[viola]] |= ARB_CALENDARIO
+    flags[b[viola]] |= ARB_CALENDARIO
+    return flags
+
+
+def contar_flags(flags) -> dict[str, int]:
+    """Contratos marcados por checagem (um contrato pode cair em mais de uma)."""
+    flags = np.asarray(flags, dtype=np.int8)
+    return {nome: int(((flags & bit) != 0).sum()) for bit, nome in NOMES_ARB.items()}
@@ -0,0 +1,101 @@
+# core/calendario_b3.py
+# ================================================
+# Calendário de pregões da B3 (feriados, dias úteis, vencimentos)
+# Projeto Phoenix
+# ================================================
+#
+# Sem dependência de Streamlit. A tabela de feriados é gerada pelas
+# regras (fixos + móveis da Páscoa) para ANO_INI..ANO_FIM e montada uma
+# vez por processo num np.busdaycalendar.
+
+from datetime import date, timedelta
+from functools import lru_cache
+
+import numpy as np
+
+ANO_INI = 2000
+ANO_FIM = 2060
+
+# dia/mês sem pregão todo ano (inclui 24/12 e 31/12, sem negociação na B3)
+_FIXOS = [(1, 1), (4, 21), (5, 1), (9, 7), (10, 12), (11, 2), (11, 15), (12, 24), (12, 25), (12, 31)]
+# feriados de São Paulo em que a B3 fechava até 2021
+_FIXOS_SP_ATE_2021 = [(1, 25), (7, 9), (11, 20)]
+
+
+def pascoa(ano: int) -> date:
+    """Domingo de Páscoa (algoritmo de Meeus/Jones/Butcher, calendário gregoriano)."""
+    a, b, c = ano % 19, ano // 100, ano % 100
+    d, e = b // 4, b % 4
+    f = (b + 8) // 25
+    g = (b - f + 1) // 3
+    h = (19 * a + b - d - g + 15) % 30
+    i, k = c // 4, c % 4
+    l = (32 + 2 * e + 2 * i - h - k) % 7
+    m = (a + 11 * h + 22 * l) // 451
+    mes = (h + l - 7 * m + 114) // 31
+    dia = (h + l - 7 * m + 114) % 31 + 1
+    return date(ano, mes, dia)
+
+
+def feriados_ano(ano: int) -> list[date]:
+    p = pascoa(ano)
+    dias = [date(ano, m, d) for m, d in _FIXOS]
+    dias += [p - timedelta(days=48), p - timedelta(days=47), p - timedelta(days=2), p + timedelta(days=60)]
+    if ano <= 2021:
+        dias += [date(ano, m, d) for m, d in _FIXOS_SP_ATE_2021]
+    elif ano >= 2024:
+        dias.append(date(ano, 11, 20))          # Consciência Negra, feriado nacional (Lei 14.759/2023)
+    return sorted(set(dias))
+
+
+@lru_cache(maxsize=1)
+def feriados() -> np.ndarray:
+    """Todos os feriados de ANO_INI..ANO_FIM como datetime64[D] ordenado."""
+    return np.array(
+        [d for ano in range(ANO_INI, ANO_FIM + 1) for d in feriados_ano(ano)],
+        dtype="datetime64[D]",
+    )
+
+
+@lru_cache(maxsize=1)
+def calendario() -> np.busdaycalendar:
+    return np.busdaycalendar(weekmask="1111100", holidays=feriados())
+
+
+def _dias(x) -> np.ndarray:
+    return np.atleast_1d(np.asarray(x, dtype="datetime64[D]"))
+
+
+def dias_uteis(inicio, fim) -> np.ndarray:
+    """
+    Pregões em (inicio, fim] — vencendo amanhã = 1, hoje = 0 — para arrays
+    de datas (broadcast). NaT vira NaN.
+    """
+    ini, fi = np.broadcast_arrays(_dias(inicio), _dias(fim))
+    out = np.full(ini.shape, np.nan)
+    ok = ~(np.isnat(ini) | np.isnat(fi))
+    out[ok] = np.busday_count(ini[ok] + 1, fi[ok] + 1, busdaycal=calendario())
+    return out
+
+
+def eh_dia_util(x) -> np.ndarray:
+    return np.is_busday(_dias(x), busdaycal=calendario())
+
+
+@lru_cache(maxsize=1)
+def vencimentos_mensais() -> np.ndarray:
+    """
+    Vencimento mensal de opções sobre ações de ANO_INI..ANO_FIM: terceira
+    sexta-feira do mês, antecipado para o pregão anterior se não houver pregão.
+    """
+    meses = np.arange(f"{ANO_INI}-01", f"{ANO_FIM + 1}-01", dtype="datetime64[M]")
+    sextas = np.busday_offset(meses.astype("datetime64[D]"), 2, roll="forward", weekmask="Fri")
+    return np.busday_offset(sextas, 0, roll="backward", busdaycal=calendario())
+
+
+def proximo_vencimento(base: date | None = None) -> date:
+    """Primeiro vencimento mensal em ou depois de `base` (hoje por padrão)."""
+    base = np.datetime64(base or date.today(), "D")
+    venc = vencimentos_mensais()
+    i = int(np.searchsorted(venc, base, side="left"))
+    return venc[min(i, len(venc) - 1)].astype(date)
@@ -0,0 +1,178 @@
+# core/curva_di.py
+# ================================================
+# Estrutura a termo de juros (curva DI) para a precificação das opções
+# Projeto Phoenix
+# ================================================
+#
+# Sem dependência de Streamlit. A curva de um dia é um arquivo local
+# data/curva_di/AAAA-MM-DD.csv com uma linha por vértice do DI futuro:
+#   vencimento; taxa
+# vencimento em AAAA-MM-DD ou pelo código do contrato (DI1F27 = 1º pregão de
+# jan/2027) e taxa em % a.a., base 252 (convenção do DI). Entre vértices a
+# interpolação é flat-forward (log do fator de desconto linear em dias
+# úteis); antes do primeiro vértice vale a taxa dele e depois do último a
+# última taxa a termo. Para o pricer a taxa sai contínua: r = ln(1 + taxa),
+# de forma que e^(-rT) com T = pregões/252 é o desconto do DI.
+# As taxas por vencimento ficam em cache por (curva, dia).
+
+import threading
+from datetime import date
+
+import numpy as np
+
+from core.calendario_b3 import calendario, dias_uteis
+from core.utils import data_dir
+
+_MESES_DI = {c: m for m, c in enumerate("FGHJKMNQUVXZ", start=1)}
+
+_CURVAS: dict[tuple, dict] = {}
+_TAXAS: dict[tuple, dict[int, float]] = {}
+_CURVAS_LOCK = threading.Lock()
+
+
+def _pasta():
+    p = data_dir() / "curva_di"
+    p.mkdir(exist_ok=True)
+    return p
+
+
+def _vencimento_di(codigo: str) -> date:
+    """DI1F27 / F27 -> primeiro pregão do mês do contrato."""
+    c = codigo.strip().upper().removeprefix("DI1")
+    if len(c) != 3 or c[0] not in _MESES_DI or not c[1:].isdigit():
+        raise ValueError(codigo)
+    inicio = np.datetime64(f"20{c[1:]}-{_MESES_DI[c[0]]:02d}-01", "D")
+    return np.busday_offset(inicio, 0, roll="forward", busdaycal=calendario()).astype(date)
+
+
+# ===============================
+# LEITURA
+# ===============================
+
+def ler_curva(texto: str, data_curva: date) -> dict:
+    """
+    Vértices 'vencimento; taxa %' (separador ';' ou ','; linhas vazias, # e um
+    cabeçalho não numérico são ignorados). Levanta ValueError apontando a linha
+    inválida. Retorna {"data", "du", "taxa"} com du crescente e taxa em fração.
+    """
+    vertices = {}
+    for n, linha in enumerate((texto or "").splitlines(), start=1):
+        linha = linha.strip()
+        if not linha or linha.startswith("#"):
+            continue
+        partes = [p.strip() for p in linha.replace(",", ";").split(";")]
+        try:
+            venc, taxa = partes
+            venc = date.fromisoformat(venc) if venc[:1].isdigit() else _vencimento_di(venc)
+            vertices[venc] = float(taxa) / 100.0
+        except ValueError:
+            if n == 1 and not any(ch.isdigit() for ch in linha):
+                continue
+            raise ValueError(f"Linha {n} da curva DI inválida: {linha!r}") from None
+
+    vencs = np.array(sorted(v for v in vertices if v > data_curva), dtype="datetime64[D]")
+    if len(vencs) == 0:
+        raise ValueError(f"Curva DI de {data_curva} sem vértices após a data da curva.")
+    du = dias_uteis(data_curva, vencs).astype(float)
+    taxa = np.array([vertices[v] for v in vencs.astype(date)])
+    # vencimentos no mesmo pregão ficam com o último
+    du, idx = np.unique(du[::-1], return_index=True)
+    return {"data": data_curva, "du": du, "taxa": taxa[::-1][idx]}
+
+
+def datas_disponiveis() -> list[date]:
+    """Datas das curvas gravadas em data/curva_di, da mais recente para a mais antiga."""
+    datas = []
+    for p in _pasta().glob("*.csv"):
+        try:
+            datas.append(date.fromisoformat(p.stem))
+        except ValueError:
+            continue
+    return sorted(datas, reverse=True)
+
+
+def carregar_curva(data_curva: date | None = None) -> dict | None:
+    """
+    Curva gravada para `data_curva` (padrão: a mais recente até hoje). None se
+    não houver arquivo. O resultado traz "chave" (data, mtime, tamanho), que
+    identifica a curva nos caches do scanner.
+    """
+    if data_curva is None:
+        datas = [d for d in datas_disponiveis() if d <= date.today()]
+        if not datas:
+            return None
+        data_curva = datas[0]
+    caminho = _pasta() / f"{data_curva.isoformat()}.csv"
+    try:
+        st = caminho.stat()
+    except FileNotFoundError:
+        return None
+    chave = (data_curva.isoformat(), st.st_mtime_ns, st.st_size)
+    with _CURVAS_LOCK:
+        curva = _CURVAS.get(chave)
+    if curva is None:
+        curva = ler_curva(caminho.read_text(encoding="utf-8"), data_curva)
+        curva["chave"] = chave
+        with _CURVAS_LOCK:
+            _CURVAS[chave] = curva
+    return curva
+
+
+def gravar_curva(texto: str, data_curva: date) -> dict:
+    """Valida (ler_curva) e grava a curva do dia em data/curva_di. Retorna a curva carregada."""
+    ler_curva(texto, data_curva)
+    (_pasta() / f"{data_curva.isoformat()}.csv").write_text(texto, encoding="utf-8")
+    return carregar_curva(data_curva)
+
+
+# ===============================
+# INTERPOLAÇÃO
+# ===============================
+
+def _log_fator(curva: dict, du) -> np.ndarray:
+    """ln do fator de capitalização do DI em `du` pregões, linear entre vértices (flat-forward)."""
+    du = np.asarray(du, dtype=float)
+    x = curva["du"]
+    lf = x / 252.0 * np.log1p(curva["taxa"])
+    out = np.interp(du, x, lf)
+    out = np.where(du < x[0], lf[0] / x[0] * du, out)
+    fwd_fim = (lf[-1] - lf[-2]) / (x[-1] - x[-2]) if len(x) > 1 else lf[0] / x[0]
+    return np.where(du > x[-1], lf[-1] + fwd_fim * (du - x[-1]), out)
+
+
+def taxa_flat_forward(curva: dict, du) -> np.ndarray:
+    """Taxa DI (fração a.a., base 252) em `du` pregões a partir da data da curva."""
+    du = np.maximum(np.asarray(du, dtype=float), 1.0)
+    return np.expm1(_log_fator(curva, du) * 252.0 / du)
+
+
+def taxas_continuas(curva: dict, vencimentos, hoje: date | None = None) -> np.ndarray:
+    """
+    r contínuo por linha de hoje até cada vencimento: a taxa a termo da curva
+    entre hoje e o vencimento (igual à taxa do vértice quando a curva é de
+    hoje), como ln(1 + taxa). Cada vencimento distinto é interpolado uma vez
+    por (curva, dia) e o resultado é espalhado pelas linhas; NaN sem vencimento.
+    """
+    hoje = hoje or date.today()
+    dias = np.asarray(vencimentos, dtype="datetime64[D]")
+    unicos, inv = np.unique(dias.astype(np.int64), return_inverse=True)
+    chave = (curva["chave"], hoje) if "chave" in curva else None
+
+    with _CURVAS_LOCK:
+        conhecidas = dict(_TAXAS.get(chave, {})) if chave else {}
+    faltam = np.array([u for u in unicos.tolist() if u not in conhecidas], dtype=np.int64)
+    validos = faltam != np.datetime64("NaT").astype(np.int64)
+    if validos.any():
+        du_h = dias_uteis(curva["data"], hoje)[0]
+        du_v = np.maximum(dias_uteis(curva["data"], faltam[validos].astype("datetime64[D]")), du_h + 1)
+        lf = _log_fator(curva, du_v) - _log_fator(curva, du_h)
+        novas = np.full(len(faltam), np.nan)
+        novas[validos] = lf * 252.0 / (du_v - du_h)
+        conhecidas.update(zip(faltam.tolist(), novas.tolist()))
+        if chave:
+            with _CURVAS_LOCK:
+                for velha in [c for c in _TAXAS if c[1] != hoje]:
+                    del _TAXAS[velha]
+                _TAXAS.setdefault(chave, {}).update(conhecidas)
+    conhecidas.update({u: np.nan for u in faltam[~validos].tolist()})
+    return np.array([conhecidas[u] for u in unicos.tolist()], dtype=float)[inv].reshape(dias.shape)
@@ -0,0 +1,93 @@
+# core/exposicao_gama.py
+# ================================================
+# Exposição a gama dos dealers (GEX) por ativo, a partir do open interest
+# Projeto Phoenix
+# ================================================
+#
+# Sem dependência de Streamlit. Convenção usual de mercado: o dealer está
+# comprado nas calls e vendido nas puts do open interest, então
+#   GEX = (+1 call / -1 put) · Γ · OI · TAMANHO_CONTRATO · S² · 1%
+# em R$ de delta a ajustar por 1% de variação do ativo. O agregado por
+# (ativo, strike) sai de np.unique + np.bincount; o perfil avalia Γ de todos os
+# contratos numa grade de spots de uma vez (contratos x pontos, em blocos
+# para limitar a memória) e soma por ativo. O flip é onde o GEX total
+# troca de sinal, interpolado na grade, no cruzamento mais perto do spot.
+
+import numpy as np
+
+TAMANHO_CONTRATO = 100          # ações por opção (lote padrão da B3)
+GRADE_SPOT = np.linspace(0.80, 1.20, 81)     # múltiplos do spot no perfil
+BLOCO_LINHAS = 20_000
+
+
+def _gamma_bs(S, K, T, r, sigma) -> np.ndarray:
+    """Γ de Black-Scholes com broadcasting; 0 onde os insumos não servem."""
+    with np.errstate(divide="ignore", invalid="ignore", over="ignore"):
+        sT = sigma * np.sqrt(T)
+        d1 = (np.log(S / K) + (r + 0.5 * sigma * sigma) * T) / sT
+        g = np.exp(-0.5 * d1 * d1) / (np.sqrt(2 * np.pi) * S * sT)
+    return np.where(np.isfinite(g), g, 0.0)
+
+
+def gex_contratos(gamma, oi, S, is_call) -> np.ndarray:
+    """GEX de cada contrato (R$ por 1% do ativo) com o Γ dado; 0 sem Γ ou OI."""
+    sinal = np.where(np.asarray(is_call, dtype=bool), 1.0, -1.0)
+    S = np.asarray(S, dtype=float)
+    g = sinal * np.asarray(gamma, dtype=float) * np.asarray(oi, dtype=float) * TAMANHO_CONTRATO * S * S * 0.01
+    return np.where(np.isfinite(g), g, 0.0)
+
+
+def gex_por_strike(grupo, K, gex, is_call) -> tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    """(grupo, strike, GEX das calls, GEX das puts) por (grupo, strike) distinto, ordenado."""
+    chaves, inv = np.unique(
+        np.column_stack([np.asarray(grupo, dtype=float), np.asarray(K, dtype=float)]), axis=0, return_inverse=True
+    )
+    inv = inv.ravel()
+    gex = np.asarray(gex, dtype=float)
+    call = np.asarray(is_call, dtype=bool)
+    soma_call = np.bincount(inv, weights=np.where(call, gex, 0.0), minlength=len(chaves))
+    soma_put = np.bincount(inv, weights=np.where(call, 0.0, gex), minlength=len(chaves))
+    return chaves[:, 0].astype(np.int64), chaves[:, 1], soma_call, soma_put
+
+
+def perfil_gex(grupo, n_grupos: int, S, K, T, r, sigma, oi, is_call, grade=GRADE_SPOT):
+    """
+    GEX total de cada grupo com o ativo em S·grade. Retorna (spots, gex),
+    ambos n_grupos x len(grade); o spot de cada grupo é o da primeira linha dele.
+    """
+    grupo = np.asarray(grupo, dtype=np.int64)
+    S, K, T, r, sigma, oi = (np.asarray(x, dtype=float) for x in (S, K, T, r, sigma, oi))
+    is_call = np.asarray(is_call, dtype=bool)
+    grade = np.asarray(grade, dtype=float)
+
+    s0 = np.full(n_grupos, np.nan)
+    primeira = np.unique(grupo, return_index=True)[1]
+    s0[grupo[primeira]] = S[primeira]
+    spots = s0[:, None] * grade[None, :]
+
+    gex = np.zeros((n_grupos, len(grade)))
+    usa = np.flatnonzero((oi > 0) & (sigma > 0) & (T > 0) & (K > 0))
+    for ini in range(0, len(usa), BLOCO_LINHAS):
+        b = usa[ini:ini + BLOCO_LINHAS]
+        Sg = spots[grupo[b]]                                    # linhas x pontos
+        gam = _gamma_bs(Sg, K[b, None], T[b, None], r[b, None], sigma[b, None])
+        np.add.at(gex, grupo[b], gex_contratos(gam, oi[b, None], Sg, is_call[b, None]))
+    return spots, gex
+
+
+def nivel_flip(spots, gex, spot_atual) -> np.ndarray:
+    """
+    Spot em que o GEX total cruza zero, por grupo (interpolação linear entre
+    pontos da grade); com vários cruzamentos, o mais perto do spot atual. NaN sem cruzamento.
+    """
+    spots = np.asarray(spots, dtype=float)
+    gex = np.asarray(gex, dtype=float)
+    x1, x2 = spots[:, :-1], spots[:, 1:]
+    y1, y2 = gex[:, :-1], gex[:, 1:]
+    cruza = (np.sign(y1) * np.sign(y2) < 0) | ((y1 == 0) & (y2 != 0))
+    with np.errstate(divide="ignore", invalid="ignore"):
+        x0 = x1 - y1 * (x2 - x1) / (y2 - y1)
+    dist = np.where(cruza, np.abs(x0 - np.asarray(spot_atual, dtype=float)[:, None]), np.inf)
+    j = np.argmin(dist, axis=1)
+    linhas = np.arange(len(spots))
+    return np.where(np.isfinite(dist[linhas, j]), x0[linhas, j], np.nan)
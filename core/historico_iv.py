@@ -0,0 +1,227 @@
+# core/historico_iv.py
+# ================================================
+# Histórico diário de IV ATM e volatilidade realizada por ativo
+# Projeto Phoenix
+# ================================================
+#
+# Sem dependência de Streamlit. Cada ativo tem um arquivo binário só de
+# acréscimo (data/historico_iv/<ATIVO>.bin) com registros de tamanho fixo
+# (dia, IV ATM, vol realizada). Regravar o mesmo dia só acrescenta: na
+# leitura vale o último registro de cada dia. A janela de 252 pregões de
+# cada ativo fica ordenada em memória (invalidada pelo mtime do arquivo),
+# então IV rank e percentil saem de um searchsorted, O(log n).
+# Aqui também fica o cone de vol realizada (quantis por janela) dos candles.
+#
+# Quem grava é o job diário job_historico_iv.py (na raiz do projeto), que
+# depende do scanner para baixar e enriquecer as cadeias.
+
+import os
+import threading
+import warnings
+
+import numpy as np
+import pandas as pd
+
+from core.utils import CacheLRU, data_dir
+
+REGISTRO = np.dtype([("dia", "<i4"), ("iv_atm", "<f4"), ("hv", "<f4")])   # dia = dias desde 1970-01-01
+JANELA_RANK = 252
+MIN_HISTORICO = 60          # com menos pregões gravados, rank/percentil ficam NaN
+DTE_ATM = 21                # IV ATM gravada: vencimento constante de 21 pregões (~1 mês)
+JANELA_HV = 20
+JANELAS_CONE = (10, 20, 60, 120)
+QUANTIS_CONE = {"min": 0, "p10": 10, "p25": 25, "p50": 50, "p75": 75, "p90": 90, "max": 100}
+
+_JANELAS_MAX = 256          # ativos com janela em memória; além disso relê o arquivo
+_JANELAS = CacheLRU(_JANELAS_MAX)
+_ESCRITA_LOCK = threading.Lock()
+
+
+def _pasta() -> "os.PathLike":
+    p = data_dir() / "historico_iv"
+    p.mkdir(exist_ok=True)
+    return p
+
+
+def _arquivo(ativo: str):
+    return _pasta() / f"{str(ativo).upper()}.bin"
+
+
+def _dia(d) -> int:
+    return int(np.datetime64(d, "D").astype(np.int64))
+
+
+# ===============================
+# GRAVAÇÃO
+# ===============================
+
+def registrar(ativos, dia, iv_atm, hv) -> int:
+    """Acrescenta um registro (dia, IV ATM, vol realizada) por ativo. Retorna quantos gravou."""
+    ativos = [str(a).upper() for a in np.atleast_1d(ativos)]
+    iv_atm = np.broadcast_to(np.asarray(iv_atm, dtype=float), (len(ativos),))
+    hv = np.broadcast_to(np.asarray(hv, dtype=float), (len(ativos),))
+    n = 0
+    with _ESCRITA_LOCK:
+        for ativo, iv, h in zip(ativos, iv_atm, hv):
+            if not np.isfinite(iv) and not np.isfinite(h):
+                continue
+            reg = np.array([(_dia(dia), iv, h)], dtype=REGISTRO)
+            with open(_arquivo(ativo), "ab") as f:
+                f.write(reg.tobytes())
+            n += 1
+    return n
+
+
+# ===============================
+# LEITURA
+# ===============================
+
+def carregar(ativo: str) -> np.ndarray:
+    """Registros do ativo em ordem de dia, um por dia (o último gravado vence)."""
+    caminho = _arquivo(ativo)
+    if not caminho.exists():
+        return np.empty(0, dtype=REGISTRO)
+    regs = np.fromfile(caminho, dtype=REGISTRO)
+    # np.unique pega a primeira ocorrência: inverte para ficar com a última
+    _, idx = np.unique(regs["dia"][::-1], return_index=True)
+    return regs[::-1][idx]
+
+
+def _janela(ativo: str) -> tuple[np.ndarray, float]:
+    """
+    (IVs ATM válidas dos últimos JANELA_RANK registros, ordenadas; última IV
+    ATM gravada), com cache por mtime/tamanho do arquivo.
+    """
+    caminho = _arquivo(ativo)
+    try:
+        st = caminho.stat()
+        assinatura = (st.st_mtime_ns, st.st_size)
+    except FileNotFoundError:
+        return np.empty(0), np.nan
+    atual = _JANELAS.obter(ativo)
+    if atual is not None and atual[0] == assinatura:
+        return atual[1], atual[2]
+
+    iv = carregar(ativo)["iv_atm"][-JANELA_RANK:].astype(float)
+    janela = np.sort(iv[np.isfinite(iv)])
+    ultima = float(iv[-1]) if len(iv) else np.nan
+    _JANELAS.gravar(ativo, (assinatura, janela, ultima))
+    return janela, ultima
+
+
+def _janela_ordenada(ativo: str) -> np.ndarray:
+    """IVs ATM válidas dos últimos JANELA_RANK registros, ordenadas."""
+    return _janela(ativo)[0]
+
+
+def rank_percentil(ativos, iv) -> tuple[np.ndarray, np.ndarray]:
+    """
+    IV rank ((iv - mín) / (máx - mín)) e percentil (% de dias com IV abaixo)
+    de `iv` na janela de até 252 pregões de cada ativo, em %. NaN com menos
+    de MIN_HISTORICO pregões gravados.
+    """
+    ativos = [str(a).upper() for a in np.atleast_1d(ativos)]
+    iv = np.broadcast_to(np.asarray(iv, dtype=float), (len(ativos),))
+    rank = np.full(len(ativos), np.nan)
+    pct = np.full(len(ativos), np.nan)
+    for i, (ativo, v) in enumerate(zip(ativos, iv)):
+        janela = _janela_ordenada(ativo)
+        if len(janela) < MIN_HISTORICO or not np.isfinite(v):
+            continue
+        lo, hi = janela[0], janela[-1]
+        rank[i] = 100.0 * np.clip((v - lo) / (hi - lo), 0, 1) if hi > lo else 50.0
+        pct[i] = 100.0 * np.searchsorted(janela, v, side="left") / len(janela)
+    return rank, pct
+
+
+def ultimo_rank(ativos) -> pd.DataFrame:
+    """
+    Rank e percentil da última IV ATM gravada de cada ativo (o que o job diário
+    fechou), com iv_rank_pregoes = pregões na janela usada (até JANELA_RANK).
+    Só lê os arquivos que mudaram desde a última chamada.
+    """
+    ativos = [str(a).upper() for a in pd.unique(np.asarray(ativos, dtype=object))]
+    janelas = [_janela(ativo) for ativo in ativos]
+    ultima = np.array([u for _, u in janelas], dtype=float)
+    rank, pct = rank_percentil(ativos, ultima)
+    pregoes = np.array([len(j) for j, _ in janelas], dtype=float)
+    return pd.DataFrame({
+        "underlying_symbol": ativos,
+        "iv_rank": rank,
+        "iv_percentil": pct,
+        "iv_rank_pregoes": np.where(np.isfinite(rank), pregoes, np.nan),
+    })
+
+
+# ===============================
+# INSUMOS DO JOB
+# ===============================
+
+def iv_atm_constante(resumo: pd.DataFrame, dte: int = DTE_ATM) -> pd.Series:
+    """
+    IV ATM por ativo no vencimento constante de `dte` pregões, interpolando a
+    variância total entre os vencimentos vizinhos (fora deles, o mais próximo).
+    `resumo`: saída de resumo_superficie (iv_atm_pct em %). Devolve fração.
+    """
+    r = resumo.dropna(subset=["iv_atm_pct", "dte_bus"])
+    out = {}
+    for ativo, g in r.groupby("underlying_symbol", sort=False, observed=True):
+        g = g.sort_values("dte_bus")
+        t = g["dte_bus"].to_numpy(dtype=float)
+        var = (g["iv_atm_pct"].to_numpy(dtype=float) / 100.0) ** 2 * t
+        if dte <= t[0]:
+            out[ativo] = np.sqrt(var[0] / t[0])
+        elif dte >= t[-1]:
+            out[ativo] = np.sqrt(var[-1] / t[-1])
+        else:
+            out[ativo] = np.sqrt(np.interp(dte, t, var) / dte)
+    return pd.Series(out, dtype=float)
+
+
+def volatilidade_realizada(candles: pd.DataFrame, janela: int = JANELA_HV) -> pd.Series:
+    """Desvio-padrão anualizado (252) dos log-retornos dos últimos `janela` pregões, por ativo."""
+    d = candles[["underlying_symbol", "date", "close"]].copy()
+    d["date"] = pd.to_datetime(d["date"], errors="coerce")
+    d = d.sort_values(["underlying_symbol", "date"])
+    ret = np.log(pd.to_numeric(d["close"], errors="coerce")).groupby(d["underlying_symbol"], sort=False).diff()
+    ret = ret.groupby(d["underlying_symbol"], sort=False).tail(janela)
+    hv = ret.groupby(d["underlying_symbol"].loc[ret.index], sort=False).std()
+    return hv * np.sqrt(252)
+
+
+# ===============================
+# CONE DE VOLATILIDADE REALIZADA
+# ===============================
+
+def vol_realizada_janelas(close, janelas=JANELAS_CONE) -> np.ndarray:
+    """
+    Vol realizada anualizada móvel para todas as janelas de uma vez (W x n-1,
+    coluna i = janela que termina no retorno i). Somas móveis por diferença de
+    somas acumuladas de r e r²; NaN onde a janela ainda não cabe.
+    """
+    r = np.diff(np.log(np.asarray(close, dtype=float)))
+    r = np.where(np.isfinite(r), r, 0.0)
+    c1 = np.concatenate([[0.0], np.cumsum(r)])
+    c2 = np.concatenate([[0.0], np.cumsum(r * r)])
+    w = np.asarray(janelas, dtype=int)[:, None]
+    fim = np.arange(1, len(r) + 1)[None, :]
+    ini = fim - w
+    cabe = ini >= 0
+    ini = np.maximum(ini, 0)
+    s1 = c1[fim] - c1[ini]
+    s2 = c2[fim] - c2[ini]
+    var = np.maximum(s2 - s1 * s1 / w, 0.0) / (w - 1)
+    return np.where(cabe, np.sqrt(var * 252), np.nan)
+
+
+def cone_volatilidade(close, janelas=JANELAS_CONE) -> pd.DataFrame:
+    """Cone de vol realizada: quantis históricos e valor atual por janela (fração, índice = janela)."""
+    hv = vol_realizada_janelas(close, janelas)
+    if hv.shape[1] == 0:
+        hv = np.full((len(janelas), 1), np.nan)
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", RuntimeWarning)      # janela maior que o histórico: linha toda NaN
+        q = np.nanpercentile(hv, list(QUANTIS_CONE.values()), axis=1)
+    cone = pd.DataFrame(q.T, index=pd.Index(janelas, name="janela"), columns=list(QUANTIS_CONE))
+    cone["atual"] = hv[:, -1]
+    return cone
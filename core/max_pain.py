@@ -0,0 +1,70 @@
+# core/max_pain.py
+# ================================================
+# Max pain e perfil de open interest por (ativo, vencimento), em O(n log n)
+# Projeto Phoenix
+# ================================================
+#
+# Sem dependência de Streamlit. Max pain é o strike de liquidação que
+# minimiza o valor intrínseco total pago aos titulares do open interest:
+#   dor(X) = Σ_calls OI·max(X - K, 0) + Σ_puts OI·max(K - X, 0)
+# Avaliar dor(X) em cada strike somando a cadeia inteira seria O(strikes²)
+# por vencimento. Com os strikes ordenados dentro de cada grupo, as duas
+# somas saem de somas acumuladas de OI e de K·OI:
+#   calls até X:   X·ΣOI_c - Σ(K·OI_c)          (strikes <= X)
+#   puts acima:    Σ(K·OI_p) - X·ΣOI_p          (strikes >  X)
+# O custo fica na ordenação (np.lexsort); o resto é linear e sem laço por grupo.
+
+import numpy as np
+
+from core.exposicao_gama import TAMANHO_CONTRATO
+
+
+def _acumulado_no_grupo(x: np.ndarray, inicio: np.ndarray) -> np.ndarray:
+    """Soma acumulada de x reiniciada em cada posição de `inicio` (x já ordenado por grupo)."""
+    cs = np.cumsum(x)
+    base = np.concatenate([[0.0], cs])[inicio]
+    return cs - np.repeat(base, np.diff(np.append(inicio, len(x))))
+
+
+def perfil_oi(grupo, K, oi, is_call) -> dict[str, np.ndarray]:
+    """
+    OI de calls e puts por (grupo, strike) distinto, ordenado, e a dor (R$ pagos
+    aos titulares se o ativo liquidar naquele strike). grupo: código inteiro
+    >= 0 de ativo/vencimento. Retorna {"grupo", "strike", "oi_call", "oi_put", "dor"}.
+    """
+    oi = np.nan_to_num(np.asarray(oi, dtype=float))
+    call = np.asarray(is_call, dtype=bool)
+    grupo = np.asarray(grupo, dtype=np.int64)
+    K = np.asarray(K, dtype=float)
+    ordem = np.lexsort((K, grupo))
+    gs, ks = grupo[ordem], K[ordem]
+    novo = np.ones(len(gs), dtype=bool)
+    novo[1:] = (gs[1:] != gs[:-1]) | (ks[1:] != ks[:-1])
+    inv = np.empty(len(gs), dtype=np.int64)
+    inv[ordem] = np.cumsum(novo) - 1
+    g, k = gs[novo], ks[novo]
+    oi_c = np.bincount(inv, weights=np.where(call, oi, 0.0), minlength=len(g))
+    oi_p = np.bincount(inv, weights=np.where(call, 0.0, oi), minlength=len(g))
+
+    inicio = np.flatnonzero(np.r_[True, g[1:] != g[:-1]])
+    fim = np.append(inicio[1:], len(g)) - 1
+    n = np.diff(np.append(inicio, len(g)))
+
+    c_oi = _acumulado_no_grupo(oi_c, inicio)
+    c_koi = _acumulado_no_grupo(k * oi_c, inicio)
+    p_oi = _acumulado_no_grupo(oi_p, inicio)
+    p_koi = _acumulado_no_grupo(k * oi_p, inicio)
+    tot_p_oi = np.repeat(p_oi[fim], n)
+    tot_p_koi = np.repeat(p_koi[fim], n)
+
+    dor = (k * c_oi - c_koi) + (tot_p_koi - p_koi) - k * (tot_p_oi - p_oi)
+    return {"grupo": g, "strike": k, "oi_call": oi_c, "oi_put": oi_p, "dor": dor * TAMANHO_CONTRATO}
+
+
+def max_pain(grupo, strike, dor) -> tuple[np.ndarray, np.ndarray]:
+    """(grupo, strike de menor dor) por grupo; empate fica com o menor strike."""
+    grupo = np.asarray(grupo, dtype=np.int64)
+    ordem = np.lexsort((np.asarray(strike, dtype=float), np.asarray(dor, dtype=float), grupo))
+    g = grupo[ordem]
+    primeiro = ordem[np.r_[True, g[1:] != g[:-1]]]
+    return grupo[primeiro], np.asarray(strike, dtype=float)[primeiro]
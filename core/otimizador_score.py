@@ -0,0 +1,252 @@
+# core/otimizador_score.py
+# ================================================
+# Calibração dos pesos do Score de Oportunidade
+# Projeto Phoenix
+# ================================================
+#
+# Sem dependência de Streamlit. O scanner grava, no envio de cada
+# operação, os fatores normalizados do score naquele momento na própria
+# linha da operação no Supabase (coluna jsonb fatores_entrada da tabela
+# opcoes — um arquivo local se perderia a cada redeploy do app):
+#   alter table opcoes add column if not exists fatores_entrada jsonb;
+# Aqui eles são cruzados com o resultado das operações encerradas
+# (source=scanner) e os pesos são buscados em grade, em paralelo, com
+# validação fora da amostra em janelas cronológicas.
+#
+# Uso:  python -m core.otimizador_score --passo 0.05 --workers 4
+
+import argparse
+import multiprocessing as mp
+import os
+from concurrent.futures import ProcessPoolExecutor
+from itertools import product
+
+import numpy as np
+import pandas as pd
+from scipy.stats import rankdata
+
+from core.score import BONUS_VOLUME, COLS_FATORES, PESOS_SCORE
+
+BONUS_GRADE = (0.0, 0.125, 0.25, 0.5)
+COLUNA_FATORES = "fatores_entrada"
+
+
+# ===============================
+# REGISTRO NA ENTRADA
+# ===============================
+
+def _num(v):
+    try:
+        v = float(v)
+    except (TypeError, ValueError):
+        return None
+    return v if np.isfinite(v) else None
+
+
+def fatores_entrada(linha: dict, delta_target: float, pesos=PESOS_SCORE, bonus_ativo: bool = True) -> dict:
+    """
+    Fatores do score da opção enviada, para a coluna COLUNA_FATORES da
+    operação. bonus_ativo: o scanner aplicou o bônus de volume (só com
+    "exigir volume acima da MM20"); sem ele ratio_vol fica vazio e o otimizador
+    não atribui bônus a essa operação.
+    """
+    vol_fin = _num(linha.get("volume_fin_acao"))
+    vol_ma = _num(linha.get("volfin_ma_acao"))
+    ratio = vol_fin / vol_ma if bonus_ativo and vol_fin is not None and vol_ma else None
+    return {
+        "delta_target": float(delta_target),
+        "pesos": [float(p) for p in pesos],
+        **{c: _num(linha.get(c)) for c in COLS_FATORES},
+        **{c: _num(linha.get(c)) for c in ["iv_pct_local", "volume", "delta_abs", "spread_rel", "score"]},
+        "ratio_vol": ratio,
+    }
+
+
+def carregar_encerradas_scanner() -> pd.DataFrame:
+    """Operações encerradas geradas pelo scanner, com o retorno final e os fatores de entrada."""
+    import requests
+    import supabase_ops
+
+    r = requests.get(
+        supabase_ops.REST_ENDPOINT,
+        headers=supabase_ops.HEADERS,
+        params={
+            "select": f"id,symbol,created_at,preco_entrada,retorno_final_pct,{COLUNA_FATORES}",
+            "source": "eq.scanner",
+            "status": "eq.encerrada",
+            "indice": "eq.OPCOES",
+            "order": "created_at.asc",
+        },
+        timeout=30,
+    )
+    r.raise_for_status()
+    df = pd.DataFrame(r.json())
+    if df.empty:
+        return df
+    df["id"] = df["id"].astype(str)
+    df["created_at"] = pd.to_datetime(df["created_at"], errors="coerce", utc=True)
+    df["retorno_final_pct"] = pd.to_numeric(df["retorno_final_pct"], errors="coerce")
+    return df
+
+
+def montar_base(operacoes: pd.DataFrame) -> pd.DataFrame:
+    """Abre os fatores de entrada de cada operação encerrada, em ordem cronológica de entrada."""
+    if operacoes.empty or COLUNA_FATORES not in operacoes.columns:
+        return pd.DataFrame()
+    ops = operacoes[operacoes[COLUNA_FATORES].apply(isinstance, args=(dict,))].reset_index(drop=True)
+    if ops.empty:
+        return pd.DataFrame()
+    fatores = pd.json_normalize(ops[COLUNA_FATORES].tolist())
+    fatores = fatores.reindex(columns=COLS_FATORES + ["ratio_vol"]).apply(pd.to_numeric, errors="coerce")
+    base = pd.concat([ops.drop(columns=[COLUNA_FATORES]), fatores], axis=1)
+    base = base.dropna(subset=COLS_FATORES + ["retorno_final_pct"])
+    return base.sort_values("created_at", kind="mergesort").reset_index(drop=True)
+
+
+# ===============================
+# OBJETIVO VETORIZADO
+# ===============================
+
+def grade_pesos(passo: float = 0.05) -> np.ndarray:
+    """Todos os vetores de 4 pesos múltiplos de `passo` que somam 1 (m x 4)."""
+    n = int(round(1 / passo))
+    pontos = [(a, b, c, n - a - b - c) for a, b, c in product(range(n + 1), repeat=3) if a + b + c <= n]
+    return np.asarray(pontos, dtype=float) / n
+
+
+def spearman_pesos(F: np.ndarray, ratio: np.ndarray, ret: np.ndarray, W: np.ndarray, bonus: float) -> np.ndarray:
+    """
+    Correlação de Spearman entre score e retorno para cada linha de W de uma vez.
+    F: n x 4 fatores normalizados; ratio: volfin/MM20 (NaN = sem bônus); W: m x 4.
+    """
+    if len(ret) < 3:
+        return np.full(len(W), np.nan)
+    mult = 1.0 + bonus * (np.clip(np.nan_to_num(ratio, nan=1.0), 0.5, 2.0) - 1.0)
+    S = (F @ W.T) * mult[:, None]
+    rs = rankdata(S, axis=0)
+    rs -= rs.mean(axis=0)
+    rr = rankdata(ret)
+    rr -= rr.mean()
+    den = np.sqrt((rs * rs).sum(axis=0) * (rr @ rr))
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return np.where(den > 0, (rr @ rs) / den, np.nan)
+
+
+def janelas_walk_forward(n: int, n_folds: int = 4, min_treino: float = 0.4) -> list[tuple[slice, slice]]:
+    """Janelas crescentes: treina em [0, corte) e testa no bloco seguinte, sem olhar o futuro."""
+    inicio = int(n * min_treino)
+    cortes = np.linspace(inicio, n, n_folds + 1).astype(int)
+    return [(slice(0, a), slice(a, b)) for a, b in zip(cortes[:-1], cortes[1:]) if b - a >= 3 and a >= 3]
+
+
+_DADOS = {}
+
+
+def _init_worker(F, ratio, ret, janelas):
+    _DADOS.update(F=F, ratio=ratio, ret=ret, janelas=janelas)
+
+
+def _avaliar_bloco(args) -> tuple[np.ndarray, np.ndarray]:
+    """(treino, teste): Spearman por janela (linhas) e combinação do bloco (colunas)."""
+    W, bonus = args
+    F, ratio, ret = _DADOS["F"], _DADOS["ratio"], _DADOS["ret"]
+    treino, teste = [], []
+    for tr, te in _DADOS["janelas"]:
+        treino.append(spearman_pesos(F[tr], ratio[tr], ret[tr], W, bonus))
+        teste.append(spearman_pesos(F[te], ratio[te], ret[te], W, bonus))
+    return np.vstack(treino), np.vstack(teste)
+
+
+# ===============================
+# OTIMIZAÇÃO
+# ===============================
+
+def otimizar_pesos(
+    base: pd.DataFrame,
+    passo: float = 0.05,
+    bonus_grade=BONUS_GRADE,
+    n_folds: int = 4,
+    n_workers: int = 1,
+    top: int = 10,
+) -> tuple[pd.DataFrame, dict]:
+    """
+    Busca em grade (pesos no simplex x bônus de volume) maximizando o Spearman
+    médio de treino nas janelas walk-forward. Retorna (melhores combinações com
+    Spearman de treino e fora da amostra, resumo). O resumo traz o Spearman
+    fora da amostra de escolher, em cada janela, o melhor peso só pelo treino —
+    a estimativa honesta do ganho — e o do peso atual (PESOS_SCORE, BONUS_VOLUME).
+    """
+    F = base[COLS_FATORES].to_numpy(dtype=float)
+    ratio = base["ratio_vol"].to_numpy(dtype=float) if "ratio_vol" in base else np.full(len(base), np.nan)
+    ret = base["retorno_final_pct"].to_numpy(dtype=float)
+    janelas = janelas_walk_forward(len(base), n_folds)
+    if not janelas:
+        raise ValueError(f"Poucas operações ({len(base)}) para validar fora da amostra.")
+
+    W = grade_pesos(passo)
+    blocos = [(w, b) for b in bonus_grade for w in np.array_split(W, max(1, n_workers * 2))]
+
+    if n_workers > 1:
+        with ProcessPoolExecutor(
+            max_workers=n_workers,
+            mp_context=mp.get_context("spawn"),
+            initializer=_init_worker,
+            initargs=(F, ratio, ret, janelas),
+        ) as pool:
+            resultados = list(pool.map(_avaliar_bloco, blocos))
+    else:
+        _init_worker(F, ratio, ret, janelas)
+        resultados = [_avaliar_bloco(b) for b in blocos]
+
+    treino = np.hstack([r[0] for r in resultados])
+    teste = np.hstack([r[1] for r in resultados])
+    pesos = np.vstack([w for w, _ in blocos])
+    bonus = np.concatenate([np.full(len(w), b) for w, b in blocos])
+
+    media_treino = np.nanmean(treino, axis=0)
+    escolhidos = np.nanargmax(np.nan_to_num(treino, nan=-np.inf), axis=1)
+    oos_escolhido = teste[np.arange(len(janelas)), escolhidos]
+
+    _init_worker(F, ratio, ret, janelas)
+    tr_atual, te_atual = _avaliar_bloco((np.asarray([PESOS_SCORE]), BONUS_VOLUME))
+
+    ordem = np.argsort(-np.nan_to_num(media_treino, nan=-np.inf), kind="stable")[:top]
+    ranking = pd.DataFrame(pesos[ordem], columns=["peso_iv", "peso_volume", "peso_delta", "peso_spread"])
+    ranking["bonus_volume"] = bonus[ordem]
+    ranking["spearman_treino"] = media_treino[ordem]
+    ranking["spearman_fora_amostra"] = np.nanmean(teste[:, ordem], axis=0)
+
+    resumo = {
+        "operacoes": len(base),
+        "janelas": len(janelas),
+        "combinacoes": len(pesos),
+        "oos_selecao_walk_forward": float(np.nanmean(oos_escolhido)),
+        "atual_treino": float(np.nanmean(tr_atual)),
+        "atual_fora_amostra": float(np.nanmean(te_atual)),
+    }
+    return ranking, resumo
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Calibra os pesos do Score de Oportunidade do scanner.")
+    ap.add_argument("--passo", type=float, default=0.05, help="resolução da grade de pesos")
+    ap.add_argument("--folds", type=int, default=4, help="janelas walk-forward")
+    ap.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    ap.add_argument("--top", type=int, default=10)
+    args = ap.parse_args()
+
+    base = montar_base(carregar_encerradas_scanner())
+    if base.empty:
+        print("Nenhuma operação encerrada do scanner com fatores de entrada registrados.")
+        return
+
+    ranking, resumo = otimizar_pesos(base, args.passo, n_folds=args.folds, n_workers=args.workers, top=args.top)
+    print(f"{resumo['operacoes']} operações, {resumo['janelas']} janelas, {resumo['combinacoes']} combinações")
+    print(f"Pesos atuais {PESOS_SCORE} / bônus {BONUS_VOLUME}: "
+          f"Spearman treino {resumo['atual_treino']:.3f}, fora da amostra {resumo['atual_fora_amostra']:.3f}")
+    print(f"Seleção walk-forward (fora da amostra): {resumo['oos_selecao_walk_forward']:.3f}")
+    print(ranking.round(3).to_string(index=False))
+
+
+if __name__ == "__main__":
+    main()
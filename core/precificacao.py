@@ -0,0 +1,413 @@
+# core/precificacao.py
+# ================================================
+# Precificação Black-Scholes vetorizada (NumPy)
+# Projeto Phoenix
+# ================================================
+#
+# Sem dependência de Streamlit: pode ser importado por
+# workers, jobs offline e benchmarks.
+
+import multiprocessing as mp
+import threading
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+import numpy as np
+from scipy.special import ndtr
+
+_INV_SQRT_2PI = 1.0 / np.sqrt(2.0 * np.pi)
+
+
+def _npdf(x):
+    return _INV_SQRT_2PI * np.exp(-0.5 * x * x)
+
+
+def _as_arrays(*args):
+    return np.broadcast_arrays(*[np.atleast_1d(np.asarray(a, dtype=float)) for a in args])
+
+
+# ===============================
+# PREÇO + GREGAS (cadeia inteira)
+# ===============================
+
+def bs_price_greeks_vec(S, K, T, r, sigma, is_call):
+    """
+    Black-Scholes europeu sem dividendos para arrays inteiros.
+    Retorna (price, delta, gamma, vega, theta, rho) como arrays float64,
+    com NaN onde S, K, T ou sigma não forem positivos — mesmo contrato
+    da versão escalar linha a linha.
+    """
+    S, K, T, r, sigma = _as_arrays(S, K, T, r, sigma)
+    cp = np.where(np.broadcast_to(np.asarray(is_call, dtype=bool), S.shape), 1.0, -1.0)
+
+    ok = (S > 0) & (K > 0) & (T > 0) & (sigma > 0)
+    out = [np.full(S.shape, np.nan) for _ in range(6)]
+    if not ok.any():
+        return tuple(out)
+
+    S, K, T, r, sigma, cp = S[ok], K[ok], T[ok], r[ok], sigma[ok], cp[ok]
+
+    sqrtT = np.sqrt(T)
+    d1 = (np.log(S / K) + (r + 0.5 * sigma**2) * T) / (sigma * sqrtT)
+    d2 = d1 - sigma * sqrtT
+    disc = np.exp(-r * T)
+    pdf_d1 = _npdf(d1)
+    nd1 = ndtr(cp * d1)
+    nd2 = ndtr(cp * d2)
+
+    out[0][ok] = cp * (S * nd1 - K * disc * nd2)
+    out[1][ok] = cp * nd1
+    out[2][ok] = pdf_d1 / (S * sigma * sqrtT)
+    out[3][ok] = S * pdf_d1 * sqrtT
+    out[4][ok] = -(S * pdf_d1 * sigma) / (2 * sqrtT) - cp * r * K * disc * nd2
+    out[5][ok] = cp * K * T * disc * nd2
+    return tuple(out)
+
+
+def _bs_price_vega(S, K, T, r, sigma, cp):
+    """Só preço e vega — o que o solver de IV precisa por iteração."""
+    sqrtT = np.sqrt(T)
+    d1 = (np.log(S / K) + (r + 0.5 * sigma**2) * T) / (sigma * sqrtT)
+    d2 = d1 - sigma * sqrtT
+    price = cp * (S * ndtr(cp * d1) - K * np.exp(-r * T) * ndtr(cp * d2))
+    vega = S * _npdf(d1) * sqrtT
+    return price, vega
+
+
+# ===============================
+# VOLATILIDADE IMPLÍCITA (lote)
+# ===============================
+
+IV_MIN = 1e-3
+IV_MAX = 10.0
+
+# Status por linha devolvido por implied_vol_vec
+IV_OK = 0
+IV_CLAMP_INF = 1       # prêmio <= preço com IV_MIN (abaixo/no intrínseco)
+IV_CLAMP_SUP = 2       # prêmio >= preço com IV_MAX (no teto de não-arbitragem)
+IV_NAO_CONVERGIU = 3
+IV_INVALIDO = 4        # S, K, T, r ou prêmio ausente / não positivo
+
+
+def _iv_chute_inicial(S, K, T, r, premium, cp):
+    """Chute racional de Corrado-Miller (put convertida via paridade)."""
+    X = K * np.exp(-r * T)
+    call = np.where(cp > 0, premium, premium + S - X)
+    a = call - 0.5 * (S - X)
+    raiz = np.sqrt(np.maximum(a * a - (S - X) ** 2 / np.pi, 0.0))
+    sig = np.sqrt(2.0 * np.pi) / (S + X) * (a + raiz) / np.sqrt(T)
+    # Brenner-Subrahmanyam quando Corrado-Miller degenera
+    bs = np.sqrt(2.0 * np.pi / T) * call / S
+    sig = np.where(np.isfinite(sig) & (sig > 0), sig, bs)
+    return np.clip(np.nan_to_num(sig, nan=0.3), IV_MIN, IV_MAX)
+
+
+def implied_vol_vec(S, K, T, r, premium, is_call, sigma0=None, tol=1e-10, maxiter=100):
+    """
+    IV de Black-Scholes para arrays inteiros.
+    Newton com intervalo [IV_MIN, IV_MAX] mantido a cada passo; quando o passo
+    de Newton sai do intervalo ou estagna (vega ~ 0 em opções muito ITM/OTM) cai
+    para bissecção.
+    Prêmios fora da faixa alcançável são presos nos limites e sinalizados.
+    `tol` é relativa ao prêmio. `sigma0` (opcional, NaN = sem chute) substitui o
+    chute de Corrado-Miller — usado no warm start do cache de IV.
+    Retorna (iv, status) — ver constantes IV_*.
+    """
+    S, K, T, r, premium = _as_arrays(S, K, T, r, premium)
+    cp = np.where(np.broadcast_to(np.asarray(is_call, dtype=bool), S.shape), 1.0, -1.0)
+
+    iv = np.full(S.shape, np.nan)
+    status = np.full(S.shape, IV_INVALIDO, dtype=np.int8)
+
+    ok = (S > 0) & (K > 0) & (T > 0) & np.isfinite(r) & (premium > 0)
+    idx = np.flatnonzero(ok)
+    if idx.size == 0:
+        return iv, status
+
+    S, K, T, r, premium, cp = S[idx], K[idx], T[idx], r[idx], premium[idx], cp[idx]
+    s0 = None if sigma0 is None else np.broadcast_to(np.asarray(sigma0, dtype=float), ok.shape)[idx]
+
+    p_min, _ = _bs_price_vega(S, K, T, r, np.full(idx.size, IV_MIN), cp)
+    p_max, _ = _bs_price_vega(S, K, T, r, np.full(idx.size, IV_MAX), cp)
+    baixo = premium <= p_min
+    alto = premium >= p_max
+    iv[idx[baixo]] = IV_MIN
+    status[idx[baixo]] = IV_CLAMP_INF
+    iv[idx[alto]] = IV_MAX
+    status[idx[alto]] = IV_CLAMP_SUP
+
+    resolver = ~(baixo | alto)
+    idx = idx[resolver]
+    S, K, T, r, premium, cp = S[resolver], K[resolver], T[resolver], r[resolver], premium[resolver], cp[resolver]
+    if s0 is not None:
+        s0 = s0[resolver]
+
+    lo = np.full(idx.size, IV_MIN)
+    hi = np.full(idx.size, IV_MAX)
+    sig = _iv_chute_inicial(S, K, T, r, premium, cp)
+    if s0 is not None:
+        sig = np.where(np.isfinite(s0), np.clip(s0, IV_MIN, IV_MAX), sig)
+    f_ant = np.full(idx.size, np.inf)
+    ativo = np.arange(idx.size)
+
+    for _ in range(maxiter):
+        if ativo.size == 0:
+            break
+        s = sig[ativo]
+        price, vega = _bs_price_vega(S[ativo], K[ativo], T[ativo], r[ativo], s, cp[ativo])
+        f = price - premium[ativo]
+
+        acima = f > 0
+        hi[ativo] = np.where(acima, s, hi[ativo])
+        lo[ativo] = np.where(acima, lo[ativo], s)
+
+        # Newton em log(preço): converge rápido também nas asas, onde o prêmio é minúsculo
+        with np.errstate(divide="ignore", invalid="ignore", over="ignore"):
+            newton = s - np.log(price / premium[ativo]) * price / vega
+        l, h = lo[ativo], hi[ativo]
+        # bissecção se Newton sai do intervalo ou não reduz o erro pela metade
+        lento = np.abs(f) > 0.5 * f_ant[ativo]
+        f_ant[ativo] = np.abs(f)
+        fora = ~np.isfinite(newton) | (newton <= l) | (newton >= h) | lento
+        sig[ativo] = np.where(fora, 0.5 * (l + h), newton)
+
+        feito = (np.abs(f) <= tol * premium[ativo]) | ((h - l) <= tol)
+        sig[ativo[feito]] = s[feito]
+        ativo = ativo[~feito]
+
+    convergiu = np.ones(idx.size, dtype=bool)
+    convergiu[ativo] = False
+    iv[idx] = sig
+    status[idx] = np.where(convergiu, IV_OK, IV_NAO_CONVERGIU)
+    iv[idx[~convergiu]] = np.nan
+    return iv, status
+
+
+# ===============================
+# CACHE DE IV ENTRE VARREDURAS
+# ===============================
+
+# floats do Python custam ~32 B cada: a conversão vai em blocos para não
+# materializar listas do livro inteiro (era o pico de memória do enriquecimento)
+BLOCO_LISTAS = 16_384
+
+
+def _como_listas(*arrays):
+    return [np.asarray(a).tolist() for a in arrays]
+
+
+def _listas_em_blocos(n: int, *arrays):
+    """(início, listas) de BLOCO_LISTAS em BLOCO_LISTAS linhas."""
+    for i in range(0, n, BLOCO_LISTAS):
+        yield i, _como_listas(*[np.asarray(a)[i:i + BLOCO_LISTAS] for a in arrays])
+
+
+class CacheIV:
+    """
+    LRU limitado, por processo, da última IV resolvida de cada contrato.
+    Chave: (symbol, strike, expiration). Guarda também o hash dos insumos
+    usados (S, T, r, prêmio, tipo) para pular linhas que não mudaram.
+    """
+
+    def __init__(self, maxsize: int = 200_000):
+        self.maxsize = maxsize
+        self._dados = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.reusos = 0
+        self.ultima = {"hits": 0, "misses": 0, "reusos": 0}
+
+    def __len__(self):
+        return len(self._dados)
+
+    def consultar(self, chaves, S, T, r, premium, is_call):
+        """
+        Retorna (sigma0, iv, status, inalterado): chute warm start para as
+        chaves encontradas e IV/status prontos onde os insumos são idênticos.
+        """
+        n = len(chaves)
+        sigma0 = np.full(n, np.nan)
+        iv = np.full(n, np.nan)
+        status = np.full(n, IV_INVALIDO, dtype=np.int8)
+        inalterado = np.zeros(n, dtype=bool)
+        hits = 0
+
+        with self._lock:
+            for ini, (S_b, T_b, r_b, p_b, c_b) in _listas_em_blocos(n, S, T, r, premium, is_call):
+                for j, chave in enumerate(chaves[ini:ini + BLOCO_LISTAS]):
+                    item = self._dados.get(chave)
+                    if item is None:
+                        continue
+                    hits += 1
+                    self._dados.move_to_end(chave)
+                    insumos, iv_i, st_i = item
+                    i = ini + j
+                    if np.isfinite(iv_i):
+                        sigma0[i] = iv_i
+                    if insumos == hash((S_b[j], T_b[j], r_b[j], p_b[j], c_b[j])):
+                        inalterado[i] = True
+                        iv[i] = iv_i
+                        status[i] = st_i
+
+            reusos = int(inalterado.sum())
+            self.ultima = {"hits": hits, "misses": n - hits, "reusos": reusos}
+            self.hits += hits
+            self.misses += n - hits
+            self.reusos += reusos
+
+        return sigma0, iv, status, inalterado
+
+    def gravar(self, chaves, S, T, r, premium, is_call, iv, status):
+        # hash dos insumos + floats do Python: bem menos memória por contrato
+        # que guardar a tupla de escalares NumPy
+        with self._lock:
+            for ini, (S_b, T_b, r_b, p_b, c_b, iv_b, st_b) in _listas_em_blocos(
+                len(chaves), S, T, r, premium, is_call, iv, status
+            ):
+                for j, chave in enumerate(chaves[ini:ini + BLOCO_LISTAS]):
+                    self._dados[chave] = (hash((S_b[j], T_b[j], r_b[j], p_b[j], c_b[j])), iv_b[j], st_b[j])
+                    self._dados.move_to_end(chave)
+            while len(self._dados) > self.maxsize:
+                self._dados.popitem(last=False)
+
+    def stats(self) -> dict:
+        """Contadores acumulados e da última consulta, com taxa de acerto."""
+        def _ratio(h, m):
+            return h / (h + m) if (h + m) else 0.0
+        return {
+            "tamanho": len(self._dados),
+            "hits": self.hits,
+            "misses": self.misses,
+            "reusos": self.reusos,
+            "hit_ratio": _ratio(self.hits, self.misses),
+            "ultima_hit_ratio": _ratio(self.ultima["hits"], self.ultima["misses"]),
+            "ultima_reusos": self.ultima["reusos"],
+        }
+
+    def limpar(self):
+        with self._lock:
+            self._dados.clear()
+            self.hits = self.misses = self.reusos = 0
+            self.ultima = {"hits": 0, "misses": 0, "reusos": 0}
+
+
+IV_CACHE = CacheIV()
+
+
+# ===============================
+# EXECUÇÃO PARALELA (pool de processos)
+# ===============================
+
+MIN_LINHAS_PARALELO = 20_000
+
+_POOL = None
+_POOL_WORKERS = 0
+_POOL_LOCK = threading.Lock()
+
+
+def _obter_pool(n_workers: int) -> ProcessPoolExecutor:
+    """Pool único por processo (spawn: os workers só importam este módulo)."""
+    global _POOL, _POOL_WORKERS
+    with _POOL_LOCK:
+        if _POOL is None or _POOL_WORKERS != n_workers:
+            if _POOL is not None:
+                _POOL.shutdown(wait=False, cancel_futures=True)
+            _POOL = ProcessPoolExecutor(max_workers=n_workers, mp_context=mp.get_context("spawn"))
+            _POOL_WORKERS = n_workers
+        return _POOL
+
+
+def _descartar_pool():
+    global _POOL, _POOL_WORKERS
+    with _POOL_LOCK:
+        if _POOL is not None:
+            _POOL.shutdown(wait=False, cancel_futures=True)
+        _POOL, _POOL_WORKERS = None, 0
+
+
+def _montar_shards(grupos, n_shards: int) -> list:
+    """
+    Índices de linha por shard. Com subjacentes suficientes, cada um vai inteiro
+    para um shard (maior primeiro, no shard menos carregado); senão, blocos de linhas.
+    Cada shard volta ordenado, então o resultado não depende da ordem de conclusão.
+    """
+    n = len(grupos)
+    codigos, contagem = np.unique(grupos, return_counts=True)
+    if codigos.size < n_shards:
+        return [b for b in np.array_split(np.arange(n), n_shards) if b.size]
+
+    carga = np.zeros(n_shards, dtype=np.int64)
+    destino = np.empty(codigos.size, dtype=np.int64)
+    for i in np.argsort(-contagem, kind="stable"):
+        alvo = int(np.argmin(carga))
+        destino[i] = alvo
+        carga[alvo] += contagem[i]
+
+    shard_da_linha = destino[np.searchsorted(codigos, grupos)]
+    return [np.flatnonzero(shard_da_linha == k) for k in range(n_shards) if carga[k]]
+
+
+def _iv_shard(args):
+    S, K, T, r, premium, is_call, sigma0 = args
+    return implied_vol_vec(S, K, T, r, premium, is_call, sigma0=sigma0)
+
+
+def implied_vol_paralelo(S, K, T, r, premium, is_call, sigma0=None, grupos=None, n_workers: int = 1):
+    """
+    implied_vol_vec dividido em shards (por subjacente via `grupos`, ou blocos de
+    linhas) num pool de processos. Cada shard viaja como arrays contíguos.
+    Livros pequenos, n_workers <= 1 ou pool quebrado caem para o caminho serial.
+    """
+    S, K, T, r, premium = _as_arrays(S, K, T, r, premium)
+    is_call = np.broadcast_to(np.asarray(is_call, dtype=bool), S.shape)
+    sigma0 = np.full(S.shape, np.nan) if sigma0 is None else np.broadcast_to(np.asarray(sigma0, dtype=float), S.shape)
+
+    if n_workers is None or n_workers <= 1 or S.size < MIN_LINHAS_PARALELO:
+        return implied_vol_vec(S, K, T, r, premium, is_call, sigma0=sigma0)
+
+    grupos = np.zeros(S.size, dtype=np.int64) if grupos is None else np.asarray(grupos)
+    shards = _montar_shards(grupos, 2 * n_workers)
+    payload = [
+        tuple(np.ascontiguousarray(a[idx]) for a in (S, K, T, r, premium, is_call, sigma0))
+        for idx in shards
+    ]
+
+    try:
+        resultados = list(_obter_pool(n_workers).map(_iv_shard, payload))
+    except (BrokenProcessPool, OSError):
+        _descartar_pool()
+        return implied_vol_vec(S, K, T, r, premium, is_call, sigma0=sigma0)
+
+    iv = np.full(S.shape, np.nan)
+    status = np.full(S.shape, IV_INVALIDO, dtype=np.int8)
+    for idx, (iv_s, st_s) in zip(shards, resultados):
+        iv[idx] = iv_s
+        status[idx] = st_s
+    return iv, status
+
+
+def implied_vol_com_cache(chaves, S, K, T, r, premium, is_call, cache: CacheIV = IV_CACHE,
+                          grupos=None, n_workers: int = 1):
+    """
+    implied_vol_vec com warm start: linhas com insumos idênticos aos da última
+    varredura reaproveitam a IV; as demais partem da IV anterior do contrato.
+    Com n_workers > 1 as linhas a resolver vão para implied_vol_paralelo.
+    """
+    S, K, T, r, premium = _as_arrays(S, K, T, r, premium)
+    is_call = np.broadcast_to(np.asarray(is_call, dtype=bool), S.shape)
+
+    sigma0, iv, status, inalterado = cache.consultar(chaves, S, T, r, premium, is_call)
+    resolver = ~inalterado
+    if resolver.any():
+        iv[resolver], status[resolver] = implied_vol_paralelo(
+            S[resolver], K[resolver], T[resolver], r[resolver], premium[resolver],
+            is_call[resolver], sigma0=sigma0[resolver],
+            grupos=None if grupos is None else np.asarray(grupos)[resolver],
+            n_workers=n_workers,
+        )
+        idx = np.flatnonzero(resolver)
+        cache.gravar([chaves[i] for i in idx], S[idx], T[idx], r[idx], premium[idx],
+                     is_call[idx], iv[idx], status[idx])
+    return iv, status
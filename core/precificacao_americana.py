@@ -0,0 +1,243 @@
+# core/precificacao_americana.py
+# ================================================
+# Exercício americano com dividendos discretos (árvore binomial vetorizada)
+# Projeto Phoenix
+# ================================================
+#
+# Sem dependência de Streamlit. Modelo de dividendo "escrowed": a árvore
+# binomial é montada sobre S* = S - VP(dividendos até o vencimento) e, em cada
+# nó, o preço à vista é S* do nó + VP dos dividendos que ainda faltam; é
+# contra ele que o exercício antecipado é testado. Todos os contratos
+# andam juntos na mesma indução reversa (nós x m por passo), cada um com
+# o próprio dt = T / passos.
+#
+# No scanner, calls de ativos marcados como americanos com provento até o
+# vencimento vão pela árvore; as demais calls desses ativos, as puts
+# (europeias na B3) e o chute inicial da IV usam Black-Scholes sobre S*.
+
+from datetime import date
+
+import numpy as np
+
+from core.calendario_b3 import dias_uteis
+from core.precificacao import (
+    IV_CLAMP_INF, IV_CLAMP_SUP, IV_INVALIDO, IV_MAX, IV_MIN, IV_NAO_CONVERGIU, IV_OK,
+    _as_arrays, _bs_price_vega, implied_vol_vec,
+)
+
+PASSOS_ARVORE = 100
+TOL_INTERVALO = 1e-6
+
+
+# ===============================
+# AGENDA DE DIVIDENDOS
+# ===============================
+
+def ler_agenda_dividendos(texto: str) -> dict[str, list[tuple[date, float]]]:
+    """
+    Uma linha por provento, 'ATIVO; AAAA-MM-DD (data ex); valor por ação'
+    (separador ';' ou ','; linhas vazias e iniciadas por # são ignoradas).
+    Levanta ValueError apontando a linha inválida.
+    """
+    agenda: dict[str, list[tuple[date, float]]] = {}
+    for n, linha in enumerate((texto or "").splitlines(), start=1):
+        linha = linha.strip()
+        if not linha or linha.startswith("#"):
+            continue
+        partes = [p.strip() for p in linha.replace(",", ";").split(";")]
+        try:
+            ativo, data_ex, valor = partes
+            item = (date.fromisoformat(data_ex), float(valor))
+        except ValueError:
+            raise ValueError(f"Linha {n} da agenda de dividendos inválida: {linha!r}") from None
+        if item[1] > 0:
+            agenda.setdefault(ativo.upper(), []).append(item)
+    return {a: sorted(v) for a, v in agenda.items()}
+
+
+def matriz_dividendos(ativos, agenda: dict, hoje: date | None = None) -> tuple[np.ndarray, np.ndarray]:
+    """
+    (tau, valor), m x D: data ex em anos de pregão (base 252, como o T do
+    scanner) e valor de cada provento futuro do ativo de cada linha. Linhas
+    com menos proventos que D são completadas com valor 0.
+    """
+    hoje = hoje or date.today()
+    ativos = np.asarray(ativos, dtype=object)
+    futuros = {a: [(d, v) for d, v in agenda.get(a, []) if d > hoje] for a in dict.fromkeys(ativos.tolist())}
+    n_div = max((len(v) for v in futuros.values()), default=0)
+    tau = np.full((len(ativos), max(n_div, 1)), np.inf)
+    valor = np.zeros((len(ativos), max(n_div, 1)))
+    for a, itens in futuros.items():
+        if not itens:
+            continue
+        linhas = np.flatnonzero(ativos == a)
+        datas = np.array([d for d, _ in itens], dtype="datetime64[D]")
+        tau[np.ix_(linhas, np.arange(len(itens)))] = dias_uteis(hoje, datas) / 252.0
+        valor[np.ix_(linhas, np.arange(len(itens)))] = [v for _, v in itens]
+    return tau, valor
+
+
+def vp_dividendos(t, T, r, tau, valor) -> np.ndarray:
+    """VP em t dos proventos com data ex em (t, T], por linha (t, T, r: m; tau, valor: m x D)."""
+    t = np.asarray(t, dtype=float)[:, None]
+    dentro = (tau > t) & (tau <= np.asarray(T, dtype=float)[:, None])
+    with np.errstate(invalid="ignore", over="ignore"):
+        desc = np.exp(-np.asarray(r, dtype=float)[:, None] * (tau - t))
+    return np.where(dentro, valor * desc, 0.0).sum(axis=1)
+
+
+# ===============================
+# ÁRVORE BINOMIAL (lote)
+# ===============================
+
+def _arvore(S, K, T, r, sigma, cp, tau, valor, passos):
+    """
+    Indução reversa para m contratos. Retorna (preço, delta, gamma).
+    Árvore com drift (Jarrow-Rudd): u, d = exp((r - σ²/2)dt ± σ√dt). Ao contrário
+    da CRR, a probabilidade fica em (0, 1) mesmo com σ√dt < r·dt (IV baixa).
+    """
+    m = S.size
+    dt = T / passos
+    sobe = sigma * np.sqrt(dt)
+    deriva = (r - 0.5 * sigma * sigma) * dt
+    u, d = np.exp(deriva + sobe), np.exp(deriva - sobe)
+    desc = np.exp(-r * dt)
+    p = np.clip((np.exp(r * dt) - d) / (u - d), 0.0, 1.0)
+    pu, pd = desc * p, desc * (1.0 - p)
+    inv_d = 1.0 / d
+    s_esc = S - vp_dividendos(np.zeros(m), T, r, tau, valor)
+
+    # nós x contratos: V[1:] e V[:-1] são blocos contíguos de memória.
+    # Parte "escrowed" dos nós: no passo j, E_j = E_{j+1}[:-1] / d (sem exp por nó)
+    E = s_esc * np.exp(passos * deriva + sobe * np.arange(-passos, passos + 1, 2)[:, None])
+    V = np.maximum(cp * (E - K), 0.0)
+    guardados = {}
+    for j in range(passos - 1, -1, -1):
+        E = E[:-1] * inv_d
+        V = pu * V[1:] + pd * V[:-1]
+        Sj = E + vp_dividendos(j * dt, T, r, tau, valor)
+        np.maximum(V, cp * (Sj - K), out=V)
+        if j <= 2:
+            guardados[j] = (Sj, V)
+
+    (S1, V1), (S2, V2) = guardados[1], guardados[2]
+    delta = (V1[1] - V1[0]) / (S1[1] - S1[0])
+    d_alto = (V2[2] - V2[1]) / (S2[2] - S2[1])
+    d_baixo = (V2[1] - V2[0]) / (S2[1] - S2[0])
+    gamma = (d_alto - d_baixo) / (0.5 * (S2[2] - S2[0]))
+    return V[0], delta, gamma
+
+
+def _sem_dividendos(n):
+    return np.full((n, 1), np.inf), np.zeros((n, 1))
+
+
+def preco_americano_vec(S, K, T, r, sigma, is_call, tau=None, valor=None, passos: int = PASSOS_ARVORE):
+    """
+    Preço, delta e gamma americanos com dividendos discretos para arrays
+    inteiros (tau/valor de matriz_dividendos; None = sem proventos). NaN onde
+    S, K, T ou sigma não forem positivos, como em bs_price_greeks_vec.
+    """
+    S, K, T, r, sigma = _as_arrays(S, K, T, r, sigma)
+    cp = np.where(np.broadcast_to(np.asarray(is_call, dtype=bool), S.shape), 1.0, -1.0)
+    if tau is None:
+        tau, valor = _sem_dividendos(S.size)
+
+    out = [np.full(S.shape, np.nan) for _ in range(3)]
+    ok = (S > 0) & (K > 0) & (T > 0) & (sigma > 0) & np.isfinite(r)
+    if ok.any():
+        res = _arvore(S[ok], K[ok], T[ok], r[ok], sigma[ok], cp[ok], tau[ok], valor[ok], passos)
+        for o, v in zip(out, res):
+            o[ok] = v
+    return tuple(out)
+
+
+# ===============================
+# VOLATILIDADE IMPLÍCITA AMERICANA
+# ===============================
+
+def implied_vol_americana(S, K, T, r, premium, is_call, tau=None, valor=None, sigma0=None,
+                          passos: int = PASSOS_ARVORE, tol: float = 1e-4, maxiter: int = 60):
+    """
+    IV que reproduz o prêmio na árvore americana com dividendos. Parte da IV
+    europeia sobre S* (ou de `sigma0`); Newton com a vega de Black-Scholes em S*
+    e intervalo [IV_MIN, IV_MAX] mantido, bissecção quando o passo sai dele ou
+    não reduz o erro pela metade (o preço da árvore oscila com sigma).
+    Só as linhas ainda não convergidas voltam para a árvore a cada iteração.
+    `tol` é relativa ao prêmio (o erro da própria árvore é maior que isso).
+    Retorna (iv, status) com as constantes IV_* de core.precificacao.
+    """
+    S, K, T, r, premium = _as_arrays(S, K, T, r, premium)
+    is_call = np.broadcast_to(np.asarray(is_call, dtype=bool), S.shape)
+    cp = np.where(is_call, 1.0, -1.0)
+    if tau is None:
+        tau, valor = _sem_dividendos(S.size)
+
+    iv = np.full(S.shape, np.nan)
+    status = np.full(S.shape, IV_INVALIDO, dtype=np.int8)
+    s_esc = S - vp_dividendos(np.zeros(S.size), T, r, tau, valor)
+    ok = (S > 0) & (s_esc > 0) & (K > 0) & (T > 0) & np.isfinite(r) & (premium > 0)
+    idx = np.flatnonzero(ok)
+    if idx.size == 0:
+        return iv, status
+
+    S, K, T, r, premium, cp, s_esc = S[idx], K[idx], T[idx], r[idx], premium[idx], cp[idx], s_esc[idx]
+    tau, valor = tau[idx], valor[idx]
+
+    def preco(sel, sig):
+        return _arvore(S[sel], K[sel], T[sel], r[sel], sig, cp[sel], tau[sel], valor[sel], passos)[0]
+
+    lo = np.full(idx.size, IV_MIN)
+    hi = np.full(idx.size, IV_MAX)
+    if sigma0 is not None:
+        sig = np.broadcast_to(np.asarray(sigma0, dtype=float), ok.shape)[idx].copy()
+    else:
+        sig = np.full(idx.size, np.nan)
+    sem_chute = ~np.isfinite(sig)
+    if sem_chute.any():
+        sig[sem_chute] = implied_vol_vec(
+            s_esc[sem_chute], K[sem_chute], T[sem_chute], r[sem_chute], premium[sem_chute], cp[sem_chute] > 0
+        )[0]
+    sig = np.clip(np.nan_to_num(sig, nan=0.3), IV_MIN, IV_MAX)
+    f_ant = np.full(idx.size, np.inf)
+    erro = np.full(idx.size, np.inf)
+    ativo = np.arange(idx.size)
+
+    # sem pré-checagem dos limites (duas árvores a mais no livro todo): prêmio
+    # inalcançável faz o intervalo fechar numa das pontas e é sinalizado no fim
+    for _ in range(maxiter):
+        if ativo.size == 0:
+            break
+        s = sig[ativo]
+        f = preco(ativo, s) - premium[ativo]
+        erro[ativo] = np.abs(f)
+        acima = f > 0
+        hi[ativo] = np.where(acima, s, hi[ativo])
+        lo[ativo] = np.where(acima, lo[ativo], s)
+
+        _, vega = _bs_price_vega(s_esc[ativo], K[ativo], T[ativo], r[ativo], s, cp[ativo])
+        with np.errstate(divide="ignore", invalid="ignore", over="ignore"):
+            newton = s - f / vega
+        l, h = lo[ativo], hi[ativo]
+        lento = np.abs(f) > 0.5 * f_ant[ativo]
+        f_ant[ativo] = np.abs(f)
+        fora = ~np.isfinite(newton) | (newton <= l) | (newton >= h) | lento
+        sig[ativo] = np.where(fora, 0.5 * (l + h), newton)
+
+        feito = (np.abs(f) <= tol * premium[ativo]) | ((h - l) <= TOL_INTERVALO)
+        sig[ativo[feito]] = s[feito]
+        ativo = ativo[~feito]
+
+    errou = erro > tol * premium
+    baixo = errou & (hi <= IV_MIN + TOL_INTERVALO)
+    alto = errou & (lo >= IV_MAX - TOL_INTERVALO)
+    iv[idx] = sig
+    status[idx] = IV_OK
+    iv[idx[baixo]], status[idx[baixo]] = IV_MIN, IV_CLAMP_INF
+    iv[idx[alto]], status[idx[alto]] = IV_MAX, IV_CLAMP_SUP
+    # intervalo fechado no interior sem reproduzir o prêmio (o preço da árvore
+    # oscila com sigma): não é uma IV válida
+    preso = errou & ~baixo & ~alto
+    iv[idx[preso]], status[idx[preso]] = np.nan, IV_NAO_CONVERGIU
+    iv[idx[ativo]], status[idx[ativo]] = np.nan, IV_NAO_CONVERGIU
+    return iv, status
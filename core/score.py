@@ -0,0 +1,13 @@
+# core/score.py
+# ================================================
+# Constantes do Score de Oportunidade do scanner
+# Projeto Phoenix
+# ================================================
+#
+# Sem dependência de Streamlit. Quem pontua é o scanner
+# (dashboards/scanner_opcoes.py); o otimizador offline (core.otimizador_score)
+# lê daqui os pesos em uso para comparar com os que encontra.
+
+PESOS_SCORE = (0.40, 0.30, 0.20, 0.10)     # IV% (baixa), volume, delta (alvo), spread (baixo)
+BONUS_VOLUME = 0.25                         # score * (1 + BONUS_VOLUME * (volfin/MM20 - 1))
+COLS_FATORES = ["fator_iv", "fator_volume", "fator_delta", "fator_spread"]
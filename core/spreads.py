@@ -0,0 +1,121 @@
+# core/spreads.py
+# ================================================
+# Busca de travas verticais (spreads) por (ativo, vencimento), vetorizada
+# Projeto Phoenix
+# ================================================
+#
+# Sem dependência de Streamlit. As pernas elegíveis são ordenadas por
+# (ativo/vencimento, tipo, strike); para cada perna, o último parceiro
+# dentro da largura máxima sai de um np.searchsorted sobre uma chave
+# composta (grupo·escala + strike), e os pares (i, j) são gerados de uma
+# vez com np.repeat + deslocamentos — sem laço por par. Cada par de calls
+# dá a trava de alta (compra K baixo, vende K alto) e a de baixa; cada par
+# de puts, idem. Preços executáveis: compra no ask, venda no bid.
+
+import numpy as np
+from scipy.special import ndtr
+
+ESTRATEGIAS = {
+    0: "Trava de alta com calls",
+    1: "Trava de baixa com calls",
+    2: "Trava de alta com puts",
+    3: "Trava de baixa com puts",
+}
+LARGURA_MAX_PCT = 20.0          # distância máxima entre strikes, % do spot
+MAX_PARES = 3_000_000           # teto de pares por chamada (memória)
+
+
+def pares_verticais(grupo, K, is_call, largura) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Índices (baixo, alto) de todos os pares do mesmo grupo (código inteiro
+    >= 0 de ativo/vencimento) e tipo com 0 < K_alto - K_baixo <= largura
+    (largura por perna, a partir do strike baixo).
+    Levanta ValueError se passar de MAX_PARES.
+    """
+    K = np.asarray(K, dtype=float)
+    cp = np.asarray(is_call, dtype=bool)
+    seg = np.asarray(grupo, dtype=np.int64) * 2 + cp
+    ordem = np.lexsort((K, seg))
+    Ks, segs = K[ordem], seg[ordem]
+    larg = np.asarray(np.broadcast_to(np.asarray(largura, dtype=float), K.shape))[ordem]
+
+    # chave composta crescente; grupos separados por mais que qualquer strike + largura
+    escala = 2.0 * (np.nanmax(Ks) + np.nanmax(larg)) + 1.0 if len(Ks) else 1.0
+    chave = segs * escala + Ks
+    fim = np.searchsorted(chave, chave + larg, side="right")
+    n = np.maximum(fim - np.arange(len(Ks)) - 1, 0)
+    total = int(n.sum())
+    if total > MAX_PARES:
+        raise ValueError(f"{total:,} pares de strikes — reduza a largura máxima ou o universo.")
+
+    i = np.repeat(np.arange(len(Ks)), n)
+    j = i + 1 + np.arange(total) - np.repeat(np.cumsum(n) - n, n)
+    sobe = Ks[j] > Ks[i]                    # strikes repetidos não formam trava
+    return ordem[i[sobe]], ordem[j[sobe]]
+
+
+def _prob_acima(S, X, T, r, sigma):
+    """P(S_T > X) neutra a risco (lognormal): N(d2)."""
+    with np.errstate(divide="ignore", invalid="ignore"):
+        sT = sigma * np.sqrt(T)
+        d2 = (np.log(S / X) + (r - 0.5 * sigma * sigma) * T) / sT
+    return ndtr(d2)
+
+
+def montar_verticais(grupo, K, is_call, bid, ask, S, T, r, sigma, largura) -> dict:
+    """
+    Todas as travas verticais das pernas dadas (arrays por contrato; sigma
+    em fração, usado só na probabilidade de lucro). Retorna um dict de
+    arrays, uma posição por trava: "compra"/"venda" (índices das pernas),
+    "estrategia" (chave de ESTRATEGIAS), "custo" (> 0 débito, < 0 crédito),
+    "ganho_max", "perda_max", "breakeven", "retorno_risco", "prob_lucro".
+    Ficam só as travas com ganho e perda máximos positivos.
+    """
+    K, bid, ask, S, T, r, sigma = (np.asarray(x, dtype=float) for x in (K, bid, ask, S, T, r, sigma))
+    is_call = np.asarray(is_call, dtype=bool)
+    lo, hi = pares_verticais(grupo, K, is_call, largura)
+    call = is_call[lo]
+    w = K[hi] - K[lo]
+
+    # débito: alta com calls (compra lo) e baixa com puts (compra hi); crédito nas outras duas
+    deb_call = ask[lo] - bid[hi]
+    cred_call = bid[lo] - ask[hi]
+    deb_put = ask[hi] - bid[lo]
+    cred_put = bid[hi] - ask[lo]
+
+    debito = np.concatenate([np.where(call, deb_call, deb_put), np.where(call, -cred_call, -cred_put)])
+    compra = np.concatenate([np.where(call, lo, hi), np.where(call, hi, lo)])
+    venda = np.concatenate([np.where(call, hi, lo), np.where(call, lo, hi)])
+    eh_debito = np.repeat([True, False], len(lo))
+    alta = np.concatenate([call, ~call])        # alta com calls (débito) e alta com puts (crédito)
+    estrategia = np.where(np.concatenate([call, call]), np.where(alta, 0, 1), np.where(alta, 2, 3))
+    ww = np.concatenate([w, w])
+    k_lo = np.concatenate([K[lo], K[lo]])
+    k_hi = np.concatenate([K[hi], K[hi]])
+
+    custo = np.where(eh_debito, debito, -debito)     # pago ou recebido; <= 0 seria arbitragem
+    ganho = np.where(eh_debito, ww - custo, custo)
+    perda = np.where(eh_debito, custo, ww - custo)
+    # calls: K baixo + custo; puts: K alto - custo (custo = débito ou crédito recebido)
+    breakeven = np.where(estrategia < 2, k_lo + custo, k_hi - custo)
+
+    sel = np.concatenate([lo, lo])
+    sig = 0.5 * (sigma[compra] + sigma[venda])
+    p_acima = _prob_acima(S[sel], breakeven, T[sel], r[sel], sig)
+    prob = np.where(alta, p_acima, 1.0 - p_acima)
+
+    ok = (ganho > 0) & (perda > 0) & np.isfinite(debito)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        rr = ganho / perda
+    return {
+        "compra": compra[ok],
+        "venda": venda[ok],
+        "estrategia": estrategia[ok],
+        "custo": debito[ok],
+        "largura": ww[ok],
+        "ganho_max": ganho[ok],
+        "perda_max": perda[ok],
+        "breakeven": breakeven[ok],
+        "retorno_risco": rr[ok],
+        "prob_lucro": prob[ok],
+    }
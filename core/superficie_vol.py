@@ -0,0 +1,142 @@
+# core/superficie_vol.py
+# ================================================
+# Smile de volatilidade por (ativo, vencimento), vetorizado
+# Projeto Phoenix
+# ================================================
+#
+# Sem dependência de Streamlit. Cada smile é uma parábola da IV em
+# log-moneyness k = ln(K / F), ajustada por mínimos quadrados ponderados
+# só com os contratos líquidos. Todos os grupos são resolvidos juntos:
+# as somas das equações normais saem de np.bincount e os sistemas 3x3
+# de um único np.linalg.solve empilhado.
+
+import numpy as np
+from scipy.special import ndtri
+
+MIN_PONTOS_SMILE = 5
+IV_SMILE_MIN = 0.01
+IV_SMILE_MAX = 5.0
+
+
+def log_moneyness(S, K, T, r):
+    """k = ln(K / F), F = S·e^(rT). NaN onde S ou K não forem positivos."""
+    S, K, T, r = np.broadcast_arrays(*[np.asarray(a, dtype=float) for a in (S, K, T, r)])
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return np.where((S > 0) & (K > 0), np.log(K / S) - r * T, np.nan)
+
+
+def _somas(k, iv, w, grupo, n_grupos):
+    pot = [np.ones_like(k)]
+    for _ in range(4):
+        pot.append(pot[-1] * k)
+    sk = [np.bincount(grupo, weights=w * p, minlength=n_grupos) for p in pot]
+    sy = [np.bincount(grupo, weights=w * iv * p, minlength=n_grupos) for p in pot[:3]]
+    A = np.stack([np.stack(sk[i:i + 3], axis=-1) for i in range(3)], axis=-2)   # G x 3 x 3
+    b = np.stack(sy, axis=-1)                                                   # G x 3
+    return A, b
+
+
+def _resolver(A, b, n, min_pontos):
+    coef = np.full(b.shape, np.nan)
+    escala = np.abs(A).max(axis=(1, 2)) + 1e-300
+    ok = (n >= min_pontos) & (np.abs(np.linalg.det(A / escala[:, None, None])) > 1e-12)
+    if ok.any():
+        coef[ok] = np.linalg.solve(A[ok], b[ok][..., None])[..., 0]
+    return coef
+
+
+def _mediana_por_grupo(x, g, validos, n_grupos):
+    """Mediana de x por grupo só entre as linhas válidas (NaN se o grupo não tem nenhuma)."""
+    idx = np.flatnonzero(validos)
+    out = np.full(n_grupos, np.nan)
+    if len(idx) == 0:
+        return out
+    ordem = idx[np.lexsort((x[idx], g[idx]))]
+    cont = np.bincount(g[ordem], minlength=n_grupos)
+    inicio = np.cumsum(cont) - cont
+    tem = cont > 0
+    lo = inicio[tem] + (cont[tem] - 1) // 2
+    hi = inicio[tem] + cont[tem] // 2
+    out[tem] = 0.5 * (x[ordem[lo]] + x[ordem[hi]])
+    return out
+
+
+def ajustar_smiles(k, iv, grupo, n_grupos: int, pesos=None, min_pontos: int = MIN_PONTOS_SMILE) -> dict:
+    """
+    Ajusta iv ≈ a0 + a1·k + a2·k² em cada grupo (códigos 0..n_grupos-1).
+    Três passadas: entre elas saem os pontos com resíduo acima de
+    max(4·MAD robusto do grupo, 2 pontos de vol). Linhas com k/iv NaN ou grupo < 0
+    não entram. Retorna {"coef": G x 3, "k_min", "k_max", "n"} — grupos com
+    menos de `min_pontos` pontos ficam com coef NaN.
+    """
+    k = np.asarray(k, dtype=float)
+    iv = np.asarray(iv, dtype=float)
+    grupo = np.asarray(grupo)
+    w = np.ones_like(k) if pesos is None else np.asarray(pesos, dtype=float).copy()
+    w = np.where(np.isfinite(k) & np.isfinite(iv) & (grupo >= 0) & (w > 0), w, 0.0)
+    g = np.where(grupo >= 0, grupo, 0)
+    k0, iv0 = np.nan_to_num(k), np.nan_to_num(iv)
+
+    for passo in range(3):
+        n = np.bincount(g, weights=(w > 0).astype(float), minlength=n_grupos)
+        A, b = _somas(k0, iv0, w, g, n_grupos)
+        coef = _resolver(A, b, n, min_pontos)
+        if passo == 2:
+            break
+        resid = np.abs(iv0 - (coef[g, 0] + coef[g, 1] * k0 + coef[g, 2] * k0 * k0))
+        ajustado = np.isfinite(resid) & (w > 0)
+        mad = 1.4826 * _mediana_por_grupo(resid, g, ajustado, n_grupos)
+        limite = np.maximum(4 * mad, 0.02)[g]
+        w = np.where(ajustado & (resid > limite), 0.0, w)
+
+    usados = w > 0
+    k_min = np.full(n_grupos, np.nan)
+    k_max = np.full(n_grupos, np.nan)
+    if usados.any():
+        np.fmin.at(k_min, g[usados], k0[usados])
+        np.fmax.at(k_max, g[usados], k0[usados])
+    return {"coef": coef, "k_min": k_min, "k_max": k_max, "n": n}
+
+
+def avaliar_smiles(ajuste: dict, grupo, k) -> np.ndarray:
+    """
+    IV da superfície em (grupo, k), numa só passada. Fora do intervalo de
+    strikes ajustado o smile é estendido reto (k preso nas pontas), e o
+    resultado fica em [IV_SMILE_MIN, IV_SMILE_MAX].
+    """
+    grupo = np.asarray(grupo)
+    k = np.asarray(k, dtype=float)
+    g = np.where(grupo >= 0, grupo, 0)
+    kc = np.clip(k, ajuste["k_min"][g], ajuste["k_max"][g])
+    a = ajuste["coef"][g]
+    iv = a[:, 0] + a[:, 1] * kc + a[:, 2] * kc * kc
+    iv = np.clip(iv, IV_SMILE_MIN, IV_SMILE_MAX)
+    return np.where((grupo >= 0) & np.isfinite(k), iv, np.nan)
+
+
+def resumo_smiles(ajuste: dict) -> dict:
+    """Por grupo: IV ATM (k=0), inclinação e curvatura do smile em k=0."""
+    coef = ajuste["coef"]
+    g = np.arange(len(coef))
+    return {
+        "iv_atm": avaliar_smiles(ajuste, g, np.zeros(len(coef))),
+        "skew": coef[:, 1],
+        "curvatura": 2 * coef[:, 2],
+        "pontos": ajuste["n"].astype(int),
+    }
+
+
+def iv_por_delta(ajuste: dict, T, delta_call: float, iters: int = 8) -> np.ndarray:
+    """
+    IV do smile de cada grupo no strike cujo delta de call (forward, sem
+    desconto) é `delta_call` — 0.25 para a call 25Δ, 0.75 para a put -25Δ.
+    Ponto fixo k = σ²T/2 - N⁻¹(Δ)·σ√T, σ = smile(k), em todos os grupos juntos.
+    """
+    T = np.asarray(T, dtype=float)
+    g = np.arange(len(ajuste["coef"]))
+    d1 = ndtri(delta_call)
+    sigma = avaliar_smiles(ajuste, g, np.zeros(len(g)))
+    for _ in range(iters):
+        k = 0.5 * sigma * sigma * T - d1 * sigma * np.sqrt(T)
+        sigma = avaliar_smiles(ajuste, g, k)
+    return sigma
@@ -1,4 +1,47 @@
 import datetime
+import os
+import threading
+from collections import OrderedDict
+from pathlib import Path
 
 def today():
     return datetime.date.today()
+
+def data_dir() -> Path:
+    """Pasta de dados locais do app (PHOENIX_DATA_DIR ou ./data na raiz do projeto)."""
+    p = Path(os.getenv("PHOENIX_DATA_DIR", Path(__file__).resolve().parent.parent / "data"))
+    p.mkdir(parents=True, exist_ok=True)
+    return p
+
+
+class CacheLRU:
+    """
+    Dicionário limitado a `maxsize` itens, por processo e protegido por lock:
+    obter() marca a chave como recente e gravar() descarta as mais antigas.
+    """
+
+    def __init__(self, maxsize: int):
+        self.maxsize = maxsize
+        self._dados = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._dados)
+
+    def obter(self, chave, padrao=None):
+        with self._lock:
+            valor = self._dados.get(chave, padrao)
+            if chave in self._dados:
+                self._dados.move_to_end(chave)
+        return valor
+
+    def gravar(self, chave, valor):
+        with self._lock:
+            self._dados[chave] = valor
+            self._dados.move_to_end(chave)
+            while len(self._dados) > self.maxsize:
+                self._dados.popitem(last=False)
+
+    def limpar(self):
+        with self._lock:
+            self._dados.clear()
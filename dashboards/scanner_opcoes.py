@@ -16,19 +16,37 @@ dentro do app Phoenix (phoenix_app.py).
 """
 
 from __future__ import annotations
-import os, math
+import os, heapq, threading, time
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import datetime, timedelta, date
 
 import numpy as np
 import pandas as pd
 import requests, yfinance as yf
 import streamlit as st
+from streamlit.runtime.scriptrunner import add_script_run_ctx, get_script_run_ctx
 import plotly.graph_objects as go
-from scipy.stats import norm
-from scipy.optimize import brentq
 from supabase_ops import inserir_operacao
 import supabase_ops as supabase_ops_mod
 from notificacoes import enviar_email, enviar_telegram
+from scipy.special import ndtr
+from core.precificacao import (
+    IV_CACHE, IV_INVALIDO, IV_MAX, IV_MIN, IV_OK, MIN_LINHAS_PARALELO, bs_price_greeks_vec, implied_vol_com_cache,
+)
+from core.arbitragem import contar_flags, flags_arbitragem
+from core.calendario_b3 import dias_uteis, proximo_vencimento
+from core.curva_di import carregar_curva, datas_disponiveis, gravar_curva, taxas_continuas
+from core.exposicao_gama import gex_contratos, gex_por_strike, nivel_flip, perfil_gex
+from core.historico_iv import JANELA_HV, MIN_HISTORICO, cone_volatilidade, ultimo_rank
+from core.max_pain import max_pain, perfil_oi
+from core.precificacao_americana import (
+    implied_vol_americana, ler_agenda_dividendos, matriz_dividendos, preco_americano_vec, vp_dividendos,
+)
+from core.spreads import ESTRATEGIAS, LARGURA_MAX_PCT, montar_verticais
+from core.superficie_vol import ajustar_smiles, avaliar_smiles, iv_por_delta, log_moneyness, resumo_smiles
+from core.otimizador_score import COLUNA_FATORES, fatores_entrada
+from core.score import BONUS_VOLUME, COLS_FATORES, PESOS_SCORE
+from core.utils import CacheLRU
 
 
 
@@ -72,6 +90,25 @@ def _yf_download_one(ticker_sa: str, start: datetime, end: datetime) -> pd.DataF
 # ===============================
 # Fetch candles (Oplab -> Yahoo)
 # ===============================
+_COLS_CANDLES = ["underlying_symbol", "date", "open", "high", "low", "close", "volume"]
+
+
+def _formatar_candles(df: pd.DataFrame, symbol: str) -> pd.DataFrame:
+    df = df.reset_index().rename(columns={
+        "Date": "date",
+        "Open": "open",
+        "High": "high",
+        "Low": "low",
+        "Close": "close",
+        "Volume": "volume"
+    })
+    for c in ["open", "high", "low", "close", "volume"]:
+        df[c] = pd.to_numeric(df[c], errors="coerce")
+    df["underlying_symbol"] = symbol
+    df = df[_COLS_CANDLES]
+    return df.dropna(subset=["date"]).sort_values("date").reset_index(drop=True)
+
+
 @st.cache_data(ttl=600, show_spinner=True)
 def fetch_candles(symbol: str, days: int = 180) -> pd.DataFrame:
     symbol = str(symbol).strip().upper()
@@ -88,122 +125,200 @@ def fetch_candles(symbol: str, days: int = 180) -> pd.DataFrame:
         if isinstance(df.columns, pd.MultiIndex):
             df.columns = df.columns.get_level_values(0)
 
-        df = df.reset_index().rename(columns={
-            "Date": "date",
-            "Open": "open",
-            "High": "high",
-            "Low": "low",
-            "Close": "close",
-            "Volume": "volume"
-        })
-        for c in ["open", "high", "low", "close", "volume"]:
-            df[c] = pd.to_numeric(df[c], errors="coerce")
-        df["underlying_symbol"] = symbol
-        df = df[["underlying_symbol", "date", "open", "high", "low", "close", "volume"]]
-        return df.dropna(subset=["date"]).sort_values("date").reset_index(drop=True)
+        return _formatar_candles(df, symbol)
 
     except Exception as e:
         err(f"Yahoo falhou ({symbol}): {e}")
-        cols = ["underlying_symbol", "date", "open", "high", "low", "close", "volume"]
-        return pd.DataFrame(columns=cols)
+        return pd.DataFrame(columns=_COLS_CANDLES)
+
+
+@st.cache_data(ttl=600, show_spinner=False)
+def fetch_candles_lote(symbols: tuple[str, ...], days: int = 180) -> tuple[pd.DataFrame, dict[str, str]]:
+    """
+    Candles de vários ativos num único yf.download.
+    Retorna (candles concatenados, {symbol: erro}) — sem mensagens na tela.
+    """
+    symbols = tuple(str(s).strip().upper().removesuffix(".SA") for s in symbols)
+    end = datetime.today()
+    start = end - timedelta(days=days)
+
+    erros: dict[str, str] = {}
+    try:
+        df = yf.download(
+            [f"{s}.SA" for s in symbols], start=start, end=end,
+            progress=False, auto_adjust=False, group_by="ticker",
+        )
+    except Exception as e:
+        return pd.DataFrame(columns=_COLS_CANDLES), {s: f"Yahoo falhou: {e}" for s in symbols}
+
+    partes = []
+    for s in symbols:
+        try:
+            if df is None or df.empty or f"{s}.SA" not in df.columns.get_level_values(0):
+                raise RuntimeError("Yahoo sem dados")
+            sub = df[f"{s}.SA"].dropna(how="all")
+            if sub.empty:
+                raise RuntimeError("Yahoo sem dados")
+            partes.append(_formatar_candles(sub, s))
+        except Exception as e:
+            erros[s] = f"Yahoo falhou: {e}"
+
+    at = pd.concat(partes, ignore_index=True) if partes else pd.DataFrame(columns=_COLS_CANDLES)
+    return at, erros
 
 
 # ===============================
 # Fetch opções (Oplab)
 # ===============================
-@st.cache_data(ttl=300, show_spinner=True)
-def fetch_options_snapshot(symbol: str) -> pd.DataFrame:
+_COLS_SNAPSHOT = ["symbol","underlying_symbol","expiration","type","strike","bid","ask","last","close","volume","open_interest","ref_price","snapshot_ts"]
+
+
+def _baixar_snapshot_oplab(symbol: str) -> pd.DataFrame:
     url = f"{OPLAB_BASE_URL}/market/options/{symbol}"
-    try:
-        r = requests.get(url, headers=_headers(), timeout=45)
-        r.raise_for_status()
-        raw = r.json()
-        data = raw if isinstance(raw, list) else raw.get("data", [])
-        df = pd.DataFrame(data)
-        if df.empty:
-            raise RuntimeError("Snapshot vazio")
-
-        rename = {
-            "parent_symbol": "underlying_symbol",
-            "underlying": "underlying_symbol",
-            "due_date": "expiration",
-            "expiration_date": "expiration",
-            "strike_price": "strike",
-            "last_price": "last",
-            "spot_price": "ref_price",
-            "option_symbol": "symbol",
-        }
-        for k, v in rename.items():
-            if k in df.columns and v != k:
-                df.rename(columns={k: v}, inplace=True)
+    r = requests.get(url, headers=_headers(), timeout=45)
+    r.raise_for_status()
+    raw = r.json()
+    data = raw if isinstance(raw, list) else raw.get("data", [])
+    df = pd.DataFrame(data)
+    if df.empty:
+        raise RuntimeError("Snapshot vazio")
+
+    rename = {
+        "parent_symbol": "underlying_symbol",
+        "underlying": "underlying_symbol",
+        "due_date": "expiration",
+        "expiration_date": "expiration",
+        "strike_price": "strike",
+        "last_price": "last",
+        "spot_price": "ref_price",
+        "option_symbol": "symbol",
+    }
+    for k, v in rename.items():
+        if k in df.columns and v != k:
+            df.rename(columns={k: v}, inplace=True)
+
+    needed = ["symbol","underlying_symbol","expiration","type","category","strike",
+              "bid","ask","last","close","volume","open_interest",
+              "ref_price"]
+    for c in needed:
+        if c not in df.columns:
+            df[c] = np.nan
 
-        needed = ["symbol","underlying_symbol","expiration","type","category","strike",
-                  "bid","ask","last","close","volume","open_interest",
-                  "ref_price"]
-        for c in needed:
-            if c not in df.columns:
-                df[c] = np.nan
+    df["expiration"] = pd.to_datetime(df["expiration"], errors="coerce")
+    for c in ["strike","bid","ask","last","close","volume","open_interest","ref_price"]:
+        df[c] = _to_num(df[c])
 
-        df["expiration"] = pd.to_datetime(df["expiration"], errors="coerce")
-        for c in ["strike","bid","ask","last","close","volume","open_interest","ref_price"]:
-            df[c] = _to_num(df[c])
+    if "type" not in df or df["type"].isna().all():
+        df["type"] = df["category"]
+    df["type"] = df["type"].astype(str).str.upper().replace({"C":"CALL","P":"PUT"})
 
-        if "type" not in df or df["type"].isna().all():
-            df["type"] = df["category"]
-        df["type"] = df["type"].astype(str).str.upper().replace({"C":"CALL","P":"PUT"})
+    df["underlying_symbol"] = df["underlying_symbol"].where(df["underlying_symbol"].notna(), symbol)
+    df["underlying_symbol"] = df["underlying_symbol"].astype(str).str.upper()
+    df.loc[df["underlying_symbol"].isin(["NAN", "NONE", "NULL"]), "underlying_symbol"] = symbol
 
-        df["underlying_symbol"] = df["underlying_symbol"].where(df["underlying_symbol"].notna(), symbol)
-        df["underlying_symbol"] = df["underlying_symbol"].astype(str).str.upper()
-        df.loc[df["underlying_symbol"].isin(["NAN", "NONE", "NULL"]), "underlying_symbol"] = symbol
+    # hora do download (UTC): identifica o snapshot nos caches derivados
+    df["snapshot_ts"] = pd.Timestamp.now("UTC").tz_localize(None)
 
-        return df.dropna(subset=["symbol"]).reset_index(drop=True)
+    return df.dropna(subset=["symbol"]).reset_index(drop=True)
 
+
+# Versão em cache que propaga a exceção (erros não ficam em cache)
+_snapshot_oplab = st.cache_data(ttl=300, show_spinner=False)(_baixar_snapshot_oplab)
+
+
+def fetch_options_snapshot(symbol: str) -> pd.DataFrame:
+    try:
+        return _snapshot_oplab(symbol)
     except Exception as e:
         warn(f"Falha ao buscar opções de {symbol}: {e}")
-        cols = ["symbol","underlying_symbol","expiration","type","strike","bid","ask","last","close","volume","open_interest","ref_price"]
-        return pd.DataFrame(columns=cols)
+        return pd.DataFrame(columns=_COLS_SNAPSHOT)
 
 
 # ===============================
-# Black-Scholes + IV local
+# Aquisição concorrente (candles + snapshots)
 # ===============================
-def _bs_price_greeks(S: float, K: float, T: float, r: float, sigma: float, call_put: str):
-    """Retorna (price, delta, gamma, vega, theta, rho)."""
-    if S <= 0 or K <= 0 or T <= 0 or sigma <= 0:
-        return (np.nan,)*6
-    cp = 1 if str(call_put).upper() == "CALL" else -1
-    try:
-        sqrtT = math.sqrt(T)
-        d1 = (math.log(S/K) + (r + 0.5*sigma**2)*T) / (sigma*sqrtT)
-        d2 = d1 - sigma*sqrtT
-
-        price = cp*(S*norm.cdf(cp*d1) - K*math.exp(-r*T)*norm.cdf(cp*d2))
-        delta = cp*norm.cdf(cp*d1)
-        gamma = norm.pdf(d1) / (S*sigma*sqrtT)
-        vega  = S*norm.pdf(d1)*sqrtT
-        theta = (-(S*norm.pdf(d1)*sigma)/(2*sqrtT) - cp*r*K*math.exp(-r*T)*norm.cdf(cp*d2))
-        rho   = cp*K*T*math.exp(-r*T)*norm.cdf(cp*d2)
-        return price, delta, gamma, vega, theta, rho
-    except Exception:
-        return (np.nan,)*6
+MAX_WORKERS_DOWNLOAD = 8
+
+
+def baixar_dados_scanner(
+    symbols: list[str],
+    days: int,
+    max_workers: int = MAX_WORKERS_DOWNLOAD,
+    cache_snapshots: bool = True,
+) -> tuple[pd.DataFrame, pd.DataFrame, dict[str, str]]:
+    """
+    Baixa ao mesmo tempo os candles (um yf.download em lote) e os snapshots
+    Oplab de todos os ativos, num pool limitado de threads.
+    cache_snapshots=False baixa os snapshots sem passar pelo st.cache_data,
+    para que a varredura do mercado inteiro não deixe o universo todo em cache.
+    Retorna (candles, opções, {symbol: erro}); falhas não bloqueiam os demais.
+    """
+    symbols = list(dict.fromkeys(str(s).strip().upper() for s in symbols))
+    erros: dict[str, str] = {}
+    ctx = get_script_run_ctx()
+
+    with ThreadPoolExecutor(
+        max_workers=max(1, min(max_workers, len(symbols) + 1)),
+        initializer=lambda: add_script_run_ctx(threading.current_thread(), ctx),
+    ) as pool:
+        fut_candles = pool.submit(fetch_candles_lote, tuple(symbols), int(days))
+        baixar = _snapshot_oplab if cache_snapshots else _baixar_snapshot_oplab
+        fut_snap = {pool.submit(baixar, s): s for s in symbols}
+
+        dfs_op = {}
+        for fut in as_completed(fut_snap):
+            s = fut_snap[fut]
+            try:
+                dfs_op[s] = fut.result()
+            except Exception as e:
+                erros[s] = f"Oplab falhou: {e}"
 
-def _implied_vol(S, K, T, r, premium, call_put):
-    """IV via Brent."""
-    if not all(pd.notna([S, K, T, r, premium])) or S <= 0 or K <= 0 or T <= 0 or premium <= 0:
-        return np.nan
-    try:
-        return brentq(lambda s: _bs_price_greeks(S, K, T, r, s, call_put)[0] - premium,
-                      1e-3, 5.0, maxiter=100, disp=False)
-    except Exception:
-        return np.nan
+        try:
+            at, erros_candles = fut_candles.result()
+        except Exception as e:
+            at, erros_candles = pd.DataFrame(columns=_COLS_CANDLES), {s: f"Yahoo falhou: {e}" for s in symbols}
+
+    for s, msg in erros_candles.items():
+        erros[s] = f"{erros[s]}; {msg}" if s in erros else msg
+
+    # concatena na ordem pedida, não na de chegada
+    partes = [dfs_op[s] for s in symbols if s in dfs_op]
+    op = pd.concat(partes, ignore_index=True) if partes else pd.DataFrame(columns=_COLS_SNAPSHOT)
+    return at, op, erros
 
 
 # ===============================
 # Contexto de volume do ativo
 # ===============================
+# Cone de vol realizada por ativo, guardado por (último candle, nº de candles)
+_CONES_MAX = 256
+_CONES = CacheLRU(_CONES_MAX)
+
+
+def cones_volatilidade(df_at: pd.DataFrame) -> dict[str, pd.DataFrame]:
+    """{ativo: cone_volatilidade(close)}; só recalcula ativos com candle novo."""
+    if df_at is None or df_at.empty:
+        return {}
+    d = df_at[["underlying_symbol", "date", "close"]].copy()
+    d["date"] = pd.to_datetime(d["date"], errors="coerce")
+    d = d.sort_values(["underlying_symbol", "date"], kind="mergesort")
+    out = {}
+    for sym, g in d.groupby("underlying_symbol", sort=False):
+        assinatura = (g["date"].iat[-1], len(g))
+        atual = _CONES.obter(sym)
+        if atual is not None and atual[0] == assinatura:
+            out[sym] = atual[1]
+            continue
+        cone = cone_volatilidade(_to_num(g["close"]).to_numpy(dtype=float))
+        _CONES.gravar(sym, (assinatura, cone))
+        out[sym] = cone
+    return out
+
+
 def preparar_contexto_ativos(df_at: pd.DataFrame, ma: int = 20) -> pd.DataFrame:
     if df_at is None or df_at.empty:
-        return pd.DataFrame(columns=["underlying_symbol","volume_fin","volfin_ma","vol_acima_ma","last_close"])
+        return pd.DataFrame(columns=["underlying_symbol","volume_fin","volfin_ma","vol_acima_ma","last_close",
+                                     "hv20_pct","iv_rank","iv_percentil","iv_rank_pregoes"])
 
     d = df_at.copy()
     d["date"] = pd.to_datetime(d["date"], errors="coerce")
@@ -214,8 +329,9 @@ def preparar_contexto_ativos(df_at: pd.DataFrame, ma: int = 20) -> pd.DataFrame:
 
     d["volume_fin"] = d["close"] * d["volume"]
     d["volfin_ma"] = (
-        d.groupby("underlying_symbol", group_keys=False)["volume_fin"]
-         .transform(lambda s: pd.Series(s).rolling(ma, min_periods=1).mean().values)
+        d.groupby("underlying_symbol", sort=False)["volume_fin"]
+         .rolling(ma, min_periods=1).mean()
+         .reset_index(level=0, drop=True)
     )
     d["vol_acima_ma"] = (d["volume_fin"] > d["volfin_ma"]).astype(int)
 
@@ -225,26 +341,138 @@ def preparar_contexto_ativos(df_at: pd.DataFrame, ma: int = 20) -> pd.DataFrame:
          .rename(columns={"close":"last_close"})
          .reset_index(drop=True)
     )
-    return last
+    cones = cones_volatilidade(df_at)
+    hv20 = {sym: cone.at[JANELA_HV, "atual"] for sym, cone in cones.items()}
+    last["hv20_pct"] = 100.0 * last["underlying_symbol"].map(hv20).astype(float)
+    # IV rank/percentil de até 252 pregões (iv_rank_pregoes) do histórico gravado
+    # pelo job diário (job_historico_iv.py)
+    return last.merge(ultimo_rank(last["underlying_symbol"]), on="underlying_symbol", how="left")
 
 
 # ===============================
 # Enriquecimento: mid/spread, IV, greeks, etc.
 # ===============================
-def add_features_and_iv(df_opts: pd.DataFrame, price_lookup: dict[str, float] | None, r_annual: float) -> pd.DataFrame:
-    if df_opts is None or df_opts.empty:
-        return df_opts
 
-    d = df_opts.copy()
+# Insumos que, se iguais ao snapshot anterior, permitem reaproveitar a linha enriquecida
+_COLS_DIFF_INCREMENTAL = ["bid","ask","last","close","ref_price","strike","expiration","type"]
+
+# Colunas calculadas linha a linha por _features_por_linha (na ordem em que são criadas)
+_COLS_POR_LINHA = [
+    "mid","spread","spread_rel","dte_calendar","dte_bus","T","r","premium_used","option_type","log_moneyness",
+    "iv_local","iv_status","iv_local_pct",
+    "bs_price","delta","gamma","vega","theta","rho","delta_abs",
+]
+
+# Último book enriquecido por subjacente (modo incremental), compartilhado entre sessões:
+# {ativo: (assinatura, book)} limitado aos _BOOKS_MAX ativos usados mais recentemente
+_BOOKS_MAX = 64
+_BOOKS_ENRIQUECIDOS = CacheLRU(_BOOKS_MAX)
+# colunas que dependem do grupo (underlying, expiration) inteiro
+_COLS_POR_GRUPO = ["iv_pct_local", "iv_superficie_pct"]
+ULTIMO_INCREMENTAL = {"linhas": 0, "recalculadas": 0, "grupos": 0, "grupos_recalculados": 0}
+
 
+def _normalizar_book(d: pd.DataFrame, price_lookup: dict[str, float] | None) -> pd.DataFrame:
     for c in ["bid","ask","last","close","strike","volume","open_interest","ref_price"]:
         d[c] = _to_num(d.get(c))
 
-    d["mid"] = np.where(
+    d["expiration"] = pd.to_datetime(d.get("expiration"), errors="coerce")
+
+    if "ref_price" not in d.columns:
+        d["ref_price"] = np.nan
+    if price_lookup:
+        mask_na = d["ref_price"].isna()
+        if mask_na.any():
+            d.loc[mask_na, "ref_price"] = d.loc[mask_na, "underlying_symbol"].map(price_lookup)
+
+    d["type"] = d["type"].astype(str).str.upper().replace({"C":"CALL","P":"PUT"})
+    return d
+
+
+def _flags_arbitragem(
+    d: pd.DataFrame, r_annual: float, curva: dict | None, exercicio: dict | None = None, dividendos: dict | None = None
+) -> np.ndarray:
+    """
+    Bitmask de não-arbitragem (core.arbitragem) do livro normalizado inteiro,
+    antes do corte de vencimentos do planejador: o calendário compara com o
+    vencimento vizinho mesmo quando ele fica fora da janela. Os proventos da
+    agenda (dividendos, mais os de exercicio) saem do forward da paridade, e as
+    calls dos ativos em exercicio só são testadas no lado que vale para americanas.
+    """
+    venc = d["expiration"]
+    if venc.dt.tz is not None:
+        venc = venc.dt.tz_localize(None)
+    T = np.clip(dias_uteis(date.today(), venc.to_numpy()), 1, None) / 252.0
+    r = _taxas_por_linha(venc, r_annual, curva)
+    agenda = {**(dividendos or {}), **(exercicio or {})}
+    vp_div = np.zeros(len(d))
+    if agenda:
+        tau, valor = matriz_dividendos(d["underlying_symbol"].astype(str).to_numpy(), agenda)
+        vp_div = vp_dividendos(np.zeros(len(d)), T, r, tau, valor)
+    return flags_arbitragem(
+        pd.factorize(d["underlying_symbol"])[0],
+        venc.to_numpy("datetime64[ns]"),
+        d["strike"].to_numpy(dtype=float),
+        (d["type"] == "CALL").to_numpy(),
+        d["bid"].to_numpy(dtype=float),
+        d["ask"].to_numpy(dtype=float),
+        d["ref_price"].to_numpy(dtype=float),
+        T,
+        r,
+        vp_div=vp_div,
+        call_americana=_linhas_americanas(d, exercicio),
+    )
+
+
+def _linhas_americanas(d: pd.DataFrame, exercicio: dict | None) -> np.ndarray:
+    if not exercicio:
+        return np.zeros(len(d), dtype=bool)
+    return d["underlying_symbol"].astype(str).isin(list(exercicio)).to_numpy()
+
+
+def _chave_exercicio(exercicio: dict | None) -> tuple:
+    return tuple(sorted((a, tuple(v)) for a, v in (exercicio or {}).items()))
+
+
+def _chave_curva(curva: dict | None) -> tuple | None:
+    return None if curva is None else curva["chave"]
+
+
+def _taxas_por_linha(venc: pd.Series, r_annual: float, curva: dict | None) -> np.ndarray:
+    """r de cada contrato: da curva DI no vencimento dele ou, sem curva (ou sem vencimento), a taxa fixa."""
+    r = np.full(len(venc), float(r_annual))
+    if curva is not None:
+        r_curva = taxas_continuas(curva, venc.to_numpy("datetime64[ns]"))
+        r = np.where(np.isfinite(r_curva), r_curva, r)
+    return r
+
+
+def _features_por_linha(
+    d: pd.DataFrame,
+    r_annual: float,
+    n_workers: int = 1,
+    filtros: dict | None = None,
+    exercicio: dict | None = None,
+    curva: dict | None = None,
+    compacto: bool = False,
+) -> pd.DataFrame:
+    """
+    curva: curva DI (core.curva_di); cada vencimento usa a taxa interpolada nela
+    em vez de r_annual, que fica só como reserva.
+    compacto: os intermediários (_COLS_INTERMEDIARIAS) ficam em arrays locais em
+    vez de colunas e IV/gregas já entram em float32; os cálculos seguem em float64.
+    exercicio: {ativo: [(data ex, valor), ...]} dos ativos precificados como
+    americanos com dividendos (core.precificacao_americana). Nesses ativos as
+    calls saem da árvore binomial e as puts (europeias) de Black-Scholes sobre
+    S* = S - VP(dividendos); os demais seguem no Black-Scholes com cache de IV.
+    """
+    mid = np.where(
         pd.notna(d["bid"]) & pd.notna(d["ask"]) & (d["bid"]>0) & (d["ask"]>0),
         (d["bid"] + d["ask"]) / 2.0,
         np.where(pd.notna(d["last"]) & (d["last"]>0), d["last"], d["close"])
     )
+    if not compacto:
+        d["mid"] = mid
 
     d["spread"] = np.where(
         (d["bid"] > 0) & (d["ask"] > 0),
@@ -257,62 +485,587 @@ def add_features_and_iv(df_opts: pd.DataFrame, price_lookup: dict[str, float] |
         d["spread"] / d["last"],
         np.nan
     )
+    d["spread_rel"] = d["spread_rel"].fillna(1.0).clip(0, 5)
 
-    hoje = date.today()
-    d["expiration"] = pd.to_datetime(d.get("expiration"), errors="coerce")
-    d["dte_calendar"] = (d["expiration"].dt.date - hoje).apply(
-        lambda x: x.days if pd.notna(x) else np.nan
-    )
+    venc = d["expiration"]
+    if venc.dt.tz is not None:
+        venc = venc.dt.tz_localize(None)
+    d["dte_calendar"] = (venc.dt.normalize() - pd.Timestamp(date.today())).dt.days
 
-    d["dte_bus"] = d["dte_calendar"].clip(lower=1)
+    # pregões até o vencimento no calendário da B3 (T em base 252)
+    d["dte_bus"] = np.clip(dias_uteis(date.today(), venc.to_numpy()), 1, None)
     d["T"] = (d["dte_bus"] / 252.0).clip(lower=1 / 365.0)
+    d["r"] = _taxas_por_linha(venc, r_annual, curva)
+
+    premio = np.where(d["last"]>0, d["last"], np.where(mid>0, mid, d["close"])).astype(float)
+    is_call = (d["type"] != "PUT").to_numpy()
+    if not compacto:
+        d["premium_used"] = premio
+        d["option_type"] = np.where(is_call, "CALL", "PUT")
+
+    S = d["ref_price"].to_numpy(dtype=float)
+    K = d["strike"].to_numpy(dtype=float)
+    T = d["T"].to_numpy(dtype=float)
+    r = d["r"].to_numpy(dtype=float)
+    am = _linhas_americanas(d, exercicio)
+    arvore = np.zeros(len(d), dtype=bool)
+    s_ef = S.copy()
+    if am.any():
+        tau, valor = matriz_dividendos(d["underlying_symbol"].astype(str).to_numpy()[am], exercicio)
+        s_ef[am] = S[am] - vp_dividendos(np.zeros(am.sum()), T[am], r[am], tau, valor)
+        # sem provento até o vencimento a call americana vale o mesmo que a europeia
+        arvore[am] = is_call[am] & ((tau <= T[am, None]) & (valor > 0)).any(axis=1)
+    d["log_moneyness"] = log_moneyness(s_ef, K, T, r)
+
+    iv = np.full(len(d), np.nan)
+    iv_status = np.full(len(d), IV_INVALIDO, dtype=np.int8)
+    eu = ~arvore
+    if eu.any():
+        # vencimento em ns (int) na chave: um Timestamp por contrato pesa ~4x mais no cache
+        venc_ns = d["expiration"].to_numpy("datetime64[ns]").view("int64")
+        chaves = list(zip(d["symbol"][eu], K[eu].tolist(), venc_ns[eu].tolist()))
+        iv[eu], iv_status[eu] = implied_vol_com_cache(
+            chaves, s_ef[eu], K[eu], T[eu], r[eu], premio[eu], is_call[eu],
+            grupos=pd.factorize(d["underlying_symbol"])[0][eu],
+            n_workers=n_workers,
+        )
+    if arvore.any():
+        sel = arvore[am]
+        iv[arvore], iv_status[arvore] = implied_vol_americana(
+            S[arvore], K[arvore], T[arvore], r[arvore], premio[arvore], True, tau[sel], valor[sel]
+        )
+    tipo = np.float32 if compacto else float
+    if not compacto:
+        d["iv_local"] = iv
+    d["iv_status"] = iv_status
+    d["iv_local_pct"] = (iv * 100.0).astype(tipo)
+
+    sigma = iv
+    if filtros is not None:
+        sigma = np.where(_mascara_gregas(d, filtros, r) | am, sigma, np.nan)
+
+    # vega/theta/rho das calls americanas: Black-Scholes sobre S*
+    greeks = list(bs_price_greeks_vec(s_ef, K, T, r, sigma, is_call))
+    if arvore.any():
+        sel = arvore[am]
+        preco, delta, gamma = preco_americano_vec(
+            S[arvore], K[arvore], T[arvore], r[arvore], sigma[arvore], True, tau[sel], valor[sel]
+        )
+        for i, valores in zip([0, 1, 2], [preco, delta, gamma]):
+            greeks[i][arvore] = valores
+    for nome, valores in zip(["bs_price","delta","gamma","vega","theta","rho"], greeks):
+        if nome != "bs_price" or not compacto:
+            d[nome] = valores.astype(tipo)
+    d["delta_abs"] = np.abs(greeks[1]).astype(tipo)
+    return d
 
-    if "ref_price" not in d.columns:
-        d["ref_price"] = np.nan
-    if price_lookup:
-        mask_na = d["ref_price"].isna()
-        if mask_na.any():
-            d.loc[mask_na, "ref_price"] = d.loc[mask_na, "underlying_symbol"].map(price_lookup)
 
-    d["premium_used"] = np.where(d["last"]>0, d["last"], np.where(d["mid"]>0, d["mid"], d["close"]))
+# ===============================
+# Planejador: filtros baratos antes do enriquecimento
+# ===============================
+ULTIMO_PLANO = {"linhas": 0, "com_iv": 0, "com_gregas": 0}
+
+
+def _mascara_grupos(d: pd.DataFrame, filtros: dict) -> np.ndarray:
+    """
+    Janela de vencimento de aplicar_filtros. Elimina grupos (underlying, expiration)
+    inteiros, então o percentil de IV dos grupos que ficam não muda.
+    """
+    return d["expiration"].between(
+        pd.to_datetime(filtros["venc_ini"]), pd.to_datetime(filtros["venc_fim"])
+    ).to_numpy()
+
+
+def _faixa_delta_abs(S, K, T, r, is_call) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Menor e maior |delta| alcançáveis com sigma em [IV_MIN, IV_MAX].
+    d1(sigma) = a/(sigma*sqrt(T)) + sigma*sqrt(T)/2, com a = ln(S/K) + rT:
+    crescente para a <= 0; convexa com mínimo sqrt(2a) em sigma* = sqrt(2a/T) para a > 0.
+    """
+    with np.errstate(all="ignore"):
+        sT = np.sqrt(T)
+        a = np.log(S / K) + r * T
+        d1_lo = a / (IV_MIN * sT) + IV_MIN * sT / 2
+        d1_hi = a / (IV_MAX * sT) + IV_MAX * sT / 2
+        d1_min = np.minimum(d1_lo, d1_hi)
+        s_otimo = np.sqrt(2 * np.maximum(a, 0)) / sT
+        interior = (a > 0) & (s_otimo > IV_MIN) & (s_otimo < IV_MAX)
+        d1_min = np.where(interior, np.minimum(d1_min, np.sqrt(2 * np.maximum(a, 0))), d1_min)
+        d1_max = np.maximum(d1_lo, d1_hi)
+
+    lo = np.where(is_call, ndtr(d1_min), ndtr(-d1_max))
+    hi = np.where(is_call, ndtr(d1_max), ndtr(-d1_min))
+    return lo, hi
+
+
+def _mascara_gregas(d: pd.DataFrame, filtros: dict, r) -> np.ndarray:
+    """
+    Linhas que ainda podem passar em aplicar_filtros: bid/ask > 0, tipo pedido e
+    moneyness compatível com a faixa de delta (limite conservador via _faixa_delta_abs).
+    """
+    ok = ((d["bid"] > 0) & (d["ask"] > 0)).to_numpy()
+    if filtros.get("tipo_opcao") in ("CALL", "PUT"):
+        ok = ok & (d["type"] == filtros["tipo_opcao"]).to_numpy()
+    if filtros.get("excluir_arbitragem") and "arb_flags" in d.columns:
+        ok = ok & (d["arb_flags"] == 0).to_numpy()
+
+    lo, hi = _faixa_delta_abs(
+        d["ref_price"].to_numpy(dtype=float),
+        d["strike"].to_numpy(dtype=float),
+        d["T"].to_numpy(dtype=float),
+        np.asarray(r, dtype=float),
+        (d["type"] != "PUT").to_numpy(),
+    )
+    folga = 1e-9
+    ok = ok & (hi >= filtros["delta_min"] - folga) & (lo <= filtros["delta_max"] + folga)
+    return ok
 
-    d["type"] = d["type"].astype(str).str.upper().replace({"C":"CALL","P":"PUT"})
-    d["option_type"] = np.where(d["type"].isin(["CALL","PUT"]), d["type"], "CALL")
 
-    d["iv_local"] = d.apply(
-        lambda r: _implied_vol(r["ref_price"], r["strike"], r["T"], r_annual, r["premium_used"], r["option_type"]),
-        axis=1
+def _iv_pct_local(d: pd.DataFrame) -> pd.Series:
+    # IVs presas nos limites de não-arbitragem não entram no percentil
+    return (
+        d["iv_local_pct"].where(d["iv_status"] == IV_OK)
+         .groupby([d["underlying_symbol"], d["expiration"]])
+         .rank(pct=True, method="average")
+        * 100
     )
-    d["iv_local_pct"] = d["iv_local"] * 100.0
-
-    greeks = d.apply(
-        lambda r: pd.Series(
-            _bs_price_greeks(
-                r["ref_price"],
-                r["strike"],
-                r["T"],
-                r_annual,
-                r["iv_local"] if pd.notna(r["iv_local"]) and r["iv_local"]>0 else np.nan,
-                r["option_type"]
-            ),
-            index=["bs_price","delta","gamma","vega","theta","rho"]
-        ),
-        axis=1
+
+
+SPREAD_REL_MAX_SMILE = 0.5
+
+
+def _grupos_smile(d: pd.DataFrame) -> tuple[np.ndarray, int]:
+    g = d.groupby(["underlying_symbol", "expiration"], sort=False, observed=True).ngroup().to_numpy()
+    return g, int(g.max()) + 1 if len(g) else 0
+
+
+def _pontos_smile(d: pd.DataFrame) -> np.ndarray:
+    """Contratos que entram no ajuste: IV resolvida, bid/ask, spread razoável e fora do dinheiro."""
+    k = d["log_moneyness"].to_numpy(dtype=float)
+    call = (d["type"] == "CALL").to_numpy()
+    return (
+        (d["iv_status"] == IV_OK).to_numpy()
+        & ((d["bid"] > 0) & (d["ask"] > 0)).to_numpy()
+        & (d["spread_rel"] <= SPREAD_REL_MAX_SMILE).to_numpy()
+        & np.where(call, k >= 0, k < 0)
     )
 
-    d = pd.concat([d, greeks], axis=1)
-    d["delta_abs"] = d["delta"].abs()
 
-    d["iv_pct_local"] = (
-        d.groupby(["underlying_symbol","expiration"])["iv_local_pct"]
-         .transform(lambda s: 100*s.rank(pct=True, method="average"))
+def _superficie_local(d: pd.DataFrame) -> pd.Series:
+    """IV (%) do smile ajustado no grupo (underlying, expiration) de cada contrato."""
+    g, n_grupos = _grupos_smile(d)
+    if n_grupos == 0:
+        return pd.Series(np.nan, index=d.index)
+    k = d["log_moneyness"].to_numpy(dtype=float)
+    iv = np.where(_pontos_smile(d), d["iv_local_pct"].to_numpy(dtype=float) / 100.0, np.nan)
+    ajuste = ajustar_smiles(k, iv, g, n_grupos)
+    return pd.Series(100.0 * avaliar_smiles(ajuste, g, k), index=d.index)
+
+
+def resumo_superficie(book: pd.DataFrame) -> pd.DataFrame:
+    """
+    Por (underlying, expiration), numa passada pelo livro: IV ATM do smile,
+    IVs 25Δ, risk reversal (call 25Δ - put 25Δ), butterfly
+    ((call 25Δ + put 25Δ)/2 - ATM), inclinação, curvatura e pontos usados.
+    """
+    if book is None or book.empty or "log_moneyness" not in book.columns:
+        return pd.DataFrame()
+    g, n_grupos = _grupos_smile(book)
+    if n_grupos == 0:
+        return pd.DataFrame()
+    iv = np.where(_pontos_smile(book), book["iv_local_pct"].to_numpy(dtype=float) / 100.0, np.nan)
+    ajuste = ajustar_smiles(book["log_moneyness"].to_numpy(dtype=float), iv, g, n_grupos)
+    r = resumo_smiles(ajuste)
+
+    primeira = pd.Series(np.arange(len(g))).groupby(g).first()
+    primeira = primeira[primeira.index >= 0]
+    base = book.iloc[primeira.to_numpy()]
+    T = np.full(n_grupos, np.nan)
+    T[primeira.index] = base["T"].to_numpy(dtype=float)
+    call25 = iv_por_delta(ajuste, T, 0.25)
+    put25 = iv_por_delta(ajuste, T, 0.75)
+
+    sel = primeira.index
+    out = pd.DataFrame({
+        "underlying_symbol": base["underlying_symbol"].astype(str).to_numpy(),
+        "expiration": base["expiration"].to_numpy(),
+        "dte_bus": base["dte_bus"].to_numpy(),
+        "iv_atm_pct": 100.0 * r["iv_atm"][sel],
+        "iv_call25_pct": 100.0 * call25[sel],
+        "iv_put25_pct": 100.0 * put25[sel],
+        "rr25_pct": 100.0 * (call25 - put25)[sel],
+        "bf25_pct": 100.0 * (0.5 * (call25 + put25) - r["iv_atm"])[sel],
+        "skew": r["skew"][sel],
+        "curvatura": r["curvatura"][sel],
+        "pontos": r["pontos"][sel],
+    })
+    return out.sort_values(["underlying_symbol", "expiration"]).reset_index(drop=True)
+
+
+_PAINEIS_MAX = 16
+_PAINEIS = CacheLRU(_PAINEIS_MAX)
+ULTIMO_PAINEL = {"reuso": False}
+
+
+def _assinatura_snapshots(book: pd.DataFrame) -> tuple:
+    """Tamanho do livro e (min, max) do snapshot_ts de cada ativo."""
+    ts = book.groupby("underlying_symbol", observed=True)["snapshot_ts"].agg(["min", "max"])
+    return len(book), tuple(ts.itertuples(name=None))
+
+
+def _chave_snapshots(book: pd.DataFrame, r_annual: float, curva: dict | None) -> tuple:
+    """Identifica o livro pelos snapshots de cada ativo, juros/curva e dia (chave dos painéis)."""
+    return (float(r_annual), _chave_curva(curva), date.today()) + _assinatura_snapshots(book)
+
+
+def painel_superficie(book: pd.DataFrame, r_annual: float, curva: dict | None = None) -> pd.DataFrame:
+    """
+    resumo_superficie com cache por (snapshot de cada ativo, juros/curva, dia): rerun
+    ou nova varredura que cai nos mesmos snapshots não refaz os ajustes.
+    """
+    if book is None or book.empty or "snapshot_ts" not in book.columns:
+        ULTIMO_PAINEL["reuso"] = False
+        return resumo_superficie(book)
+
+    chave = _chave_snapshots(book, r_annual, curva)
+    painel = _PAINEIS.obter(chave)
+    ULTIMO_PAINEL["reuso"] = painel is not None
+    if painel is None:
+        painel = resumo_superficie(book)
+        _PAINEIS.gravar(chave, painel)
+    return painel
+
+
+def exposicao_gama(book: pd.DataFrame) -> dict[str, pd.DataFrame]:
+    """
+    GEX dos dealers por ativo (core.exposicao_gama), numa passada pelo livro:
+    "resumo" (spot, GEX total, nível de flip), "por_strike" (GEX de calls, puts
+    e líquido por strike, com o gamma do livro) e "perfil" (GEX total com o
+    ativo em cada ponto da grade, Γ reavaliado com a IV de cada contrato).
+    """
+    vazio = {"resumo": pd.DataFrame(), "por_strike": pd.DataFrame(), "perfil": pd.DataFrame()}
+    if book is None or book.empty or "open_interest" not in book.columns:
+        return vazio
+    d = book.loc[_to_num(book["open_interest"]).fillna(0).gt(0).to_numpy()]
+    if d.empty:
+        return vazio
+
+    cod, ativos = pd.factorize(d["underlying_symbol"].astype(str))
+    S = d["ref_price"].to_numpy(dtype=float)
+    K = d["strike"].to_numpy(dtype=float)
+    T = d["T"].to_numpy(dtype=float)
+    r = d["r"].to_numpy(dtype=float)
+    oi = _to_num(d["open_interest"]).to_numpy(dtype=float)
+    is_call = (d["type"] == "CALL").to_numpy()
+    sigma = d["iv_local_pct"].astype(float).fillna(d["iv_superficie_pct"].astype(float)).to_numpy() / 100.0
+
+    # Γ do livro (árvore nas calls americanas); onde o planejador não calculou, Γ de BS com a IV
+    gamma = np.array(d["gamma"], dtype=float)
+    falta = ~np.isfinite(gamma)
+    if falta.any():
+        gamma[falta] = bs_price_greeks_vec(S[falta], K[falta], T[falta], r[falta], sigma[falta], is_call[falta])[2]
+    gex = gex_contratos(gamma, oi, S, is_call)
+
+    g, strike, gex_call, gex_put = gex_por_strike(cod, K, gex, is_call)
+    por_strike = pd.DataFrame({
+        "underlying_symbol": ativos.to_numpy()[g],
+        "strike": strike,
+        "gex_call": gex_call,
+        "gex_put": gex_put,
+        "gex": gex_call + gex_put,
+    })
+
+    spots, perfil = perfil_gex(cod, len(ativos), S, K, T, r, sigma, oi, is_call)
+    spot = spots[:, len(spots[0]) // 2]
+    resumo = pd.DataFrame({
+        "underlying_symbol": ativos.to_numpy(),
+        "spot": spot,
+        "gex_total": np.bincount(cod, weights=gex, minlength=len(ativos)),
+        "flip": nivel_flip(spots, perfil, spot),
+    })
+    perfil_df = pd.DataFrame({
+        "underlying_symbol": np.repeat(ativos.to_numpy(), spots.shape[1]),
+        "spot": spots.ravel(),
+        "gex": perfil.ravel(),
+    })
+    return {"resumo": resumo, "por_strike": por_strike, "perfil": perfil_df}
+
+
+_GEX = CacheLRU(_PAINEIS_MAX)
+
+
+def painel_gex(book: pd.DataFrame, r_annual: float, curva: dict | None = None) -> dict[str, pd.DataFrame]:
+    """exposicao_gama com o mesmo cache por snapshot de painel_superficie."""
+    if book is None or book.empty or "snapshot_ts" not in book.columns:
+        return exposicao_gama(book)
+    chave = _chave_snapshots(book, r_annual, curva)
+    painel = _GEX.obter(chave)
+    if painel is None:
+        painel = exposicao_gama(book)
+        _GEX.gravar(chave, painel)
+    return painel
+
+
+def max_pain_oi(book: pd.DataFrame) -> dict[str, pd.DataFrame]:
+    """
+    Max pain e perfil de open interest por (ativo, vencimento) (core.max_pain):
+    "por_venc" (max pain, OI de calls e puts, put/call de OI) e "por_strike"
+    (OI de calls e puts e dor dos titulares em cada strike).
+    """
+    vazio = {"por_venc": pd.DataFrame(), "por_strike": pd.DataFrame()}
+    if book is None or book.empty or "open_interest" not in book.columns:
+        return vazio
+    d = book.loc[(book["expiration"].notna() & _to_num(book["strike"]).gt(0)).to_numpy()]
+    if d.empty:
+        return vazio
+
+    cod_ativo, ativos = pd.factorize(d["underlying_symbol"].astype(str))
+    cod_venc, vencs = pd.factorize(d["expiration"])
+    pares, cod = np.unique(cod_ativo * len(vencs) + cod_venc, return_inverse=True)
+    grupos = pd.MultiIndex.from_arrays([ativos[pares // len(vencs)], vencs[pares % len(vencs)]])
+    p = perfil_oi(
+        cod,
+        d["strike"].to_numpy(dtype=float),
+        _to_num(d["open_interest"]).to_numpy(dtype=float),
+        (d["type"] == "CALL").to_numpy(),
     )
+    g, strike_mp = max_pain(p["grupo"], p["strike"], p["dor"])
+    oi_call = np.bincount(p["grupo"], weights=p["oi_call"], minlength=len(grupos))
+    oi_put = np.bincount(p["grupo"], weights=p["oi_put"], minlength=len(grupos))
+    with np.errstate(divide="ignore", invalid="ignore"):
+        pcr = np.where(oi_call > 0, oi_put / oi_call, np.nan)
+
+    por_venc = pd.DataFrame({
+        "underlying_symbol": grupos.get_level_values(0)[g],
+        "expiration": grupos.get_level_values(1)[g],
+        "max_pain": np.where(oi_call[g] + oi_put[g] > 0, strike_mp, np.nan),
+        "oi_call": oi_call[g],
+        "oi_put": oi_put[g],
+        "pcr_oi": pcr[g],
+    })
+    por_strike = pd.DataFrame({
+        "underlying_symbol": grupos.get_level_values(0)[p["grupo"]],
+        "expiration": grupos.get_level_values(1)[p["grupo"]],
+        "strike": p["strike"],
+        "oi_call": p["oi_call"],
+        "oi_put": p["oi_put"],
+        "dor": p["dor"],
+    })
+    return {"por_venc": por_venc, "por_strike": por_strike}
 
-    d["spread_rel"] = d["spread_rel"].fillna(1.0).clip(0, 5)
 
+_OI = CacheLRU(_PAINEIS_MAX)
+
+
+def painel_oi(book: pd.DataFrame) -> dict[str, pd.DataFrame]:
+    """max_pain_oi com cache por snapshot de cada ativo (só strikes e OI entram no cálculo)."""
+    if book is None or book.empty or "snapshot_ts" not in book.columns:
+        return max_pain_oi(book)
+    chave = _assinatura_snapshots(book)
+    painel = _OI.obter(chave)
+    if painel is None:
+        painel = max_pain_oi(book)
+        _OI.gravar(chave, painel)
+    return painel
+
+
+def _colunas_max_pain(d: pd.DataFrame) -> pd.DataFrame:
+    """max_pain, dist_max_pain_pct (max pain vs spot) e pcr_oi do vencimento de cada contrato."""
+    por_venc = painel_oi(d)["por_venc"]
+    cols = ["max_pain", "pcr_oi"]
+    if por_venc.empty:
+        valores = {c: np.full(len(d), np.nan) for c in cols}
+    else:
+        idx = pd.MultiIndex.from_frame(por_venc[["underlying_symbol", "expiration"]]).get_indexer(
+            pd.MultiIndex.from_arrays([d["underlying_symbol"].astype(str), d["expiration"]])
+        )
+        valores = {c: np.where(idx >= 0, por_venc[c].to_numpy(dtype=float)[idx], np.nan) for c in cols}
+    d["max_pain"] = valores["max_pain"]
+    d["dist_max_pain_pct"] = 100.0 * (valores["max_pain"] / d["ref_price"].to_numpy(dtype=float) - 1.0)
+    d["pcr_oi"] = valores["pcr_oi"]
     return d
 
 
+def _mesmos_valores(a: pd.Series, b: pd.Series) -> np.ndarray:
+    return ((a == b) | (a.isna() & b.isna())).to_numpy()
+
+
+def _enriquecer_incremental(
+    d: pd.DataFrame, r_annual: float, n_workers: int = 1, exercicio: dict | None = None, curva: dict | None = None
+) -> pd.DataFrame:
+    """
+    Reaproveita as linhas do último book enriquecido de cada subjacente cujos
+    insumos (_COLS_DIFF_INCREMENTAL) não mudaram; recalcula só o resto.
+    O percentil de IV e o smile são refeitos apenas nos grupos (underlying, expiration) tocados.
+    Só os _BOOKS_MAX ativos mais recentes ficam guardados; além disso o livro é recalculado.
+    """
+    assinatura = (date.today(), r_annual, _chave_exercicio(exercicio), _chave_curva(curva))
+    unds = d["underlying_symbol"].unique()
+    anteriores = [
+        book for u in unds
+        for (assin, book) in [_BOOKS_ENRIQUECIDOS.obter(u, (None, None))]
+        if assin == assinatura
+    ]
+
+    if anteriores:
+        prev = pd.concat(anteriores).drop_duplicates("symbol", keep="last").set_index("symbol")
+    else:
+        prev = pd.DataFrame(columns=["underlying_symbol"] + _COLS_DIFF_INCREMENTAL + _COLS_POR_LINHA + _COLS_POR_GRUPO)
+    alinhado = prev.reindex(d["symbol"].to_numpy())
+    alinhado.index = d.index
+
+    iguais = d["symbol"].isin(prev.index).to_numpy().copy()
+    for c in _COLS_DIFF_INCREMENTAL:
+        iguais &= _mesmos_valores(d[c], alinhado[c])
+
+    partes = []
+    if iguais.any():
+        reuso = d.loc[iguais].copy()
+        for c in _COLS_POR_LINHA:
+            reuso[c] = alinhado.loc[iguais, c].astype(prev[c].dtype)
+        partes.append(reuso)
+    if not iguais.all():
+        partes.append(_features_por_linha(d.loc[~iguais].copy(), r_annual, n_workers, exercicio=exercicio, curva=curva))
+    out = pd.concat(partes).loc[d.index] if len(partes) > 1 else partes[0]
+    out["iv_status"] = out["iv_status"].astype(np.int8)
+
+    grupos = pd.MultiIndex.from_arrays([out["underlying_symbol"], out["expiration"]])
+    removidos = prev.loc[~prev.index.isin(d["symbol"])]
+    tocados = grupos[~iguais].union(
+        pd.MultiIndex.from_arrays([removidos["underlying_symbol"], removidos["expiration"]])
+    )
+    mask_tocado = grupos.isin(tocados)
+
+    pct = alinhado["iv_pct_local"].astype(float)
+    sup = alinhado["iv_superficie_pct"].astype(float)
+    if mask_tocado.any():
+        pct[mask_tocado] = _iv_pct_local(out.loc[mask_tocado])
+        sup[mask_tocado] = _superficie_local(out.loc[mask_tocado])
+    out["iv_pct_local"] = pct
+    out["iv_superficie_pct"] = sup
+
+    cols = ["symbol","underlying_symbol"] + _COLS_DIFF_INCREMENTAL + _COLS_POR_LINHA + _COLS_POR_GRUPO
+    for u, book_u in out.groupby("underlying_symbol", sort=False, observed=True):
+        _BOOKS_ENRIQUECIDOS.gravar(u, (assinatura, book_u[cols].reset_index(drop=True)))
+
+    ULTIMO_INCREMENTAL.update({
+        "linhas": len(out),
+        "recalculadas": int((~iguais).sum()),
+        "grupos": int(grupos.nunique()),
+        "grupos_recalculados": int(grupos[mask_tocado].nunique()),
+    })
+    return out
+
+
+def add_features_and_iv(
+    df_opts: pd.DataFrame,
+    price_lookup: dict[str, float] | None,
+    r_annual: float,
+    incremental: bool = False,
+    n_workers: int = 1,
+    filtros: dict | None = None,
+    compacto: bool = False,
+    exercicio: dict | None = None,
+    curva: dict | None = None,
+    dividendos: dict | None = None,
+) -> pd.DataFrame:
+    """
+    incremental: reaproveita linhas inalteradas do último snapshot de cada subjacente.
+    n_workers: > 1 resolve a IV num pool de processos, em shards por subjacente
+    (livros abaixo de MIN_LINHAS_PARALELO seguem no caminho serial).
+    filtros: kwargs de aplicar_filtros — planeja o enriquecimento para eles.
+    Vencimentos fora da janela nem entram no livro; nos grupos restantes a IV é
+    resolvida para todos (o percentil local depende do grupo inteiro), mas as
+    gregas só para quem ainda pode passar. aplicar_filtros(livro, **filtros)
+    devolve o mesmo que sem o planejador; o livro em si serve só para esses filtros.
+    compacto: devolve o livro no layout de compactar_book. Reduz a memória do
+    livro que fica guardado (~330 -> ~185 B/contrato), não o pico do cálculo:
+    fora do modo incremental os intermediários nem viram colunas e IV/gregas já
+    nascem em float32, mas o pico (~900 B/contrato em benchmarks.py memoria)
+    vem da resolução da IV e das chaves/entradas do IV_CACHE, iguais nos dois layouts.
+    exercicio: {ativo: agenda de dividendos} dos ativos com calls americanas
+    (ver _features_por_linha).
+    curva: curva DI de core.curva_di — juros por vencimento (coluna r) em vez
+    da taxa fixa r_annual.
+    A coluna arb_flags traz as violações de não-arbitragem de cada contrato
+    (bitmask ARB_* de core.arbitragem), calculadas sempre sobre o livro inteiro;
+    dividendos: agenda de proventos de todos os ativos, descontada do forward da paridade;
+    max_pain, dist_max_pain_pct e pcr_oi vêm do vencimento de cada contrato (painel_oi).
+    """
+    if df_opts is None or df_opts.empty:
+        return df_opts
+    if incremental and filtros is not None:
+        raise ValueError("Modo incremental não combina com filtros planejados.")
+
+    d = _normalizar_book(df_opts.copy(), price_lookup)
+    d["arb_flags"] = _flags_arbitragem(d, r_annual, curva, exercicio, dividendos)
+    d = _colunas_max_pain(d)
+
+    if filtros is not None:
+        total = len(d)
+        d = d.loc[_mascara_grupos(d, filtros)]
+        if d.empty:
+            ULTIMO_PLANO.update({"linhas": total, "com_iv": 0, "com_gregas": 0})
+            return d
+
+    if incremental:
+        idx_orig = d.index
+        d = _enriquecer_incremental(d.reset_index(drop=True), r_annual, n_workers, exercicio, curva)
+        d.index = idx_orig
+        return compactar_book(d) if compacto else d
+
+    d = _features_por_linha(d, r_annual, n_workers, filtros, exercicio, curva, compacto)
+    d["iv_pct_local"] = _iv_pct_local(d)
+    d["iv_superficie_pct"] = _superficie_local(d)
+
+    if filtros is not None:
+        ULTIMO_PLANO.update({"linhas": total, "com_iv": len(d), "com_gregas": int(d["delta"].notna().sum())})
+    # d já é cópia local e veio sem os intermediários: converte coluna a coluna, sem copiar o livro
+    return _converter_tipos(d) if compacto else d
+
+
+# Intermediários que só servem ao cálculo (mid/premium_used/bs_price/iv_local/option_type)
+_COLS_INTERMEDIARIAS = ["mid", "premium_used", "bs_price", "iv_local", "option_type"]
+_COLS_CATEGORICAS = ["underlying_symbol", "type"]
+_COLS_FLOAT32 = [
+    "iv_local_pct", "iv_pct_local", "delta", "gamma", "vega", "theta", "rho", "delta_abs",
+    "spread", "spread_rel", "T", "r", "dte_calendar", "dte_bus", "log_moneyness", "iv_superficie_pct",
+    "volume_fin_acao", "volfin_ma_acao", "hv20_pct", "iv_rank", "iv_percentil",
+    "iv_rank_pregoes", "dist_max_pain_pct", "pcr_oi",
+]
+
+
+def compactar_book(d: pd.DataFrame) -> pd.DataFrame:
+    """
+    Layout compacto do livro enriquecido: sem os intermediários, subjacente e
+    tipo como category, gregas/razões em float32 e iv_status em int8. Preços,
+    strike e volume ficam em float64 (entram em chaves e filtros exatos).
+    `symbol` fica como está: é único por contrato, category não economiza nada.
+    """
+    if d is None or d.empty:
+        return d
+    return _converter_tipos(d.drop(columns=[c for c in _COLS_INTERMEDIARIAS if c in d.columns]))
+
+
+def _converter_tipos(x: pd.DataFrame) -> pd.DataFrame:
+    """Tipos de compactar_book aplicados em x, no lugar e só nas colunas que ainda não os têm."""
+    tipos = {c: "category" for c in _COLS_CATEGORICAS if c in x.columns}
+    tipos.update({c: np.float32 for c in _COLS_FLOAT32 if c in x.columns})
+    if "iv_status" in x.columns:
+        tipos["iv_status"] = np.int8
+    for c, tipo in tipos.items():
+        if x[c].dtype != tipo:
+            x[c] = x[c].astype(tipo)
+    return x
+
+
+def memoria_por_contrato(d: pd.DataFrame) -> float:
+    """Bytes por linha do livro (memory_usage profundo, inclui strings)."""
+    if d is None or d.empty:
+        return 0.0
+    return float(d.memory_usage(deep=True).sum()) / len(d)
+
+
 # ===============================
 # Filtros e ranking
 # ===============================
@@ -326,7 +1079,9 @@ def aplicar_filtros(
     iv_pct_max: float,
     min_volume_opt: float,
     max_spread_rel: float,
-    exigir_vol_acima: bool
+    exigir_vol_acima: bool,
+    iv_rank_max: float = 100.0,
+    excluir_arbitragem: bool = False,
 ) -> pd.DataFrame:
 
     if d is None or d.empty:
@@ -357,6 +1112,12 @@ def aplicar_filtros(
         & (x["spread_rel"].fillna(1.0) <= max_spread_rel)
         & x["T"].gt(0)
     )
+    if iv_rank_max < 100 and "iv_rank" in x.columns:
+        # sem histórico suficiente o ativo não passa
+        cond &= x["iv_rank"].le(iv_rank_max)
+    if excluir_arbitragem and "arb_flags" in x.columns:
+        # cotação que viola paridade, monotonia, borboleta ou calendário
+        cond &= x["arb_flags"].eq(0)
 
     return x.loc[cond.fillna(False)].copy()
 
@@ -371,37 +1132,78 @@ def _norm01(s: pd.Series, invert: bool = False) -> pd.Series:
     return (1 - n) if invert else n
 
 
-def rankear(d: pd.DataFrame, delta_target=0.45, exigir_vol_acima=False) -> pd.DataFrame:
-    if d is None or d.empty:
-        return d
+_FATORES_INVERTIDOS = (True, False, True, True)
 
-    x = d.copy().reset_index(drop=True)
 
-    def _norm01_local(s: pd.Series, invert: bool = False) -> pd.Series:
-        s = _to_num(s)
-        if s.nunique(dropna=True) <= 1:
-            n = pd.Series(0.5, index=s.index)
+def _fatores_brutos(x: pd.DataFrame, delta_target: float) -> np.ndarray:
+    return np.column_stack([
+        _to_num(x["iv_pct_local"]).to_numpy(dtype=float),
+        _to_num(x["volume"]).to_numpy(dtype=float),
+        _to_num((x["delta_abs"] - delta_target).abs()).to_numpy(dtype=float),
+        _to_num(x["spread_rel"]).to_numpy(dtype=float),
+    ])
+
+
+def _min_max_fatores(f: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """Mínimo/máximo por coluna ignorando NaN (inf/-inf se a coluna não tem valor)."""
+    if len(f) == 0:
+        return np.full(f.shape[1], np.inf), np.full(f.shape[1], -np.inf)
+    nan = np.isnan(f)
+    return np.where(nan, np.inf, f).min(axis=0), np.where(nan, -np.inf, f).max(axis=0)
+
+
+def _normalizar_fatores(
+    f: np.ndarray, mn: np.ndarray, mx: np.ndarray, invertidos=_FATORES_INVERTIDOS
+) -> np.ndarray:
+    """Mesma regra de _norm01, coluna a coluna, com mínimo/máximo dados (1 = melhor)."""
+    out = np.empty_like(f)
+    for j, inverter in enumerate(invertidos):
+        if not np.isfinite(mn[j]) or mn[j] == mx[j]:       # nunique <= 1
+            v = np.full(len(f), 0.5)
         else:
-            n = (s - s.min()) / (s.max() - s.min() + 1e-12)
-        n = n.fillna(0.5)
-        return (1 - n) if invert else n
-
-    x["score_base"] = (
-        0.40 * _norm01_local(x["iv_pct_local"], invert=True) +
-        0.30 * _norm01_local(x["volume"]) +
-        0.20 * _norm01_local((x["delta_abs"] - delta_target).abs(), invert=True) +
-        0.10 * _norm01_local(x["spread_rel"], invert=True)
-    )
+            v = (f[:, j] - mn[j]) / (mx[j] - mn[j] + 1e-12)
+            v = np.where(np.isnan(v), 0.5, v)
+        out[:, j] = 1 - v if inverter else v
+    return out
+
+
+def matriz_fatores(x: pd.DataFrame, delta_target: float = 0.45) -> np.ndarray:
+    """Fatores do score normalizados sobre `x` (n x 4, na ordem de PESOS_SCORE)."""
+    f = _fatores_brutos(x, delta_target)
+    return _normalizar_fatores(f, *_min_max_fatores(f))
 
-    if exigir_vol_acima and {"volume_fin", "volfin_ma"}.issubset(x.columns):
-        ratio = (x["volume_fin"] / x["volfin_ma"]).replace([np.inf, -np.inf], np.nan)
-        ratio = ratio.clip(lower=0.5, upper=2.0)
-        bonus = (ratio - 1.0) * 0.25
-        x["score"] = np.clip(x["score_base"] * (1 + bonus), 0, None)
-    else:
-        x["score"] = x["score_base"]
 
-    return x.sort_values("score", ascending=False)
+def _pontuar(F: np.ndarray, x: pd.DataFrame, pesos=PESOS_SCORE, exigir_vol_acima=False) -> tuple[np.ndarray, np.ndarray]:
+    """(score_base, score) a partir da matriz de fatores; o bônus de volume só muda o score."""
+    score_base = pesos[0] * F[:, 0]
+    for j in range(1, F.shape[1]):
+        score_base = score_base + pesos[j] * F[:, j]
+
+    mult = _mult_volume(x, exigir_vol_acima)
+    score = score_base if mult is None else np.clip(score_base * mult, 0, None)
+    return score_base, score
+
+
+def _mult_volume(x: pd.DataFrame, exigir_vol_acima=False) -> np.ndarray | None:
+    """Multiplicador do bônus de volume (volume financeiro do ativo / MM20), ou None sem bônus."""
+    if not (exigir_vol_acima and {"volume_fin_acao", "volfin_ma_acao"}.issubset(x.columns)):
+        return None
+    ratio = x["volume_fin_acao"].astype(float) / x["volfin_ma_acao"].astype(float)
+    ratio = ratio.replace([np.inf, -np.inf], np.nan)
+    ratio = ratio.clip(lower=0.5, upper=2.0).to_numpy(dtype=float)
+    return 1 + (ratio - 1.0) * BONUS_VOLUME
+
+
+def rankear(d: pd.DataFrame, delta_target=0.45, exigir_vol_acima=False, pesos=PESOS_SCORE) -> pd.DataFrame:
+    if d is None or d.empty:
+        return d
+
+    x = d.copy().reset_index(drop=True)
+    F = matriz_fatores(x, delta_target)
+    x[COLS_FATORES] = F
+    x["score_base"], x["score"] = _pontuar(F, x, pesos, exigir_vol_acima)
+
+    return x.sort_values("score", ascending=False, kind="mergesort")
 
 
 def top_por_venc(d: pd.DataFrame, n: int = 5) -> pd.DataFrame:
@@ -414,6 +1216,473 @@ def top_por_venc(d: pd.DataFrame, n: int = 5) -> pd.DataFrame:
     )
 
 
+def top_por_venc_fatores(
+    x: pd.DataFrame,
+    F: np.ndarray,
+    n: int = 5,
+    pesos=PESOS_SCORE,
+    exigir_vol_acima: bool = False,
+    cols_fatores=COLS_FATORES,
+) -> pd.DataFrame:
+    """
+    top_por_venc(rankear(x, pesos=pesos), n) a partir da matriz de fatores já
+    normalizada: produto pelos pesos e seleção parcial (np.partition) dentro de
+    cada vencimento; só os candidatos empatados no corte são ordenados.
+    `x` deve ter índice 0..n-1 (como o de rankear). cols_fatores: nomes das
+    colunas de F no resultado (as travas verticais têm fatores próprios).
+    """
+    if x is None or x.empty:
+        return x
+
+    score_base, score = _pontuar(F, x, pesos, exigir_vol_acima)
+    chave = np.nan_to_num(score, nan=-np.inf)
+
+    cod, _ = pd.factorize(x["expiration"], use_na_sentinel=False)
+    ordem = np.argsort(cod, kind="stable")
+    inicios = np.flatnonzero(np.r_[True, np.diff(cod[ordem]) != 0])
+    sel = []
+    for idx in np.split(ordem, inicios[1:]):
+        if len(idx) > n:
+            corte = np.partition(chave[idx], len(idx) - n)[len(idx) - n]
+            idx = idx[chave[idx] >= corte]
+        sel.append(idx)
+    sel = np.sort(np.concatenate(sel))
+
+    out = x.iloc[sel].copy()
+    out[cols_fatores] = F[sel]
+    out["score_base"] = score_base[sel]
+    out["score"] = score[sel]
+    return top_por_venc(out.sort_values("score", ascending=False, kind="mergesort"), n)
+
+
+def visao_filtrada(
+    book: pd.DataFrame,
+    filtros: dict,
+    delta_target: float,
+    top_n: int,
+    pesos=PESOS_SCORE,
+    cache: dict | None = None,
+) -> pd.DataFrame:
+    """
+    Filtra, rankeia e corta o top N de um livro já enriquecido (não recalcula IV).
+    Com `cache`, o livro filtrado e a matriz de fatores ficam guardados por
+    (filtros, delta_target): trocar só pesos ou top N não refiltra nem renormaliza.
+    """
+    if book is None or book.empty:
+        return pd.DataFrame()
+
+    chave = (tuple(sorted(filtros.items())), float(delta_target))
+    if cache is not None and chave in cache:
+        x, F = cache[chave]
+    else:
+        x = aplicar_filtros(book, **filtros).reset_index(drop=True)
+        F = matriz_fatores(x, delta_target)
+        if cache is not None:
+            cache.clear()
+            cache[chave] = (x, F)
+    return top_por_venc_fatores(x, F, top_n, pesos, filtros["exigir_vol_acima"])
+
+
+# candidatos guardados por vencimento na passada única, em múltiplos de n
+FATOR_BUFFER = 10
+
+
+class RankerStreaming:
+    """
+    top_por_venc(rankear(...)) em fluxo, lote a lote, sem juntar o livro filtrado.
+
+    Duas passadas sobre os mesmos lotes (já filtrados, na mesma ordem):
+      1) observar(lote): mínimo/máximo corrente de cada fator do score;
+      2) acumular(lote): score com a normalização congelada e um heap de
+         tamanho n por vencimento.
+    resultado() devolve as mesmas linhas, ordem e índice que a versão em memória
+    (empates desempatados pela ordem de chegada, como no sort estável de rankear).
+
+    Passada única, com memória limitada: adicionar(lote) em cada lote e fechar()
+    no fim. Só os buffer*n melhores de cada vencimento (pelo mínimo/máximo
+    corrente) ficam guardados e são repontuados com o mínimo/máximo final.
+    O mínimo/máximo só se alarga, então se não mudou desde o primeiro descarte
+    todos os cortes usaram a normalização final e o top é exato; senão, um
+    descartado cedo ainda poderia ter entrado (exato=False).
+    """
+
+    def __init__(self, n: int = 5, delta_target: float = 0.45, exigir_vol_acima: bool = False, pesos=PESOS_SCORE,
+                 buffer: int = FATOR_BUFFER):
+        self.n = int(n)
+        self.delta_target = delta_target
+        self.exigir_vol_acima = exigir_vol_acima
+        self.pesos = pesos
+        self.m = max(self.n, int(buffer) * self.n)
+        self._min = np.full(4, np.inf)
+        self._max = np.full(4, -np.inf)
+        self._heaps: dict = {}
+        self._seq = 0
+        self._buffer: pd.DataFrame | None = None
+        self._norma_descarte: tuple | None = None     # mínimo/máximo no primeiro descarte
+        self.exato = True
+
+    def observar(self, lote: pd.DataFrame):
+        if lote is None or lote.empty:
+            return
+        mn, mx = _min_max_fatores(_fatores_brutos(lote, self.delta_target))
+        self._min = np.minimum(self._min, mn)
+        self._max = np.maximum(self._max, mx)
+
+    def _pontuar_lote(self, x: pd.DataFrame):
+        F = _normalizar_fatores(_fatores_brutos(x, self.delta_target), self._min, self._max)
+        x[COLS_FATORES] = F
+        x["score_base"], x["score"] = _pontuar(F, x, self.pesos, self.exigir_vol_acima)
+
+    def _numerar(self, lote: pd.DataFrame) -> pd.DataFrame:
+        """Lote com índice = ordem de chegada global (desempate do ranking)."""
+        x = lote.reset_index(drop=True)
+        x.index = pd.RangeIndex(self._seq, self._seq + len(x))
+        self._seq += len(x)
+        return x
+
+    def acumular(self, lote: pd.DataFrame):
+        if lote is None or lote.empty:
+            return
+        self._empilhar(self._numerar(lote))
+
+    def adicionar(self, lote: pd.DataFrame):
+        """Passada única: observa o lote e mantém só os m melhores de cada vencimento."""
+        if lote is None or lote.empty:
+            return
+        self.observar(lote)
+        x = self._numerar(lote)
+        buf = x if self._buffer is None else pd.concat([self._buffer, x])
+
+        f = _fatores_brutos(buf, self.delta_target)
+        _, score = _pontuar(_normalizar_fatores(f, self._min, self._max), buf, self.pesos, self.exigir_vol_acima)
+        chave = np.nan_to_num(score, nan=-np.inf)
+        ordem = np.lexsort((buf.index.to_numpy(), -chave, buf["expiration"].to_numpy()))
+        pos_no_grupo = buf.iloc[ordem].groupby("expiration", sort=False).cumcount().to_numpy()
+        fica = np.zeros(len(buf), dtype=bool)
+        fica[ordem[pos_no_grupo < self.m]] = True
+        if not fica.all() and self._norma_descarte is None:
+            self._norma_descarte = (self._min.copy(), self._max.copy())
+        self._buffer = buf.loc[fica]
+
+    def fechar(self) -> pd.DataFrame:
+        """
+        Fim da passada única: pontua o buffer com o mínimo/máximo final e monta
+        o top n. Retorna os candidatos guardados (sem as colunas de score), com
+        índice 0..m-1 na ordem de chegada — o mesmo índice do top.
+        """
+        buf, self._buffer = self._buffer, None
+        if buf is None:
+            return pd.DataFrame()
+        buf = buf.reset_index(drop=True)
+        self._empilhar(buf.copy())
+        if self._norma_descarte is not None:
+            mn, mx = self._norma_descarte
+            self.exato = bool(np.array_equal(mn, self._min) and np.array_equal(mx, self._max))
+        return buf
+
+    def _empilhar(self, x: pd.DataFrame):
+        self._pontuar_lote(x)
+        chave = np.nan_to_num(x["score"].to_numpy(dtype=float), nan=-np.inf)
+
+        # só os n melhores de cada vencimento do lote disputam o heap
+        venc = x["expiration"].to_numpy()
+        ordem = np.lexsort((x.index.to_numpy(), -chave, venc))
+        pos_no_grupo = x.iloc[ordem].groupby("expiration", sort=False).cumcount().to_numpy()
+        for i in ordem[pos_no_grupo < self.n]:
+            # chave do heap: (score, -seq) — o topo é o pior dos n guardados
+            item = (chave[i], -int(x.index[i]), x.iloc[[i]])
+            heap = self._heaps.setdefault(venc[i], [])
+            if len(heap) < self.n:
+                heapq.heappush(heap, item)
+            elif item[:2] > heap[0][:2]:
+                heapq.heapreplace(heap, item)
+
+    def subjacentes(self) -> set:
+        """Ativos do top (e, antes de fechar(), os do buffer da passada única)."""
+        vivos = {str(item[2]["underlying_symbol"].iat[0]) for heap in self._heaps.values() for item in heap}
+        if self._buffer is not None:
+            vivos |= set(self._buffer["underlying_symbol"].astype(str))
+        return vivos
+
+    def resultado(self) -> pd.DataFrame:
+        linhas = [item[2] for heap in self._heaps.values() for item in heap]
+        if not linhas:
+            return pd.DataFrame()
+        out = pd.concat(linhas).sort_index()
+        return out.sort_values(["expiration", "score"], ascending=[True, False], kind="mergesort")
+
+
+def top_por_venc_streaming(
+    gerar_lotes,
+    n: int = 5,
+    delta_target: float = 0.45,
+    exigir_vol_acima: bool = False,
+    pesos=PESOS_SCORE,
+) -> pd.DataFrame:
+    """
+    Igual a top_por_venc(rankear(concat(lotes))); o ranker guarda só n linhas por
+    vencimento, a memória dos lotes fica por conta de `gerar_lotes`.
+    `gerar_lotes()` deve produzir os mesmos lotes filtrados nas duas chamadas.
+    """
+    ranker = RankerStreaming(n, delta_target, exigir_vol_acima, pesos)
+    for lote in gerar_lotes():
+        ranker.observar(lote)
+    for lote in gerar_lotes():
+        ranker.acumular(lote)
+    return ranker.resultado()
+
+
+# ===============================
+# Travas verticais
+# ===============================
+COLS_FATORES_SPREAD = ["fator_retorno", "fator_prob", "fator_liquidez", "fator_custo"]
+PESOS_SPREAD = (0.35, 0.35, 0.20, 0.10)     # retorno/risco, prob. de lucro, liquidez, custo de spread (baixo)
+_FATORES_SPREAD_INVERTIDOS = (False, False, False, True)
+
+
+def _pernas_spread(book: pd.DataFrame, filtros: dict) -> np.ndarray:
+    """
+    Pernas elegíveis: bid/ask, janela de vencimento, tipo, volume e spread
+    relativo de aplicar_filtros (delta e IV% não se aplicam à trava).
+    """
+    ok = ((book["bid"] > 0) & (book["ask"] > 0) & (book["strike"] > 0)).to_numpy()
+    ok = ok & _mascara_grupos(book, filtros)
+    if filtros.get("tipo_opcao") in ("CALL", "PUT"):
+        ok = ok & (book["type"] == filtros["tipo_opcao"]).to_numpy()
+    ok = ok & (_to_num(book["volume"]).fillna(0) >= filtros["min_volume_opt"]).to_numpy()
+    ok = ok & (book["spread_rel"].fillna(1.0) <= filtros["max_spread_rel"]).to_numpy()
+    if filtros.get("excluir_arbitragem") and "arb_flags" in book.columns:
+        ok = ok & (book["arb_flags"] == 0).to_numpy()
+    return ok
+
+
+def buscar_spreads(book: pd.DataFrame, filtros: dict, largura_pct: float = LARGURA_MAX_PCT) -> pd.DataFrame:
+    """
+    Todas as travas verticais (alta/baixa, calls/puts) de cada (ativo, vencimento)
+    do livro enriquecido, com strikes a até `largura_pct` % do spot. Custo > 0 é
+    débito e < 0 crédito, na ponta executável; prob_lucro (%) pela IV média das pernas.
+    """
+    if book is None or book.empty:
+        return pd.DataFrame()
+    x = book.loc[_pernas_spread(book, filtros)].reset_index(drop=True)
+    if x.empty:
+        return pd.DataFrame()
+
+    grupo = x.groupby(["underlying_symbol", "expiration"], sort=False, observed=True).ngroup().to_numpy()
+    K = x["strike"].to_numpy(dtype=float)
+    S = x["ref_price"].to_numpy(dtype=float)
+    sigma = x["iv_local_pct"].astype(float).fillna(x["iv_superficie_pct"].astype(float)).to_numpy() / 100.0
+    res = montar_verticais(
+        grupo, K, (x["type"] == "CALL").to_numpy(),
+        x["bid"].to_numpy(dtype=float), x["ask"].to_numpy(dtype=float),
+        S, x["T"].to_numpy(dtype=float), x["r"].to_numpy(dtype=float), sigma,
+        largura_pct / 100.0 * S,
+    )
+    c, v = res["compra"], res["venda"]
+    spread_perna = (x["ask"] - x["bid"]).to_numpy(dtype=float)
+    volume = _to_num(x["volume"]).fillna(0).to_numpy(dtype=float)
+
+    out = pd.DataFrame({
+        "underlying_symbol": x["underlying_symbol"].astype(str).to_numpy()[c],
+        "expiration": x["expiration"].to_numpy()[c],
+        "estrategia": np.array(list(ESTRATEGIAS.values()), dtype=object)[res["estrategia"]],
+        "type": x["type"].astype(str).to_numpy()[c],
+        "compra": x["symbol"].to_numpy()[c],
+        "strike_compra": K[c],
+        "venda": x["symbol"].to_numpy()[v],
+        "strike_venda": K[v],
+        "custo": res["custo"],
+        "largura": res["largura"],
+        "ganho_max": res["ganho_max"],
+        "perda_max": res["perda_max"],
+        "breakeven": res["breakeven"],
+        "retorno_risco": res["retorno_risco"],
+        "prob_lucro_pct": 100.0 * res["prob_lucro"],
+        "volume": np.minimum(volume[c], volume[v]),
+        "custo_spread_rel": (spread_perna[c] + spread_perna[v]) / res["largura"],
+        "ref_price": S[c],
+        "dte_bus": x["dte_bus"].to_numpy()[c],
+    })
+    # volume financeiro do ativo, para o bônus de volume de _pontuar
+    for col in ("volume_fin_acao", "volfin_ma_acao"):
+        if col in x.columns:
+            out[col] = x[col].to_numpy()[c]
+    return out
+
+
+def matriz_fatores_spread(sp: pd.DataFrame) -> np.ndarray:
+    """
+    Fatores das travas normalizados sobre `sp` (n x 4, na ordem de PESOS_SPREAD).
+    Retorno/risco entra em log (travas de crédito quase sem perda explodem a razão).
+    """
+    f = np.column_stack([
+        np.log1p(sp["retorno_risco"].to_numpy(dtype=float)),
+        sp["prob_lucro_pct"].to_numpy(dtype=float),
+        sp["volume"].to_numpy(dtype=float),
+        sp["custo_spread_rel"].to_numpy(dtype=float),
+    ])
+    return _normalizar_fatores(f, *_min_max_fatores(f), _FATORES_SPREAD_INVERTIDOS)
+
+
+def visao_spreads(
+    book: pd.DataFrame,
+    filtros: dict,
+    top_n: int,
+    largura_pct: float = LARGURA_MAX_PCT,
+    pesos=PESOS_SPREAD,
+    cache: dict | None = None,
+) -> pd.DataFrame:
+    """
+    Top N travas verticais por vencimento, pelo mesmo corte parcial de
+    top_por_venc_fatores. Com `cache`, as travas e a matriz de fatores ficam
+    guardadas por (filtros, largura): trocar só top N não refaz a busca.
+    """
+    chave = (tuple(sorted(filtros.items())), float(largura_pct))
+    if cache is not None and chave in cache:
+        sp, F = cache[chave]
+    else:
+        sp = buscar_spreads(book, filtros, largura_pct)
+        F = matriz_fatores_spread(sp) if not sp.empty else np.empty((0, len(COLS_FATORES_SPREAD)))
+        if cache is not None:
+            cache.clear()
+            cache[chave] = (sp, F)
+    if sp.empty:
+        return sp
+    return top_por_venc_fatores(sp, F, top_n, pesos, filtros["exigir_vol_acima"], cols_fatores=COLS_FATORES_SPREAD)
+
+
+# ===============================
+# Varredura do mercado inteiro
+# ===============================
+ATIVOS_PADRAO = ["PETR4","BOVA11","VALE3","ITUB4","WEGE3","ABEV3","BBDC4","BBAS3","EMBR3","MGLU3"]
+LOTE_MERCADO = 25
+ULTIMO_MERCADO = {"exato": True, "candidatos": 0}
+
+
+@st.cache_data(ttl=6 * 3600, show_spinner=False)
+def obter_universo_opcoes() -> list[str]:
+    """Todos os ativos da B3 com opções listadas (Oplab)."""
+    url = f"{OPLAB_BASE_URL}/market/stocks"
+    r = requests.get(url, headers=_headers(), params={"has_options": "true"}, timeout=30)
+    r.raise_for_status()
+    raw = r.json()
+    data = raw if isinstance(raw, list) else raw.get("data", [])
+    symbols = {
+        str(item.get("symbol", "")).strip().upper()
+        for item in data
+        if isinstance(item, dict) and item.get("has_options", True)
+    }
+    symbols.discard("")
+    if not symbols:
+        raise RuntimeError("Universo de opções vazio")
+    return sorted(symbols)
+
+
+def varrer_mercado(
+    universo: list[str],
+    days: int,
+    r_annual: float,
+    filtros: dict,
+    delta_target: float,
+    exigir_vol_acima: bool,
+    top_n: int,
+    n_workers: int = 1,
+    lote: int = LOTE_MERCADO,
+    progresso=None,
+    pesos=PESOS_SCORE,
+    candidatos: list | None = None,
+    compacto: bool = False,
+    exercicio: dict | None = None,
+    curva: dict | None = None,
+    dividendos: dict | None = None,
+    exato: bool = False,
+) -> tuple[pd.DataFrame, pd.DataFrame, dict[str, str]]:
+    """
+    Busca, enriquece, filtra e ranqueia o universo em lotes de `lote` ativos,
+    com RankerStreaming; a rede e o enriquecimento rodam uma vez por lote.
+    Padrão: passada única com memória limitada — de cada vencimento ficam só
+    FATOR_BUFFER*top_n candidatos (e os candles dos seus ativos), repontuados
+    no fim com o min/máx do universo inteiro. ULTIMO_MERCADO["exato"] diz se o
+    top ficou garantido igual ao de ranquear o livro filtrado inteiro; quando
+    não, um descartado cedo (com outro min/máx) ainda poderia ter entrado.
+    exato=True: guarda todos os lotes filtrados e ranqueia numa segunda passada
+    sobre eles — sempre igual ao livro inteiro, mas a memória cresce com o universo.
+    Com `candidatos` (lista), os contratos guardados (os lotes filtrados ou, no
+    padrão, os candidatos do buffer) são anexados a ela, para rerankear depois
+    sem varrer de novo.
+    Memória no padrão: o livro bruto e enriquecido de um lote por vez (os
+    snapshots não passam pelo st.cache_data) mais o buffer, limitado pelo
+    número de vencimentos; fora dela, os candles de cada lote no st.cache_data
+    (10 min) e o IV_CACHE (até 200 mil contratos).
+    Retorna (top, candles dos ativos do top, {symbol: erro}).
+    """
+    erros: dict[str, str] = {}
+    lotes = [universo[i:i + lote] for i in range(0, len(universo), lote)]
+    filtrados: list[pd.DataFrame] = []
+    candles_ativos: dict[str, pd.DataFrame] = {}
+    ranker = RankerStreaming(top_n, delta_target, exigir_vol_acima, pesos)
+
+    for i, simbolos in enumerate(lotes, start=1):
+        at, op, erros_lote = baixar_dados_scanner(simbolos, days, cache_snapshots=False)
+        erros.update(erros_lote)
+        if not (at.empty or op.empty):
+            ctx = preparar_contexto_ativos(at, ma=20)
+            book_raw = op.merge(
+                ctx.rename(columns={"volume_fin":"volume_fin_acao","volfin_ma":"volfin_ma_acao"}),
+                on="underlying_symbol",
+                how="left"
+            )
+            book = add_features_and_iv(
+                book_raw,
+                price_lookup=dict(zip(ctx["underlying_symbol"], ctx["last_close"])),
+                r_annual=r_annual,
+                n_workers=n_workers,
+                filtros=filtros,
+                compacto=compacto,
+                exercicio=exercicio,
+                curva=curva,
+                dividendos=dividendos,
+            )
+            flt = aplicar_filtros(book, **filtros)
+            if not flt.empty:
+                if exato:
+                    ranker.observar(flt)
+                    filtrados.append(flt)
+                    vivos = set(candles_ativos) | set(flt["underlying_symbol"].astype(str))
+                else:
+                    ranker.adicionar(flt)
+                    vivos = ranker.subjacentes()
+                _guardar_candles(candles_ativos, at, vivos)
+        if progresso is not None:
+            progresso(i / len(lotes), f"Lote {i}/{len(lotes)}")
+
+    if exato:
+        for flt in filtrados:
+            ranker.acumular(flt)
+    else:
+        guardados = ranker.fechar()
+        filtrados = [guardados] if not guardados.empty else []
+    if candidatos is not None:
+        candidatos.extend(filtrados)
+    ULTIMO_MERCADO.update({"exato": ranker.exato, "candidatos": sum(len(f) for f in filtrados)})
+
+    vivos = ranker.subjacentes()
+    candles = pd.concat(
+        [c for u, c in candles_ativos.items() if u in vivos] or [pd.DataFrame(columns=_COLS_CANDLES)],
+        ignore_index=True,
+    )
+    return ranker.resultado(), candles, erros
+
+
+def _guardar_candles(candles_ativos: dict, at: pd.DataFrame, vivos: set):
+    """Candles do lote para os ativos em `vivos`; os dos demais ativos saem do dicionário."""
+    novos = at[at["underlying_symbol"].astype(str).isin(vivos)]
+    for u, c in novos.groupby("underlying_symbol", sort=False):
+        candles_ativos[str(u)] = c
+    for u in set(candles_ativos) - vivos:
+        del candles_ativos[u]
+
+
 def obter_underlying_opcao(symbol: str) -> str:
     url = f"{OPLAB_BASE_URL}/market/options/details/{symbol}"
     try:
@@ -680,6 +1949,474 @@ def carregar_df_operacoes(status: str) -> pd.DataFrame:
         return pd.DataFrame()
 
 
+# ===============================
+# RESULTADOS (cards, tabela, candles)
+# ===============================
+def _render_spreads(spreads: pd.DataFrame):
+    st.caption(
+        "Custo > 0 = débito, < 0 = crédito (compra no ask, venda no bid). Ganho/perda máximos por ação no "
+        "vencimento; probabilidade de lucro neutra a risco, com a IV média das pernas no breakeven."
+    )
+    if spreads.empty:
+        warn("Nenhuma trava encontrada com os critérios atuais. Aumente a largura ou afrouxe volume e spread.")
+        return
+    sp = spreads.sort_values(["expiration", "score"], ascending=[True, False]).reset_index(drop=True)
+    sp["expiration"] = pd.to_datetime(sp["expiration"], errors="coerce").dt.date
+    cols = [
+        "score", "underlying_symbol", "expiration", "estrategia", "compra", "strike_compra", "venda", "strike_venda",
+        "custo", "ganho_max", "perda_max", "breakeven", "retorno_risco", "prob_lucro_pct",
+        "volume", "custo_spread_rel", "ref_price", "dte_bus",
+    ]
+    fmt = {c: "R$ {:,.2f}".format for c in
+           ["strike_compra", "strike_venda", "custo", "ganho_max", "perda_max", "breakeven", "ref_price"]}
+    fmt.update({c: "{:.2f}".format for c in ["score", "retorno_risco", "prob_lucro_pct", "custo_spread_rel"]})
+    st.dataframe(sp[cols].style.format(fmt), use_container_width=True, hide_index=True)
+
+
+def _figura_gex(gex: dict[str, pd.DataFrame], sym: str):
+    """Barras de GEX líquido por strike e perfil de GEX total do ativo; None sem open interest."""
+    resumo = gex["resumo"]
+    if resumo.empty or sym not in set(resumo["underlying_symbol"]):
+        return None
+    linha = resumo[resumo["underlying_symbol"] == sym].iloc[0]
+    por_strike = gex["por_strike"][gex["por_strike"]["underlying_symbol"] == sym]
+    perfil = gex["perfil"][gex["perfil"]["underlying_symbol"] == sym]
+
+    fig = go.Figure()
+    fig.add_trace(go.Bar(
+        x=por_strike["strike"], y=por_strike["gex"] / 1e6, name="GEX por strike",
+        marker_color=np.where(por_strike["gex"] >= 0, "#00C896", "#FF5A5F"),
+    ))
+    fig.add_trace(go.Scatter(
+        x=perfil["spot"], y=perfil["gex"] / 1e6, mode="lines", name="GEX total", line=dict(color="orange"),
+    ))
+    fig.add_vline(x=linha["spot"], line=dict(color="white", dash="dot", width=1))
+    titulo = f"GEX {linha['gex_total'] / 1e6:,.1f} mi"
+    if np.isfinite(linha["flip"]):
+        fig.add_vline(x=linha["flip"], line=dict(color="#FFD166", dash="dash", width=1))
+        titulo += f" · flip {linha['flip']:,.2f}"
+    fig.update_layout(
+        title=titulo,
+        height=550,
+        template="plotly_dark",
+        xaxis=dict(title="Strike / spot", range=[perfil["spot"].min(), perfil["spot"].max()]),
+        yaxis=dict(title="R$ mi por 1%"),
+        legend=dict(orientation="h", yanchor="bottom", y=-0.25),
+        margin=dict(l=40, r=20, t=50, b=20),
+    )
+    return fig
+
+
+def _render_resultados(
+    top: pd.DataFrame, at: pd.DataFrame, book: pd.DataFrame, top_n: int, r_annual: float, curva: dict | None = None,
+    spreads: pd.DataFrame | None = None,
+):
+    """spreads: top de visao_spreads — no modo de travas, ocupa o lugar dos cards e da tabela de opções."""
+    st.subheader("🏆 Top Oportunidades por Vencimento 💎" if spreads is None else "🪜 Top Travas Verticais por Vencimento")
+
+    if spreads is not None:
+        st.session_state["top5"] = pd.DataFrame()
+        _render_spreads(spreads)
+    elif top.empty:
+        warn("Nenhuma oportunidade encontrada com os critérios atuais. Afrouxe IV %, delta ou spread.")
+    else:
+        top = top.sort_values("score", ascending=False).reset_index(drop=True)
+        top["expiration"] = pd.to_datetime(top["expiration"], errors="coerce").dt.date
+        if "hv20_pct" in top.columns:
+            # IV da opção sobre a vol realizada de 20 pregões do ativo
+            top.insert(
+                top.columns.get_loc("iv_local_pct") + 1, "iv_vs_hv",
+                top["iv_local_pct"].astype(float) / top["hv20_pct"].astype(float).where(lambda v: v > 0),
+            )
+        num_cols = top.select_dtypes(include=["float", "float64", "int", "int64"]).columns.difference(COLS_FATORES)
+        top[num_cols] = top[num_cols].apply(lambda x: np.round(x, 2))
+
+        cols = ["score"] + [c for c in top.columns if c != "score" and c not in COLS_FATORES]
+
+        num_cards = min(int(top_n), 10)
+        top5 = top.head(num_cards).copy()
+        st.session_state["top5"] = top5
+
+        def get_card_gradient(score, tipo):
+            s = float(score)
+            if tipo == "CALL":
+                start, end = "#004d00", "#66ff66"
+            else:
+                start, end = "#7f0000", "#ff6666"
+            return f"linear-gradient(135deg, {start} {(s*100):.0f}%, {end})"
+
+        card_html = ""
+        for _, row in top5.iterrows():
+            grad = get_card_gradient(row["score"], row["type"])
+            delta_color = "lime" if row["type"] == "CALL" else "salmon"
+            card_html += f"""
+            <div class="card" style="background-image: {grad};">
+                <div class="symbol">{row['symbol']} ({row['type']})</div>
+                <div class="score-label">Score</div>
+                <div class="score">{row['score']:.2f}</div>
+                <div class="details">Strike {row['strike']:.2f} • Venc. {row['expiration']}</div>
+                <div class="delta-line">
+                    <span style='color:{delta_color}; font-weight:600;'>Δ {row['delta']:.2f}</span>
+                </div>
+            </div>
+            """
+
+        st.markdown(
+            f"""
+            <style>
+            .card {{
+                display: inline-block;
+                border-radius: 16px;
+                padding: 16px 18px;
+                margin: 8px;
+                box-shadow: 0 2px 6px rgba(0,0,0,0.4);
+                color: white;
+                transition: all 0.25s ease;
+                width: 16.5%;
+                text-align: center;
+                min-height: 180px;
+            }}
+            .card:hover {{
+                transform: translateY(-4px) scale(1.03);
+                box-shadow: 0 6px 14px rgba(0,0,0,0.6);
+                cursor: pointer;
+            }}
+            .symbol {{
+                font-weight: 600;
+                font-size: 1rem;
+                margin-bottom: 6px;
+            }}
+            .score-label {{
+                font-size: 0.8rem;
+                color: rgba(255,255,255,0.9);
+                text-transform: uppercase;
+                letter-spacing: 0.5px;
+            }}
+            .score {{
+                font-size: 1.8rem;
+                font-weight: 700;
+                margin-bottom: 6px;
+                color: #fff;
+                text-shadow: 0 0 10px rgba(255,255,255,0.5);
+            }}
+            .details {{
+                font-size: 0.85rem;
+                color: rgba(255,255,255,0.85);
+            }}
+            .delta-line {{
+                margin-top: 4px;
+            }}
+            @media (max-width: 1800px) {{
+                .card {{ width: 17%; }}
+            }}
+            @media (max-width: 1300px) {{
+                .card {{ width: 22%; }}
+            }}
+            @media (max-width: 1000px) {{
+                .card {{ width: 45%; }}
+            }}
+            @media (max-width: 600px) {{
+                .card {{
+                    width: 90%;
+                    padding: 14px 16px;
+                }}
+                .symbol {{ font-size: 0.95rem; }}
+                .score-label {{ font-size: 0.7rem; }}
+                .score {{ font-size: 1.5rem; }}
+                .details {{ font-size: 0.8rem; }}
+            }}
+            @media (max-width: 400px) {{
+                .card {{
+                    width: 95%;
+                    padding: 12px 14px;
+                }}
+                .symbol {{ font-size: 0.9rem; }}
+                .score {{ font-size: 1.3rem; }}
+                .details {{ font-size: 0.75rem; }}
+            }}
+            .cards-container {{
+                display: flex;
+                flex-wrap: wrap;
+                justify-content: center;
+                align-items: stretch;
+                gap: 10px;
+            }}
+            </style>
+            <div class="cards-container">
+                {card_html}
+            </div>
+            """,
+            unsafe_allow_html=True
+        )
+
+        st.markdown("---")
+
+        def score_color(val, tipo):
+            if pd.isna(val):
+                return ""
+            s = float(val)
+            s = max(0, min(s, 1))
+            if tipo == "CALL":
+                dark = np.array([0, 77, 0])
+                light = np.array([102, 255, 102])
+            else:
+                dark = np.array([127, 0, 0])
+                light = np.array([255, 102, 102])
+            rgb = (dark * s + light * (1 - s)).astype(int)
+            color = f"rgb({rgb[0]},{rgb[1]},{rgb[2]})"
+            return f"background-color: {color}; color: black; font-weight: 700;"
+
+        financial_cols = [
+            c for c in top.columns if any(k in c.lower() for k in ["price", "premium", "strike", "ref_", "volfin", "volume"])
+        ]
+        fmt = {}
+        for c in top.columns:
+            if c in financial_cols:
+                fmt[c] = "R$ {:,.2f}".format
+            elif top[c].dtype.kind in "fi":
+                fmt[c] = "{:.2f}".format
+
+        styled_df = (
+            top[cols]
+            .style
+            .format(fmt)
+            .apply(
+                lambda r: [score_color(r["score"], r["type"])] + ["" for _ in range(len(r) - 1)],
+                axis=1
+            )
+        )
+
+        st.dataframe(
+            styled_df,
+            use_container_width=True,
+            hide_index=True
+        )
+
+    # Superfície de volatilidade
+    resumo = painel_superficie(book, r_annual, curva)
+    if not resumo.empty:
+        st.markdown("---")
+        st.subheader("🌋 Superfície de volatilidade")
+        st.caption(
+            "Smile quadrático em log-moneyness por vencimento, ajustado só com contratos líquidos fora do dinheiro. "
+            "Skew = inclinação da IV por unidade de ln(K/F). RR 25Δ = IV call 25Δ − IV put 25Δ; "
+            "BF 25Δ = média das duas − IV ATM."
+            + (" Painel reaproveitado do mesmo snapshot." if ULTIMO_PAINEL["reuso"] else "")
+        )
+        graficos = [
+            ("iv_atm_pct", "Estrutura a termo — IV ATM (%)"),
+            ("rr25_pct", "Risk reversal 25Δ (pontos de vol)"),
+            ("bf25_pct", "Butterfly 25Δ (pontos de vol)"),
+        ]
+        for (col, titulo), area in zip(graficos, st.columns(len(graficos))):
+            fig_ts = go.Figure()
+            for sym, g in resumo.dropna(subset=[col]).groupby("underlying_symbol"):
+                fig_ts.add_trace(go.Scatter(x=g["expiration"], y=g[col], mode="lines+markers", name=sym))
+            fig_ts.update_layout(
+                template="plotly_dark",
+                height=350,
+                title=titulo,
+                margin=dict(l=40, r=40, t=50, b=20),
+            )
+            area.plotly_chart(fig_ts, use_container_width=True)
+        st.dataframe(
+            resumo.assign(expiration=pd.to_datetime(resumo["expiration"]).dt.date).round(
+                {"iv_atm_pct": 2, "iv_call25_pct": 2, "iv_put25_pct": 2, "rr25_pct": 2, "bf25_pct": 2,
+                 "skew": 3, "curvatura": 3}
+            ),
+            use_container_width=True,
+            hide_index=True,
+        )
+
+    # Max pain e open interest
+    oi = painel_oi(book)
+    if not oi["por_venc"].empty:
+        st.markdown("---")
+        st.subheader("🎯 Max pain e open interest")
+        st.caption(
+            "Max pain = strike de liquidação que minimiza o valor intrínseco pago aos titulares do open interest. "
+            "Barras: OI de calls (acima) e puts (abaixo) por strike; linha: essa dor total em R$ mi. "
+            "Put/call de OI por vencimento na tabela."
+        )
+        por_venc = oi["por_venc"].dropna(subset=["max_pain"])
+        opcoes = list(zip(por_venc["underlying_symbol"], pd.to_datetime(por_venc["expiration"]).dt.date))
+        if opcoes:
+            sym, venc = st.selectbox(
+                "Ativo / vencimento", opcoes, format_func=lambda o: f"{o[0]} — {o[1]:%d/%m/%Y}", key="max_pain_venc"
+            )
+            ps = oi["por_strike"]
+            ps = ps[(ps["underlying_symbol"] == sym) & (pd.to_datetime(ps["expiration"]).dt.date == venc)]
+            linha = por_venc[(por_venc["underlying_symbol"] == sym)
+                             & (pd.to_datetime(por_venc["expiration"]).dt.date == venc)].iloc[0]
+            spot = book.loc[book["underlying_symbol"].astype(str) == sym, "ref_price"].astype(float).median()
+
+            fig_oi = go.Figure()
+            fig_oi.add_trace(go.Bar(x=ps["strike"], y=ps["oi_call"], name="OI calls", marker_color="#00C896"))
+            fig_oi.add_trace(go.Bar(x=ps["strike"], y=-ps["oi_put"], name="OI puts", marker_color="#FF5A5F"))
+            fig_oi.add_trace(go.Scatter(
+                x=ps["strike"], y=ps["dor"] / 1e6, mode="lines", name="Dor (R$ mi)", line=dict(color="orange"),
+                yaxis="y2",
+            ))
+            fig_oi.add_vline(x=linha["max_pain"], line=dict(color="#FFD166", dash="dash", width=1))
+            if np.isfinite(spot):
+                fig_oi.add_vline(x=spot, line=dict(color="white", dash="dot", width=1))
+            fig_oi.update_layout(
+                title=f"{sym} {venc:%d/%m/%Y} — max pain {linha['max_pain']:,.2f} · put/call OI {linha['pcr_oi']:.2f}",
+                barmode="relative",
+                height=450,
+                template="plotly_dark",
+                xaxis=dict(title="Strike"),
+                yaxis=dict(title="Open interest"),
+                yaxis2=dict(title="Dor (R$ mi)", overlaying="y", side="right", showgrid=False),
+                legend=dict(orientation="h", yanchor="bottom", y=1.02, xanchor="right", x=1),
+                margin=dict(l=40, r=40, t=50, b=20),
+            )
+            st.plotly_chart(fig_oi, use_container_width=True)
+        st.dataframe(
+            oi["por_venc"].assign(expiration=pd.to_datetime(oi["por_venc"]["expiration"]).dt.date).round(
+                {"max_pain": 2, "pcr_oi": 2}
+            ),
+            use_container_width=True,
+            hide_index=True,
+        )
+
+    # Gráficos de candles
+    st.markdown("---")
+    st.subheader("📈 Candles (últimos dias) — OHLCV")
+    st.caption(
+        "Volume abaixo é financeiro (Close × Volume) com MM20 branca. Ao lado, o cone de vol realizada "
+        "(mín./p25/mediana/p75/máx. de cada janela no histórico baixado) com a IV ATM de cada vencimento, "
+        "e a exposição a gama dos dealers (GEX, R$ mi por 1% do ativo; dealer comprado nas calls e vendido "
+        "nas puts do open interest): barras por strike, curva com o ativo em outros níveis e o flip."
+    )
+
+    if at.empty:
+        warn("Candles indisponíveis.")
+    else:
+        cones = cones_volatilidade(at)
+        gex = painel_gex(book, r_annual, curva)
+        for sym in sorted(set(at["underlying_symbol"])):
+            d = at[at["underlying_symbol"] == sym].sort_values("date").tail(180)
+            if d.empty:
+                continue
+
+            d["vol_fin"] = _to_num(d["close"]) * _to_num(d["volume"])
+            d["volfin_ma20"] = d["vol_fin"].rolling(20, min_periods=1).mean()
+
+            fig = go.Figure()
+            fig.add_trace(go.Candlestick(
+                x=d["date"],
+                open=d["open"],
+                high=d["high"],
+                low=d["low"],
+                close=d["close"],
+                name=f"{sym} OHLC",
+                increasing_line_color="lime",
+                decreasing_line_color="red",
+                yaxis="y1"
+            ))
+            fig.add_trace(go.Bar(
+                x=d["date"],
+                y=d["vol_fin"],
+                name="Volume financeiro",
+                yaxis="y2",
+                opacity=0.6
+            ))
+            fig.add_trace(go.Scatter(
+                x=d["date"],
+                y=d["volfin_ma20"],
+                name="MM20 Vol (R$)",
+                mode="lines",
+                line=dict(width=1.5),
+                yaxis="y2"
+            ))
+
+            fig.update_layout(
+                title=f"{sym}",
+                height=550,
+                template="plotly_dark",
+                xaxis=dict(
+                    domain=[0.0, 1.0],
+                    rangeslider=dict(visible=False),
+                    showline=True,
+                    linecolor="#555",
+                    mirror=True
+                ),
+                yaxis=dict(
+                    title="Preço",
+                    domain=[0.35, 1.0],
+                    side="left",
+                    showgrid=True
+                ),
+                yaxis2=dict(
+                    title="Volume (R$)",
+                    domain=[0.0, 0.30],
+                    showgrid=False
+                ),
+                legend=dict(
+                    orientation="h",
+                    yanchor="bottom",
+                    y=1.02,
+                    xanchor="right",
+                    x=1
+                ),
+                margin=dict(l=40, r=40, t=50, b=20)
+            )
+            col_candle, col_cone, col_gex = st.columns([5, 2, 2])
+            col_candle.plotly_chart(fig, use_container_width=True)
+
+            fig_gex = _figura_gex(gex, sym)
+            if fig_gex is not None:
+                col_gex.plotly_chart(fig_gex, use_container_width=True)
+
+            cone = cones.get(sym)
+            if cone is None:
+                continue
+            fig_cone = go.Figure()
+            x = cone.index.to_numpy()
+            for q, estilo in [("max", "dot"), ("p75", "dash"), ("p50", "solid"), ("p25", "dash"), ("min", "dot")]:
+                fig_cone.add_trace(go.Scatter(
+                    x=x, y=100 * cone[q], mode="lines", name=q, line=dict(dash=estilo, width=1.2, color="#9aa0a6")
+                ))
+            fig_cone.add_trace(go.Scatter(
+                x=x, y=100 * cone["atual"], mode="lines+markers", name="HV atual", line=dict(color="orange")
+            ))
+            iv_sym = resumo[resumo["underlying_symbol"] == sym].dropna(subset=["iv_atm_pct"]) if not resumo.empty else resumo
+            if not iv_sym.empty:
+                fig_cone.add_trace(go.Scatter(
+                    x=iv_sym["dte_bus"], y=iv_sym["iv_atm_pct"], mode="markers", name="IV ATM",
+                    marker=dict(color="#00C896", size=8, symbol="diamond"),
+                ))
+            fig_cone.update_layout(
+                title="Cone de vol (%)",
+                height=550,
+                template="plotly_dark",
+                xaxis=dict(title="Janela / pregões até o vencimento"),
+                legend=dict(orientation="h", yanchor="bottom", y=-0.25),
+                margin=dict(l=40, r=20, t=50, b=20),
+            )
+            col_cone.plotly_chart(fig_cone, use_container_width=True)
+
+    with st.expander("📦 Dados brutos (opcional)"):
+        st.caption("Ativos (OHLCV)")
+        st.dataframe(at, use_container_width=True, hide_index=True)
+
+        st.caption("Opções (processadas com IV/greeks)")
+        show_cols = [
+            "symbol","underlying_symbol","type","expiration","strike",
+            "bid","ask","last","close","premium_used",
+            "ref_price","T","dte_bus",
+            "iv_local_pct","iv_superficie_pct","iv_status","iv_pct_local","hv20_pct","iv_rank","iv_rank_pregoes",
+            "arb_flags",
+            "max_pain","dist_max_pain_pct","pcr_oi",
+            "delta","gamma","vega","theta","rho",
+            "volume","open_interest","spread","spread_rel",
+            "vol_acima_ma","score"
+        ]
+        show_cols = [c for c in show_cols if c in book.columns]
+        st.dataframe(book[show_cols], use_container_width=True, hide_index=True)
+
+
 # =====================================================================
 # UI PRINCIPAL — AGORA DENTRO DE render()
 # =====================================================================
@@ -737,10 +2474,21 @@ def render():
     with st.sidebar:
         st.title("⚙️ Parâmetros do Scanner")
 
+        universo = st.radio(
+            "Universo", options=["Ativos selecionados", "Mercado inteiro"], index=0, horizontal=True,
+            help="Mercado inteiro varre todos os ativos com opções listadas, em lotes."
+        )
+        mercado_inteiro = universo == "Mercado inteiro"
+        ranking_exato = st.checkbox(
+            "Ranking exato (memória cresce com o universo)", value=False, disabled=not mercado_inteiro,
+            help=f"Sem ela a varredura guarda só {FATOR_BUFFER}× o top N de candidatos por vencimento e "
+                 "repontua no fim: memória limitada, mas o top pode diferir do ranking do mercado inteiro.",
+        )
         symbols = st.multiselect(
             "Ativos (subjacentes)",
-            ["PETR4","BOVA11","VALE3","ITUB4","WEGE3","ABEV3","BBDC4","BBAS3","EMBR3","MGLU3"],
-            default=["BOVA11"]
+            ATIVOS_PADRAO,
+            default=["BOVA11"],
+            disabled=mercado_inteiro,
         )
         days = st.number_input("Dias de histórico (candles)", min_value=30, max_value=365, value=180, step=5)
 
@@ -752,28 +2500,38 @@ def render():
             value=14.90,
             step=0.10
         ) / 100.0
+        datas_curva = datas_disponiveis()
+        usar_curva = st.checkbox(
+            "Juros pela curva DI (por vencimento)", value=bool(datas_curva),
+            help="Cada vencimento usa a taxa da curva DI interpolada (flat-forward) no prazo dele; "
+                 "a taxa acima fica só para vencimentos fora da curva.",
+        )
+        curva = None
+        if usar_curva:
+            with st.expander("Curva DI", expanded=not datas_curva):
+                texto_curva = st.text_area(
+                    "Vértices do DI futuro (curva de hoje)", value="", height=110,
+                    placeholder="DI1F27; 14.90\nDI1N27; 14.55\n2028-01-03; 14.20",
+                    help="Uma linha por vértice: vencimento (AAAA-MM-DD ou código DI1) ; taxa % a.a. base 252. "
+                         "Gravada em data/curva_di/AAAA-MM-DD.csv.",
+                )
+                if st.button("Gravar curva de hoje", disabled=not texto_curva.strip()):
+                    try:
+                        gravar_curva(texto_curva, date.today())
+                        datas_curva = datas_disponiveis()
+                    except ValueError as e:
+                        warn(str(e))
+                data_curva = st.selectbox("Data da curva", datas_curva, index=0, disabled=not datas_curva)
+            curva = carregar_curva(data_curva) if data_curva else None
+            if curva is None:
+                warn("Nenhuma curva DI gravada — usando a taxa fixa.")
 
         st.markdown("---")
         tipo_opcao = st.radio("Tipo de opção", options=["Ambas","CALL","PUT"], index=0, horizontal=True)
 
         col_v1, col_v2 = st.columns(2)
 
-        import calendar
-        def proximo_vencimento_opcoes(base: date | None = None) -> date:
-            if base is None:
-                base = datetime.today().date()
-            ano, mes = base.year, base.month
-            c = calendar.Calendar(firstweekday=calendar.MONDAY)
-            sextas = [d for d in c.itermonthdates(ano, mes) if d.weekday() == 4 and d.month == mes]
-            if len(sextas) >= 3 and base <= sextas[2]:
-                return sextas[2]
-            else:
-                mes = 1 if mes == 12 else mes + 1
-                ano = ano + 1 if mes == 1 else ano
-                sextas = [d for d in c.itermonthdates(ano, mes) if d.weekday() == 4 and d.month == mes]
-                return sextas[2] if len(sextas) >= 3 else base + timedelta(days=30)
-
-        prox_venc = proximo_vencimento_opcoes()
+        prox_venc = proximo_vencimento()
         with col_v1:
             venc_ini = st.date_input("Venc. inicial", prox_venc)
         with col_v2:
@@ -783,18 +2541,81 @@ def render():
         delta_min = st.slider("Delta mínimo (abs)", 0.0, 1.0, 0.30, 0.01)
         delta_max = st.slider("Delta máximo (abs)", 0.0, 1.0, 0.60, 0.01)
         iv_pct_max = st.slider("IV percentil local máx. (%)", 0, 100, 60, 1)
+        iv_rank_max = st.slider(
+            "IV rank máx. (até 252 pregões, %)", 0, 100, 100, 1,
+            help="IV ATM de hoje frente ao mínimo/máximo dos últimos 252 pregões do histórico local "
+                 "(python job_historico_iv.py); com histórico mais curto, a janela é a gravada — "
+                 "a coluna iv_rank_pregoes mostra quantos pregões entraram. Sem ao menos "
+                 f"{MIN_HISTORICO} pregões não há rank, e abaixo de 100 esses ativos ficam de fora.",
+        )
         min_vol_opt = st.number_input("Volume mínimo (opção)", 0, 200000, 0, 100)
         max_spread_rel = st.slider("Spread relativo máx.", 0.0, 5.0, 1.0, 0.05)
         exigir_vol_acima = st.checkbox(
             "Exigir volume do ativo acima da MM20 (volume financeiro)",
             value=False
         )
+        excluir_arbitragem = st.checkbox(
+            "Excluir cotações com arbitragem", value=False,
+            help="Tira do ranking contratos cujo bid/ask viola paridade put-call, monotonia ou convexidade "
+                 "em strike, ou calendário entre vencimentos (cotação velha ou errada). A paridade desconta "
+                 "os proventos da agenda de dividendos: sem ela, ativos com provento antes do vencimento "
+                 "aparecem marcados.",
+        )
 
         st.markdown("---")
         delta_target = st.slider("Delta alvo p/ score", 0.0, 1.0, 0.45, 0.01)
         top_n = st.number_input("Top por vencimento", 1, 10, 5)
+        modo = st.radio(
+            "Estratégia", options=["Opções simples", "Travas verticais"], index=0, horizontal=True,
+            help="Travas: todas as travas de alta/baixa com calls e puts de cada vencimento, "
+                 "ranqueadas por retorno/risco, probabilidade de lucro, liquidez e custo de spread.",
+        )
+        travas = modo == "Travas verticais"
+        largura_trava = st.slider(
+            "Largura máx. da trava (% do spot)", 1.0, 50.0, LARGURA_MAX_PCT, 1.0, disabled=not travas
+        )
+        with st.expander("Pesos do score", expanded=False):
+            pesos = [
+                st.slider("IV% (baixa)", 0.0, 1.0, PESOS_SCORE[0], 0.05),
+                st.slider("Volume", 0.0, 1.0, PESOS_SCORE[1], 0.05),
+                st.slider("Delta (alvo)", 0.0, 1.0, PESOS_SCORE[2], 0.05),
+                st.slider("Spread (baixo)", 0.0, 1.0, PESOS_SCORE[3], 0.05),
+            ]
+        soma_pesos = sum(pesos)
+        if soma_pesos <= 0:
+            pesos = list(PESOS_SCORE)
+        elif abs(soma_pesos - 1.0) > 1e-9:
+            pesos = [p / soma_pesos for p in pesos]
 
         st.markdown("---")
+        n_workers = st.number_input(
+            "Processos p/ cálculo de IV", 1, os.cpu_count() or 1, min(4, os.cpu_count() or 1), 1,
+            help=f"Acima de 1, livros com mais de {MIN_LINHAS_PARALELO:,} contratos são divididos por ativo entre processos."
+        )
+        compacto = st.checkbox(
+            "Livro compacto (menos memória)", value=True,
+            help="Descarta intermediários do cálculo e guarda gregas em float32 e textos repetidos como categoria. "
+                 "Reduz a memória do livro guardado, não o pico durante o cálculo da IV."
+        )
+        with st.expander("Exercício americano e dividendos", expanded=False):
+            texto_dividendos = st.text_area(
+                "Agenda de dividendos", value="", height=110,
+                placeholder="PETR4; 2026-11-21; 1.05\nVALE3; 2026-12-05; 2.30",
+                help="Uma linha por provento: ativo; data ex (AAAA-MM-DD); valor por ação.",
+            )
+            try:
+                agenda = ler_agenda_dividendos(texto_dividendos)
+            except ValueError as e:
+                warn(str(e))
+                agenda = {}
+            americanos = st.multiselect(
+                "Calls americanas (árvore binomial)",
+                sorted(set(ATIVOS_PADRAO) | set(symbols) | set(agenda)),
+                default=[],
+                help="Calls desses ativos são precificadas com exercício antecipado e os dividendos da agenda; "
+                     "as puts seguem europeias, sobre o spot descontado dos dividendos.",
+            )
+        exercicio = {a: agenda.get(a, []) for a in americanos}
         btn_run = st.button("🌀 Rodar Scanner", type="primary", use_container_width=True)
 
     # ----------------- Título principal -----------------
@@ -815,7 +2636,6 @@ Score próximo de 1 👉 melhor equilíbrio entre risco, liquidez e eficiência.
         """)
 
         fatores = ["IV% (baixa)", "Volume", "Delta (alvo)", "Spread (baixo)"]
-        pesos = [0.40, 0.30, 0.20, 0.10]
 
         fig_score = go.Figure(
             go.Bar(
@@ -830,350 +2650,193 @@ Score próximo de 1 👉 melhor equilíbrio entre risco, liquidez e eficiência.
             template='plotly_dark',
             height=300,
             margin=dict(l=40, r=40, t=20, b=20),
-            xaxis=dict(title="Peso (%)", range=[0, 0.5]),
+            xaxis=dict(title="Peso (%)", range=[0, max(0.5, max(pesos) * 1.2)]),
             yaxis=dict(title=""),
             showlegend=False,
         )
         st.plotly_chart(fig_score, use_container_width=True)
 
     # ----------------- Estado -----------------
-    if "ativos" not in st.session_state:
-        st.session_state["ativos"] = pd.DataFrame()
-    if "opcoes" not in st.session_state:
-        st.session_state["opcoes"] = pd.DataFrame()
-
     if "scanner_primeira_execucao" not in st.session_state:
         st.session_state["scanner_primeira_execucao"] = True
     else:
         st.session_state["scanner_primeira_execucao"] = False
 
+    filtros = dict(
+        tipo_opcao=tipo_opcao if tipo_opcao != "Ambas" else "",
+        venc_ini=venc_ini,
+        venc_fim=venc_fim,
+        delta_min=delta_min,
+        delta_max=delta_max,
+        iv_pct_max=float(iv_pct_max),
+        min_volume_opt=float(min_vol_opt),
+        max_spread_rel=float(max_spread_rel),
+        exigir_vol_acima=bool(exigir_vol_acima),
+        iv_rank_max=float(iv_rank_max),
+        excluir_arbitragem=bool(excluir_arbitragem),
+    )
+
+    # O livro enriquecido fica guardado por (ativos, dias, juros/curva, exercício): mexer só em
+    # filtros, delta alvo, pesos ou top N refiltra e rerankeia o livro em memória.
+    # No mercado inteiro guardam-se só os candidatos já filtrados, então a chave
+    # inclui os filtros.
+    if mercado_inteiro:
+        chave_livro = ("mercado", int(days), float(taxa_juros), _chave_curva(curva), tuple(sorted(filtros.items())),
+                       _chave_exercicio(exercicio), _chave_exercicio(agenda), bool(ranking_exato))
+    else:
+        chave_livro = ("ativos", tuple(symbols), int(days), float(taxa_juros), _chave_curva(curva),
+                       _chave_exercicio(exercicio), _chave_exercicio(agenda))
+    livro = st.session_state.get("scanner_livro")
+    livro_valido = livro is not None and livro["chave"] == chave_livro
+
     # ----------------- Execução principal -----------------
     if btn_run or st.session_state["scanner_primeira_execucao"]:
 
-        if not symbols:
+        if not symbols and not mercado_inteiro:
             err("Selecione ao menos um ativo.")
             return
 
         with st.status("Baixando e preparando dados...", expanded=True) as status:
             try:
-                dfs_at, dfs_op = [], []
-                for sym in symbols:
-                    with st.spinner(f"Baixando dados de {sym}..."):
-                        dfs_at.append(fetch_candles(sym, int(days)))
-                        dfs_op.append(fetch_options_snapshot(sym))
-
-                at = pd.concat(dfs_at, ignore_index=True) if dfs_at else pd.DataFrame()
-                op = pd.concat(dfs_op, ignore_index=True) if dfs_op else pd.DataFrame()
-
-                if at.empty or op.empty:
-                    err("Sem dados suficientes (ativos ou opções).")
-                    return
-
-                ctx = preparar_contexto_ativos(at, ma=20)
-                last_close_map = dict(zip(ctx["underlying_symbol"], ctx["last_close"]))
-
-                book_raw = op.merge(
-                    ctx.rename(columns={"volume_fin":"volume_fin_acao","volfin_ma":"volfin_ma_acao"}),
-                    on="underlying_symbol",
-                    how="left"
-                )
+                spreads = None
+                if mercado_inteiro:
+                    try:
+                        universo_opcoes = obter_universo_opcoes()
+                    except Exception as e:
+                        warn(f"Não foi possível obter o universo de opções ({e}); usando a lista padrão.")
+                        universo_opcoes = ATIVOS_PADRAO
+
+                    barra = st.progress(0.0, text=f"Varrendo {len(universo_opcoes)} ativos...")
+                    candidatos = []
+                    top, at, erros_download = varrer_mercado(
+                        universo_opcoes, int(days), taxa_juros, filtros,
+                        delta_target=delta_target,
+                        exigir_vol_acima=bool(exigir_vol_acima),
+                        top_n=int(top_n),
+                        n_workers=int(n_workers),
+                        progresso=lambda frac, txt: barra.progress(frac, text=txt),
+                        pesos=pesos,
+                        candidatos=candidatos,
+                        compacto=bool(compacto),
+                        exercicio=exercicio,
+                        curva=curva,
+                        dividendos=agenda,
+                        exato=bool(ranking_exato),
+                    )
+                    book = pd.DataFrame()
+                    candidatos = pd.concat(candidatos, ignore_index=True) if candidatos else pd.DataFrame()
+                    st.session_state["scanner_livro"] = {
+                        "chave": chave_livro,
+                        "book": compactar_book(candidatos) if compacto else candidatos,
+                        "at": at,
+                        "visoes": {},
+                        "spreads": {},
+                        "exato": ULTIMO_MERCADO["exato"],
+                    }
+                    if not ULTIMO_MERCADO["exato"]:
+                        st.caption(
+                            f"Ranking da passada única: {ULTIMO_MERCADO['candidatos']:,} candidatos guardados "
+                            f"({FATOR_BUFFER}× o top N por vencimento), repontuados no fim — pode diferir do "
+                            "ranking exato do mercado inteiro."
+                        )
+                    if erros_download:
+                        warn(f"{len(erros_download)} ativo(s) sem dados na varredura: "
+                             + ", ".join(sorted(erros_download)[:20]))
+                    if travas:
+                        st.info("Travas verticais só com ativos selecionados: no mercado inteiro "
+                                "guardam-se apenas os candidatos já filtrados por delta e IV.")
+                else:
+                    with st.spinner(f"Baixando dados de {len(symbols)} ativo(s)..."):
+                        at, op, erros_download = baixar_dados_scanner(symbols, int(days))
+                    for sym, msg in erros_download.items():
+                        warn(f"{sym}: {msg}")
+
+                    if at.empty or op.empty:
+                        err("Sem dados suficientes (ativos ou opções).")
+                        return
+
+                    ctx = preparar_contexto_ativos(at, ma=20)
+                    last_close_map = dict(zip(ctx["underlying_symbol"], ctx["last_close"]))
+
+                    book_raw = op.merge(
+                        ctx.rename(columns={"volume_fin":"volume_fin_acao","volfin_ma":"volfin_ma_acao"}),
+                        on="underlying_symbol",
+                        how="left"
+                    )
 
-                book = add_features_and_iv(book_raw, price_lookup=last_close_map, r_annual=taxa_juros)
-
-                flt = aplicar_filtros(
-                    book,
-                    tipo_opcao=tipo_opcao if tipo_opcao != "Ambas" else "",
-                    venc_ini=venc_ini,
-                    venc_fim=venc_fim,
-                    delta_min=delta_min,
-                    delta_max=delta_max,
-                    iv_pct_max=float(iv_pct_max),
-                    min_volume_opt=float(min_vol_opt),
-                    max_spread_rel=float(max_spread_rel),
-                    exigir_vol_acima=bool(exigir_vol_acima)
-                )
+                    book = add_features_and_iv(
+                        book_raw, price_lookup=last_close_map, r_annual=taxa_juros,
+                        incremental=True, n_workers=int(n_workers), compacto=bool(compacto),
+                        exercicio=exercicio, curva=curva, dividendos=agenda,
+                    )
+                    livro = {"chave": chave_livro, "book": book, "at": at, "visoes": {}, "spreads": {}}
+                    st.session_state["scanner_livro"] = livro
 
-                ranked = rankear(flt, delta_target=delta_target, exigir_vol_acima=exigir_vol_acima)
-                top = top_por_venc(ranked, n=int(top_n))
+                    top = visao_filtrada(book, filtros, delta_target, int(top_n), pesos, cache=livro["visoes"])
+                    if travas:
+                        spreads = visao_spreads(book, filtros, int(top_n), largura_trava, cache=livro["spreads"])
 
                 status.update(label="Concluído", state="complete")
 
-                st.subheader("🏆 Top Oportunidades por Vencimento 💎")
-
-                if top.empty:
-                    warn("Nenhuma oportunidade encontrada com os critérios atuais. Afrouxe IV %, delta ou spread.")
-                else:
-                    top = top.sort_values("score", ascending=False).reset_index(drop=True)
-                    top["expiration"] = pd.to_datetime(top["expiration"], errors="coerce").dt.date
-                    num_cols = top.select_dtypes(include=["float", "float64", "int", "int64"]).columns
-                    top[num_cols] = top[num_cols].apply(lambda x: np.round(x, 2))
-
-                    cols = ["score"] + [c for c in top.columns if c != "score"]
-
-                    num_cards = min(int(top_n), 10)
-                    top5 = top.head(num_cards).copy()
-                    st.session_state["top5"] = top5
-
-                    def get_card_gradient(score, tipo):
-                        s = float(score)
-                        if tipo == "CALL":
-                            start, end = "#004d00", "#66ff66"
-                        else:
-                            start, end = "#7f0000", "#ff6666"
-                        return f"linear-gradient(135deg, {start} {(s*100):.0f}%, {end})"
-
-                    card_html = ""
-                    for _, row in top5.iterrows():
-                        grad = get_card_gradient(row["score"], row["type"])
-                        delta_color = "lime" if row["type"] == "CALL" else "salmon"
-                        card_html += f"""
-                        <div class="card" style="background-image: {grad};">
-                            <div class="symbol">{row['symbol']} ({row['type']})</div>
-                            <div class="score-label">Score</div>
-                            <div class="score">{row['score']:.2f}</div>
-                            <div class="details">Strike {row['strike']:.2f} • Venc. {row['expiration']}</div>
-                            <div class="delta-line">
-                                <span style='color:{delta_color}; font-weight:600;'>Δ {row['delta']:.2f}</span>
-                            </div>
-                        </div>
-                        """
-
-                    st.markdown(
-                        f"""
-                        <style>
-                        .card {{
-                            display: inline-block;
-                            border-radius: 16px;
-                            padding: 16px 18px;
-                            margin: 8px;
-                            box-shadow: 0 2px 6px rgba(0,0,0,0.4);
-                            color: white;
-                            transition: all 0.25s ease;
-                            width: 16.5%;
-                            text-align: center;
-                            min-height: 180px;
-                        }}
-                        .card:hover {{
-                            transform: translateY(-4px) scale(1.03);
-                            box-shadow: 0 6px 14px rgba(0,0,0,0.6);
-                            cursor: pointer;
-                        }}
-                        .symbol {{
-                            font-weight: 600;
-                            font-size: 1rem;
-                            margin-bottom: 6px;
-                        }}
-                        .score-label {{
-                            font-size: 0.8rem;
-                            color: rgba(255,255,255,0.9);
-                            text-transform: uppercase;
-                            letter-spacing: 0.5px;
-                        }}
-                        .score {{
-                            font-size: 1.8rem;
-                            font-weight: 700;
-                            margin-bottom: 6px;
-                            color: #fff;
-                            text-shadow: 0 0 10px rgba(255,255,255,0.5);
-                        }}
-                        .details {{
-                            font-size: 0.85rem;
-                            color: rgba(255,255,255,0.85);
-                        }}
-                        .delta-line {{
-                            margin-top: 4px;
-                        }}
-                        @media (max-width: 1800px) {{
-                            .card {{ width: 17%; }}
-                        }}
-                        @media (max-width: 1300px) {{
-                            .card {{ width: 22%; }}
-                        }}
-                        @media (max-width: 1000px) {{
-                            .card {{ width: 45%; }}
-                        }}
-                        @media (max-width: 600px) {{
-                            .card {{
-                                width: 90%;
-                                padding: 14px 16px;
-                            }}
-                            .symbol {{ font-size: 0.95rem; }}
-                            .score-label {{ font-size: 0.7rem; }}
-                            .score {{ font-size: 1.5rem; }}
-                            .details {{ font-size: 0.8rem; }}
-                        }}
-                        @media (max-width: 400px) {{
-                            .card {{
-                                width: 95%;
-                                padding: 12px 14px;
-                            }}
-                            .symbol {{ font-size: 0.9rem; }}
-                            .score {{ font-size: 1.3rem; }}
-                            .details {{ font-size: 0.75rem; }}
-                        }}
-                        .cards-container {{
-                            display: flex;
-                            flex-wrap: wrap;
-                            justify-content: center;
-                            align-items: stretch;
-                            gap: 10px;
-                        }}
-                        </style>
-                        <div class="cards-container">
-                            {card_html}
-                        </div>
-                        """,
-                        unsafe_allow_html=True
-                    )
-
-                    st.markdown("---")
-
-                    def score_color(val, tipo):
-                        if pd.isna(val):
-                            return ""
-                        s = float(val)
-                        s = max(0, min(s, 1))
-                        if tipo == "CALL":
-                            dark = np.array([0, 77, 0])
-                            light = np.array([102, 255, 102])
-                        else:
-                            dark = np.array([127, 0, 0])
-                            light = np.array([255, 102, 102])
-                        rgb = (dark * s + light * (1 - s)).astype(int)
-                        color = f"rgb({rgb[0]},{rgb[1]},{rgb[2]})"
-                        return f"background-color: {color}; color: black; font-weight: 700;"
-
-                    financial_cols = [
-                        c for c in top.columns if any(k in c.lower() for k in ["price", "premium", "strike", "ref_", "volfin", "volume"])
-                    ]
-                    fmt = {}
-                    for c in top.columns:
-                        if c in financial_cols:
-                            fmt[c] = "R$ {:,.2f}".format
-                        elif top[c].dtype.kind in "fi":
-                            fmt[c] = "{:.2f}".format
-
-                    styled_df = (
-                        top[cols]
-                        .style
-                        .format(fmt)
-                        .apply(
-                            lambda r: [score_color(r["score"], r["type"])] + ["" for _ in range(len(r) - 1)],
-                            axis=1
-                        )
+                cache_iv = IV_CACHE.stats()
+                st.caption(
+                    f"Cache de IV: {cache_iv['ultima_hit_ratio']:.0%} de acerto nesta varredura "
+                    f"({cache_iv['ultima_reusos']} contratos sem mudança reaproveitados) • "
+                    f"{cache_iv['hit_ratio']:.0%} acumulado em {cache_iv['tamanho']} contratos. "
+                    f"Incremental: {ULTIMO_INCREMENTAL['recalculadas']}/{ULTIMO_INCREMENTAL['linhas']} linhas e "
+                    f"{ULTIMO_INCREMENTAL['grupos_recalculados']}/{ULTIMO_INCREMENTAL['grupos']} vencimentos recalculados."
+                )
+                livro_mem = st.session_state["scanner_livro"]["book"]
+                if not livro_mem.empty:
+                    st.caption(
+                        f"Livro em memória: {len(livro_mem):,} contratos, "
+                        f"{memoria_por_contrato(livro_mem):,.0f} B/contrato "
+                        f"({livro_mem.memory_usage(deep=True).sum() / 2**20:,.1f} MiB)."
                     )
-
-                    st.dataframe(
-                        styled_df,
-                        use_container_width=True,
-                        hide_index=True
+                if not book.empty and "arb_flags" in book.columns:
+                    marcados = contar_flags(book["arb_flags"])
+                    st.caption(
+                        f"Não-arbitragem: {int((book['arb_flags'] != 0).sum()):,} contrato(s) marcados — "
+                        + ", ".join(f"{nome} {n}" for nome, n in marcados.items())
+                        + (" (fora do ranking)." if excluir_arbitragem else " (mantidos no ranking).")
                     )
 
-                # Gráficos de candles
-                st.markdown("---")
-                st.subheader("📈 Candles (últimos dias) — OHLCV")
-                st.caption("Volume abaixo é financeiro (Close × Volume) com MM20 branca.")
-
-                if at.empty:
-                    warn("Candles indisponíveis.")
-                else:
-                    for sym in sorted(set(at["underlying_symbol"])):
-                        d = at[at["underlying_symbol"] == sym].sort_values("date").tail(180)
-                        if d.empty:
-                            continue
-
-                        d["vol_fin"] = _to_num(d["close"]) * _to_num(d["volume"])
-                        d["volfin_ma20"] = d["vol_fin"].rolling(20, min_periods=1).mean()
-
-                        fig = go.Figure()
-                        fig.add_trace(go.Candlestick(
-                            x=d["date"],
-                            open=d["open"],
-                            high=d["high"],
-                            low=d["low"],
-                            close=d["close"],
-                            name=f"{sym} OHLC",
-                            increasing_line_color="lime",
-                            decreasing_line_color="red",
-                            yaxis="y1"
-                        ))
-                        fig.add_trace(go.Bar(
-                            x=d["date"],
-                            y=d["vol_fin"],
-                            name="Volume financeiro",
-                            yaxis="y2",
-                            opacity=0.6
-                        ))
-                        fig.add_trace(go.Scatter(
-                            x=d["date"],
-                            y=d["volfin_ma20"],
-                            name="MM20 Vol (R$)",
-                            mode="lines",
-                            line=dict(width=1.5),
-                            yaxis="y2"
-                        ))
-
-                        fig.update_layout(
-                            title=f"{sym}",
-                            height=550,
-                            template="plotly_dark",
-                            xaxis=dict(
-                                domain=[0.0, 1.0],
-                                rangeslider=dict(visible=False),
-                                showline=True,
-                                linecolor="#555",
-                                mirror=True
-                            ),
-                            yaxis=dict(
-                                title="Preço",
-                                domain=[0.35, 1.0],
-                                side="left",
-                                showgrid=True
-                            ),
-                            yaxis2=dict(
-                                title="Volume (R$)",
-                                domain=[0.0, 0.30],
-                                showgrid=False
-                            ),
-                            legend=dict(
-                                orientation="h",
-                                yanchor="bottom",
-                                y=1.02,
-                                xanchor="right",
-                                x=1
-                            ),
-                            margin=dict(l=40, r=40, t=50, b=20)
-                        )
-                        st.plotly_chart(fig, use_container_width=True)
-
-                with st.expander("📦 Dados brutos (opcional)"):
-                    st.caption("Ativos (OHLCV)")
-                    st.dataframe(at, use_container_width=True, hide_index=True)
-
-                    st.caption("Opções (processadas com IV/greeks)")
-                    show_cols = [
-                        "symbol","underlying_symbol","type","expiration","strike",
-                        "bid","ask","last","close","premium_used",
-                        "ref_price","T","dte_bus",
-                        "iv_local_pct","iv_pct_local",
-                        "delta","gamma","vega","theta","rho",
-                        "volume","open_interest","spread","spread_rel",
-                        "vol_acima_ma","score"
-                    ]
-                    show_cols = [c for c in show_cols if c in book.columns]
-                    st.dataframe(book[show_cols], use_container_width=True, hide_index=True)
+                _render_resultados(top, at, book, int(top_n), float(taxa_juros), curva, spreads)
 
             except Exception as e:
                 status.update(label="Erro no processamento", state="error")
                 err(str(e))
 
+    elif livro_valido:
+        try:
+            t0 = time.perf_counter()
+            top = visao_filtrada(livro["book"], filtros, delta_target, int(top_n), pesos, cache=livro["visoes"])
+            st.caption(
+                f"Visão refiltrada do livro em memória em {(time.perf_counter() - t0) * 1000:.0f} ms "
+                f"— clique em Rodar Scanner para baixar dados novos."
+                + ("" if livro.get("exato", True) else " No mercado inteiro, só sobre os candidatos guardados.")
+            )
+            book = pd.DataFrame() if mercado_inteiro else livro["book"]
+            spreads = None
+            if travas and not mercado_inteiro:
+                spreads = visao_spreads(book, filtros, int(top_n), largura_trava, cache=livro["spreads"])
+            _render_resultados(top, livro["at"], book, int(top_n), float(taxa_juros), curva, spreads)
+        except Exception as e:
+            err(str(e))
+
+    elif livro is not None:
+        if mercado_inteiro:
+            st.info("Histórico, juros ou filtros mudaram — clique em Rodar Scanner para varrer o mercado de novo.")
+        else:
+            st.info("Ativos, histórico ou juros mudaram — clique em Rodar Scanner para recalcular o livro.")
+
     # ===================== Envio de operações =====================
     st.markdown("### 📩 Enviar operações para o Supabase")
     top5 = st.session_state.get("top5", pd.DataFrame())
 
     required_cols = [
         "symbol","type","strike","expiration","underlying_symbol",
-        "last","mid","close"
+        "last","close"
     ]
 
     missing = [c for c in required_cols if c not in top5.columns]
@@ -1217,10 +2880,22 @@ Score próximo de 1 👉 melhor equilíbrio entre risco, liquidez e eficiência.
                     "retorno_atual_pct": 0,
                     "created_at": datetime.utcnow().isoformat(),
                     "updated_at": datetime.utcnow().isoformat(),
+                    # fatores do score na entrada, para core/otimizador_score.py
+                    COLUNA_FATORES: fatores_entrada(
+                        row.to_dict(), delta_target, pesos, bonus_ativo=bool(exigir_vol_acima)
+                    ),
                 }
 
                 try:
-                    op_id = inserir_operacao(nova_op)
+                    try:
+                        op_id = inserir_operacao(nova_op)
+                    except requests.HTTPError as e:
+                        # tabela ainda sem a coluna jsonb: grava a operação sem os fatores
+                        if e.response is None or COLUNA_FATORES not in e.response.text:
+                            raise
+                        nova_op.pop(COLUNA_FATORES)
+                        op_id = inserir_operacao(nova_op)
+                        warn(f"Fatores de entrada não registrados: falta a coluna {COLUNA_FATORES} na tabela opcoes.")
 
                     msg_telegram = (
                         "💥 <b>NOVA OPERAÇÃO — SCANNER FÊNIX</b>\n\n"
@@ -0,0 +1,60 @@
+# job_historico_iv.py
+# ================================================
+# Job diário do histórico de IV ATM e vol realizada (core.historico_iv)
+# Projeto Phoenix
+# ================================================
+#
+# Uso (depois do fechamento):
+#   python job_historico_iv.py [ATIVO ...] [--mercado] [--juros 14.9]
+# Baixa e enriquece as cadeias com o pipeline do scanner
+# (dashboards.scanner_opcoes), então precisa das mesmas variáveis de
+# ambiente do app (SUPABASE_URL, SUPABASE_KEY, ...). O core não importa o dashboard.
+
+import argparse
+from datetime import date
+
+import dashboards.scanner_opcoes as so
+from core.calendario_b3 import eh_dia_util
+from core.curva_di import carregar_curva
+from core.historico_iv import iv_atm_constante, registrar, volatilidade_realizada
+from core.utils import data_dir
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Grava IV ATM e vol realizada do dia no histórico local.")
+    ap.add_argument("ativos", nargs="*", help="ativos (padrão: lista padrão do scanner)")
+    ap.add_argument("--mercado", action="store_true", help="todos os ativos com opções listadas")
+    ap.add_argument("--juros", type=float, default=14.90, help="taxa de juros anual (%%), sem curva DI gravada")
+    ap.add_argument("--lote", type=int, default=25)
+    ap.add_argument("--forcar", action="store_true", help="grava mesmo fora de dia de pregão")
+    args = ap.parse_args()
+
+    hoje = date.today()
+    if not args.forcar and not eh_dia_util(hoje)[0]:
+        print(f"{hoje} não é dia de pregão na B3; nada gravado.")
+        return
+
+    ativos = [a.upper() for a in args.ativos] or (so.obter_universo_opcoes() if args.mercado else so.ATIVOS_PADRAO)
+    curva = carregar_curva()
+    gravados = 0
+    for i in range(0, len(ativos), args.lote):
+        lote = ativos[i:i + args.lote]
+        at, op, erros = so.baixar_dados_scanner(lote, 60)
+        for sym, msg in erros.items():
+            print(f"{sym}: {msg}")
+        if at.empty or op.empty:
+            continue
+        ctx = so.preparar_contexto_ativos(at, ma=20)
+        book = so.add_features_and_iv(
+            op, price_lookup=dict(zip(ctx["underlying_symbol"], ctx["last_close"])), r_annual=args.juros / 100,
+            curva=curva,
+        )
+        iv = iv_atm_constante(so.resumo_superficie(book))
+        hv = volatilidade_realizada(at).reindex(iv.index.union(ctx["underlying_symbol"]))
+        iv = iv.reindex(hv.index)
+        gravados += registrar(hv.index, hoje, iv.to_numpy(), hv.to_numpy())
+    print(f"{gravados} ativo(s) gravados em {data_dir() / 'historico_iv'} para {hoje}.")
+
+
+if __name__ == "__main__":
+    main()